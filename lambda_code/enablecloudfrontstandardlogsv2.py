@@ -1,3 +1,4 @@
+from fallprofiler import profiled
 import boto3
 import os
 import json
@@ -6,6 +7,12 @@ import re
 import urllib3
 import urllib.request
 from botocore.exceptions import ClientError
+from fallratelimiter import acquire, rate_limited, RateLimitDeferred
+from falleventclassifier import classify_event, EXCLUDED, PROCESS
+from fallinventory import DeliveryInventory
+from fallevent import parse_event, log_event, InvalidEvent
+from fallarchive import configure_replication, check_archive
+from fallpreflight import require, check_kms_key
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -17,36 +24,62 @@ logs = boto3.client('logs', region_name='us-east-1')
 elbv2 = boto3.client('elbv2')
 cloudfront = boto3.client('cloudfront')
 
+# Delivery Sources, Destinations and Deliveries of the account, loaded once per container and updated with the CloudWatch Logs delivery events.
+
+deliveries = DeliveryInventory(logs)
+
 # Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
 
 KMS_KEY_ARN = os.environ['KMS_KEY_ARN']                     # Used to encrypt the S3 Bucket where our CloudFront logs will be stored.
 TRANSITION_IN_DAYS = int(os.environ['TRANSITION_IN_DAYS'])  # Used in the Lifecycle Rule of the S3 Bucket.
 STORAGE_CLASS = os.environ['STORAGE_CLASS']                 # S3 Storage Class used to send the logs after the days defined in TRANSITION_IN_DAYS variable.
 EXPIRATION_IN_DAYS = int(os.environ['EXPIRATION_IN_DAYS'])  # Used to define when the log files will be deleted from our S3 Bucket
+NONCURRENT_EXPIRATION_IN_DAYS = int(os.environ.get('NONCURRENT_EXPIRATION_IN_DAYS', '1'))  # Days the noncurrent versions (e.g. the originals purged after the compaction) are kept in the versioned buckets.
+COMPACTED_PREFIX = os.environ.get('COMPACTED_PREFIX', 'compacted/')                    # Prefix where the compaction job stores the merged log objects, only these objects are transitioned.
+MIN_TRANSITION_SIZE_BYTES = int(os.environ.get('MIN_TRANSITION_SIZE_BYTES', '131072'))  # Objects smaller than this value are never transitioned to STORAGE_CLASS.
 WEBHOOK_GOOGLE_CHAT = os.environ.get("WEBHOOK_GOOGLE_CHAT") # Used to forward our notification status to a Google Chat Space.
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'json')                                  # Format of the log files delivered to S3 (json, parquet, plain or w3c).
+HIVE_COMPATIBLE_PATH = os.environ.get('HIVE_COMPATIBLE_PATH', 'false').lower() == 'true'  # Use key=value folders so Athena/Glue detect the partitions.
+SUFFIX_PATH = os.environ.get('SUFFIX_PATH', '')                                          # Folders added after AWSLogs/{account}/CloudFront/, e.g. {DistributionId}/{yyyy}/{MM}/{dd}/{HH}
+RECORD_FIELDS = [field.strip() for field in os.environ.get('RECORD_FIELDS', '').split(',') if field.strip()]  # Fields included in each record, empty means all of them.
 
 http = urllib3.PoolManager()
 
 """
 Principal function or entry point to start the execution of Lambda where first of all we extract the DistributionId
-We validate the presence of the ExcludeLogging tag, define the S3 Bucket Name for our CloudFront logs, Validate if 
-the Distribution ID has already logging enabled by the User to skip the creation of the bucket and avoid an unnecessary 
-error message, in case of everything is OK, we create the bucket with the security best practicas and then enable CloudFront
+We validate the presence of the ExcludeLogging tag, define the S3 Bucket Name for our CloudFront logs, Validate using the
+delivery inventory if the Distribution ID has already logging enabled by the User to skip the creation of the bucket and avoid
+an unnecessary error message, in case of everything is OK, we create the bucket with the security best practicas and then enable CloudFront
 Logging using Delivery Source, Destination and send the notification to administrators via Webhook.
 """
 
+@profiled
+@rate_limited
 def lambda_handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
-    distribution_id = ""
+    try:
+        record = parse_event(event)
+    except InvalidEvent as e:
+        logger.error(f"Invalid CloudTrail Event: {e}")
+        log_event(event)
+        return {"status": "invalid-event"}
+    log_event(event, record)
+
+    if deliveries.apply_event(record):
+        return {"status": "inventory-updated"}
+
+    distribution_id = record.resource_id or ""
     account_id = ""
     bucket_name = ""
-    principal_arn = event['detail'].get('userIdentity', {}).get('arn', 'Unknown')
+    principal_arn = record.principal
 
     try:
-        distribution_id = event['detail']['responseElements']['distribution']['id']
         account_id = sts.get_caller_identity()["Account"]
 
-        if is_excluded(distribution_id):
+        classification = classify_event(record, lambda: get_distribution_tags(distribution_id, account_id))
+        if classification not in (PROCESS, EXCLUDED):
+            return {"status": classification}
+
+        if classification == EXCLUDED:
             logger.info(f"Exclusion tag found for distribution {distribution_id}, skipping log configuration.")
             send_chat_card(
                 distribution_id=distribution_id,
@@ -64,42 +97,53 @@ def lambda_handler(event, context):
         dest_name = f"CF-{distribution_id}-{safe_name}"
         source_name = f"CreatedByCloudFront-{distribution_id}"
         resource_arn = f'arn:aws:cloudfront::{account_id}:distribution/{distribution_id}'
+        destination_arn = f'arn:aws:logs:us-east-1:{account_id}:delivery-destination:{dest_name}'
 
-        try:
-            logs.put_delivery_source(
-                name=dest_name,
-                resourceArn=resource_arn,
-                logType='ACCESS_LOGS'
-            )
-        except logs.exceptions.ConflictException:
-            logger.info(f"Standard Logging v2 already enabled by the user for the Distribution: {distribution_id}")
-            send_chat_card(
-                distribution_id=distribution_id,
-                account_id=account_id,
-                bucket_name="(N/A)",
-                success=True,
-                already_enabled=True,
-                principal_arn=principal_arn
-            )
-            return {"status": "already-enabled"}
+        # A Delivery Source with our name but without Delivery means a previous execution was interrupted, in that case we resume it.
+
+        existing_source, has_delivery = deliveries.source_of(resource_arn, expected_name=dest_name)
+        if has_delivery or (existing_source and existing_source != dest_name):
+            return already_enabled(distribution_id, account_id, principal_arn)
+
+        # Pre-flight validation (cached per container), a bad KMS Key fails here instead of leaving a Delivery Source without bucket.
+
+        require(check_kms_key(KMS_KEY_ARN, region), *check_archive(kms_encrypted=True))
+
+        if existing_source is None:
+            try:
+                acquire('logs:PutDeliverySource', region='us-east-1')
+                logs.put_delivery_source(
+                    name=dest_name,
+                    resourceArn=resource_arn,
+                    logType='ACCESS_LOGS'
+                )
+                deliveries.record_source(dest_name, resource_arn)
+            except logs.exceptions.ConflictException:
+                return already_enabled(distribution_id, account_id, principal_arn)
 
         if not bucket_exists(bucket_name):
             create_logging_bucket(bucket_name)
 
         apply_bucket_policy(bucket_name, account_id, source_name)
 
-        logs.put_delivery_destination(
-            name=dest_name,
-            outputFormat='json',
-            deliveryDestinationConfiguration={
-                'destinationResourceArn': f'arn:aws:s3:::{bucket_name}'
-            }
-        )
+        if dest_name not in deliveries.destinations:
+            acquire('logs:PutDeliveryDestination', defer=False, region='us-east-1')
+            logs.put_delivery_destination(
+                name=dest_name,
+                outputFormat=OUTPUT_FORMAT,
+                deliveryDestinationConfiguration={
+                    'destinationResourceArn': f'arn:aws:s3:::{bucket_name}'
+                }
+            )
+            deliveries.record_destination(dest_name, destination_arn)
 
-        logs.create_delivery(
+        acquire('logs:CreateDelivery', defer=False, region='us-east-1')
+        delivery = logs.create_delivery(
             deliverySourceName=dest_name,
-            deliveryDestinationArn=f'arn:aws:logs:us-east-1:{account_id}:delivery-destination:{dest_name}'
+            deliveryDestinationArn=destination_arn,
+            **delivery_options()
         )
+        deliveries.record_delivery(delivery['delivery'])
 
         send_chat_card(
             distribution_id=distribution_id,
@@ -111,6 +155,9 @@ def lambda_handler(event, context):
 
         return {"status": "success"}
 
+    except RateLimitDeferred as e:
+        logger.warning(f"Deferring Standard Logging v2 configuration for the Distribution {distribution_id}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error: {e}")
         send_chat_card(
@@ -129,22 +176,34 @@ For example all evaluation logic or conditionals evaluated to avoid the creation
 """
 
 
-# Here we defined the evaluation logic to determine if the created resource has the Tag/Value ExcludeLogging set in True,
-# if this is the case we skipped the enabling logging process.
+# Here we retrieve the tags of the Distribution when the CloudTrail Event does not include them, they are used to determine
+# if the created resource has the Tag/Value ExcludeLogging set in True, if this is the case we skipped the enabling logging process.
 
 
-def is_excluded(distribution_id):
+def get_distribution_tags(distribution_id, account_id):
     try:
         response = cloudfront.list_tags_for_resource(
-            Resource=f'arn:aws:cloudfront::{sts.get_caller_identity()["Account"]}:distribution/{distribution_id}'
+            Resource=f'arn:aws:cloudfront::{account_id}:distribution/{distribution_id}'
         )
         tags = response.get("Tags", {}).get("Items", [])
-        for tag in tags:
-            if tag.get("Key") == "ExcludeLogging" and tag.get("Value", "").lower() == "true":
-                return True
+        return {tag.get("Key", "").lower(): tag.get("Value", "").lower() for tag in tags}
     except Exception as e:
         logger.warning(f"Unable to get tags for distribution {distribution_id}: {e}")
-    return False
+    return {}
+
+# This function notifies that the Distribution already had Standard Logging v2 enabled (by the user or a previous execution).
+
+def already_enabled(distribution_id, account_id, principal_arn):
+    logger.info(f"Standard Logging v2 already enabled by the user for the Distribution: {distribution_id}")
+    send_chat_card(
+        distribution_id=distribution_id,
+        account_id=account_id,
+        bucket_name="(N/A)",
+        success=True,
+        already_enabled=True,
+        principal_arn=principal_arn
+    )
+    return {"status": "already-enabled"}
 
 # This is used to sanitize the name because this value will be used as part of the S3 Bucket name created to store the log files.
 
@@ -162,9 +221,11 @@ def bucket_exists(bucket_name):
             return False
         raise
 
-# Here we create the bucket after successfully passed all the previous conditionals
+# Here we create the bucket after successfully passed all the previous conditionals, in the Lifecycle Rule only the objects
+# merged by the compaction job (tools/compactlogobjects.py) are transitioned, the small original objects just expire.
 
 def create_logging_bucket(bucket_name):
+    acquire('s3:CreateBucket', defer=False)
     if region == 'us-east-1':
         s3.create_bucket(Bucket=bucket_name)
     else:
@@ -173,6 +234,7 @@ def create_logging_bucket(bucket_name):
             CreateBucketConfiguration={'LocationConstraint': region}
         )
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_public_access_block(
         Bucket=bucket_name,
         PublicAccessBlockConfiguration={
@@ -183,6 +245,7 @@ def create_logging_bucket(bucket_name):
         }
     )
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_encryption(
         Bucket=bucket_name,
         ServerSideEncryptionConfiguration={
@@ -195,22 +258,56 @@ def create_logging_bucket(bucket_name):
         }
     )
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_lifecycle_configuration(
         Bucket=bucket_name,
         LifecycleConfiguration={
             'Rules': [{
                 'ID': 'LifecycleRuleArchivingAndExpiration',
-                'Filter': {'Prefix': ''},
+                'Filter': {
+                    'And': {
+                        'Prefix': COMPACTED_PREFIX,
+                        'ObjectSizeGreaterThan': MIN_TRANSITION_SIZE_BYTES
+                    }
+                },
                 'Status': 'Enabled',
                 'Transitions': [{
                     'Days': TRANSITION_IN_DAYS,
                     'StorageClass': STORAGE_CLASS
                 }],
-                'Expiration': {'Days': EXPIRATION_IN_DAYS}
+                'Expiration': {'Days': EXPIRATION_IN_DAYS},
+                'NoncurrentVersionExpiration': {'NoncurrentDays': NONCURRENT_EXPIRATION_IN_DAYS}
+            },
+            {
+                'ID': 'LifecycleRuleExpiration',
+                'Filter': {'Prefix': ''},
+                'Status': 'Enabled',
+                'Expiration': {'Days': EXPIRATION_IN_DAYS},
+                'NoncurrentVersionExpiration': {'NoncurrentDays': NONCURRENT_EXPIRATION_IN_DAYS}
             }]
         }
     )
 
+    # When the central log archive is configured, the new bucket is replicated to it.
+
+    configure_replication(s3, bucket_name, kms_encrypted=True)
+
+# This function returns the optional parameters of the Delivery, the layout of the objects (suffixPath and Hive compatible
+# folders) and the fields of each record. The Athena table that matches them is generated by tools/cloudfronttabledefinition.py
+
+def delivery_options():
+    options = {}
+    s3_configuration = {}
+    if SUFFIX_PATH:
+        s3_configuration['suffixPath'] = SUFFIX_PATH
+    if HIVE_COMPATIBLE_PATH:
+        s3_configuration['enableHiveCompatiblePath'] = True
+    if s3_configuration:
+        options['s3DeliveryConfiguration'] = s3_configuration
+    if RECORD_FIELDS:
+        options['recordFields'] = RECORD_FIELDS
+    return options
+
 # This function just put the bucket policy that CloudFront Service needs to be able to store logs in an S3 Bucket
 
 def apply_bucket_policy(bucket_name, account_id, source_name):
@@ -224,7 +321,10 @@ def apply_bucket_policy(bucket_name, account_id, source_name):
                     "Service": "delivery.logs.amazonaws.com"
                 },
                 "Action": "s3:PutObject",
-                "Resource": f"arn:aws:s3:::{bucket_name}/AWSLogs/{account_id}/CloudFront/*",
+                "Resource": [
+                    f"arn:aws:s3:::{bucket_name}/AWSLogs/{account_id}/CloudFront/*",
+                    f"arn:aws:s3:::{bucket_name}/AWSLogs/aws-account-id={account_id}/CloudFront/*"
+                ],
                 "Condition": {
                     "StringEquals": {
                         "s3:x-amz-acl": "bucket-owner-full-control",
@@ -238,6 +338,7 @@ def apply_bucket_policy(bucket_name, account_id, source_name):
         ]
     }
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_policy(
         Bucket=bucket_name,
         Policy=json.dumps(policy)
@@ -1,9 +1,15 @@
+from fallprofiler import profiled
 import boto3
 import os
 import json
 import logging
 import urllib.request
 from botocore.exceptions import ClientError
+from fallratelimiter import acquire, rate_limited, RateLimitDeferred
+from falleventclassifier import classify_event, tags_to_dict, EXCLUDED, PROCESS
+from fallevent import parse_event, log_event, InvalidEvent
+from fallarchive import configure_replication, check_archive
+from fallpreflight import require, check_kms_key, check_region
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -26,56 +32,67 @@ KMS_KEY_ARN = os.environ.get('KMS_KEY_ARN')                 # Used to encrypt th
 TRANSITION_IN_DAYS = int(os.environ['TRANSITION_IN_DAYS'])  # Used in the Lifecycle Rule of the S3 Bucket.
 STORAGE_CLASS = os.environ['STORAGE_CLASS']                 # S3 Storage Class used to send the logs after the days defined in TRANSITION_IN_DAYS variable.
 EXPIRATION_IN_DAYS = int(os.environ['EXPIRATION_IN_DAYS'])  # Used to define when the log files will be deleted from our S3 Bucket
+NONCURRENT_EXPIRATION_IN_DAYS = int(os.environ.get('NONCURRENT_EXPIRATION_IN_DAYS', '1'))  # Days the noncurrent versions (e.g. the originals purged after the compaction) are kept in the versioned buckets.
+COMPACTED_PREFIX = os.environ.get('COMPACTED_PREFIX', 'compacted/')                    # Prefix where the compaction job stores the merged log objects, only these objects are transitioned.
+MIN_TRANSITION_SIZE_BYTES = int(os.environ.get('MIN_TRANSITION_SIZE_BYTES', '131072'))  # Objects smaller than this value are never transitioned to STORAGE_CLASS.
 WEBHOOK_GOOGLE_CHAT = os.environ.get("WEBHOOK_GOOGLE_CHAT") # Used to forward our notification status to a Google Chat Space.
 
 """
 Principal function or entry point to start the execution of Lambda where first of all we extract the Elastic Load Balancer Name
-We validate the presence of the ExcludeLogging tag, we determine what type of ELB the user created because depend on that we need to
+We validate the presence of the ExcludeLogging tag (using the tags included in the CloudTrail Event when possible), we determine what type of ELB the user created because depend on that we need to
 execute different configurations in the S3 Bucket which will store the Access Logs. Also we perform some evaluation to validate if the ELB
 Previously exists and the corresponding S3 Bucket still exists and reuse it, if not, we create the bucket aligned with AWS Security Best Practices
 and send a Google Chat Notification.
 """
 
+@profiled
+@rate_limited
 def lambda_handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
+    try:
+        record = parse_event(event)
+    except InvalidEvent as e:
+        logger.error(f"Invalid CloudTrail Event: {e}")
+        log_event(event)
+        return {"status": "invalid-event"}
+    log_event(event, record)
+
+    region = record.region
+    lb_arn = record.resource_id
 
-    detail = event['detail']
-    region = event['region']
-    lb_arn = detail['responseElements']['loadBalancers'][0]['loadBalancerArn']
+    classification = classify_event(record, lambda: get_lb_tags(lb_arn))
+    if classification not in (PROCESS, EXCLUDED):
+        return {"status": classification}
 
     lb_description = elbv2.describe_load_balancers(LoadBalancerArns=[lb_arn])['LoadBalancers'][0]
     lb_type = lb_description['Type']
     lb_name = lb_description['LoadBalancerName']
 
-    tags = elbv2.describe_tags(ResourceArns=[lb_arn])['TagDescriptions'][0]['Tags']
-    tag_dict = {tag['Key']: tag['Value'] for tag in tags}
-    exclude_logging = tag_dict.get("ExcludeLogging", "").lower() == "true"
-
-    if exclude_logging:
+    if classification == EXCLUDED:
         account_id = sts.get_caller_identity()['Account']
-        principal_arn = event['detail'].get('userIdentity', {}).get('principalId', 'Unknown')
-        send_skip_notification(lb_name, lb_type, region, account_id, principal_arn, lb_arn)
+        send_skip_notification(lb_name, lb_type, region, account_id, record.principal, lb_arn)
         logger.info(f"Skipping logging configuration for {lb_name} due to ExcludeLogging tag")
-        return
+        return {"status": "excluded"}
 
     if lb_type == 'application':
-        handle_application_lb(lb_arn, lb_name, region, event)
+        return handle_application_lb(lb_arn, lb_name, region, record)
     elif lb_type == 'network':
-        handle_network_lb(lb_arn, lb_name, region, event)
+        return handle_network_lb(lb_arn, lb_name, region, record)
     else:
         logger.info(f"Load Balancer {lb_name} has unsupported type: {lb_type}")
+        return {"status": "unsupported"}
 
 # This function is used to manage the security best practices applied when the user created an Application Load Balancer
 
-def handle_application_lb(lb_arn, lb_name, region, event):
+def handle_application_lb(lb_arn, lb_name, region, record):
     bucket_name = f"s3bkt-access-logging-{lb_name}"
     error_message = None
-    principal_arn = "Unknown"
+    status = "success"
+    principal_arn = record.principal
 
     try:
-        principal_arn = event['detail'].get('userIdentity', {}).get('arn', 'Unknown')
-
         if not bucket_exists(bucket_name):
+            # Pre-flight validation (cached per container), an unsupported region fails here instead of after CreateBucket.
+            require(check_region(region, elb_account_ids, "ELB Access Logging"), *check_archive(kms_encrypted=False))
             logger.info(f"Bucket {bucket_name} does not exist. Creating...")
             create_logging_bucket(bucket_name, region, type='alb')
             apply_bucket_policy(bucket_name, region, type='alb')
@@ -84,30 +101,37 @@ def handle_application_lb(lb_arn, lb_name, region, event):
 
         if is_logging_enabled(lb_arn, bucket_name):
             logger.info(f"Access logging is already enabled for ALB {lb_name}. Skipping configuration.")
+            status = "already-enabled"
         else:
             configure_lb_logging(lb_arn, bucket_name)
             logger.info(f"Access logging enabled for ALB {lb_name}.")
 
         logging_enabled = True
+    except RateLimitDeferred as e:
+        logger.warning(f"Deferring logging configuration for ALB {lb_name}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error configuring logging for ALB {lb_name}: {e}")
         logging_enabled = False
         error_message = str(e)
+        status = "error"
 
     my_account_id = sts.get_caller_identity()['Account']
     send_chat_card(lb_name, 'application', region, my_account_id, logging_enabled, bucket_name, principal_arn, error_message)
+    return {"status": status, "message": error_message} if error_message else {"status": status}
 
 # This function is used to manage the security best practices applied when the user created an Network Load Balancer
 
-def handle_network_lb(lb_arn, lb_name, region, event):
+def handle_network_lb(lb_arn, lb_name, region, record):
     bucket_name = f"s3bkt-access-logging-{lb_name}"
     error_message = None
-    principal_arn = "Unknown"
+    status = "success"
+    principal_arn = record.principal
 
     try:
-        principal_arn = event['detail'].get('userIdentity', {}).get('arn', 'Unknown')
-
         if not bucket_exists(bucket_name):
+            # Pre-flight validation (cached per container), an unsupported region or a bad KMS Key fails here instead of after CreateBucket.
+            require(check_region(region, elb_account_ids, "ELB Access Logging"), check_kms_key(KMS_KEY_ARN, region), *check_archive(kms_encrypted=True))
             logger.info(f"Bucket {bucket_name} does not exist. Creating...")
             create_logging_bucket(bucket_name, region, type='nlb')
             apply_bucket_policy(bucket_name, region, type='nlb')
@@ -116,18 +140,30 @@ def handle_network_lb(lb_arn, lb_name, region, event):
 
         if is_logging_enabled(lb_arn, bucket_name):
             logger.info(f"Access logging is already enabled for NLB {lb_name}. Skipping configuration.")
+            status = "already-enabled"
         else:
             configure_lb_logging(lb_arn, bucket_name)
             logger.info(f"Access logging enabled for NLB {lb_name}.")
 
         logging_enabled = True
+    except RateLimitDeferred as e:
+        logger.warning(f"Deferring logging configuration for NLB {lb_name}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error configuring logging for NLB {lb_name}: {e}")
         logging_enabled = False
         error_message = str(e)
+        status = "error"
 
     my_account_id = sts.get_caller_identity()['Account']
     send_chat_card(lb_name, 'network', region, my_account_id, logging_enabled, bucket_name, principal_arn, error_message)
+    return {"status": status, "message": error_message} if error_message else {"status": status}
+
+# This function is used only when the CloudTrail Event does not include the tags of the Load Balancer.
+
+def get_lb_tags(lb_arn):
+    tags = elbv2.describe_tags(ResourceArns=[lb_arn])['TagDescriptions'][0]['Tags']
+    return tags_to_dict(tags)
 
 # This function is used to validate if the S3 Bucket Name that we created using s3bkt-access-logging-${ELB_Name} already exists.
 
@@ -137,6 +173,7 @@ def bucket_exists(bucket_name):
     return bucket_name in buckets
 
 # At this stage we create the Bucket to store ELB Access Logs with some considerations for example if the AWS Regions is us-east-1 or not.
+# Only the objects merged by the compaction job (tools/compactlogobjects.py) are transitioned, the small original objects just expire.
 
 def create_logging_bucket(bucket_name, region, type):
     create_bucket_params = {
@@ -146,8 +183,10 @@ def create_logging_bucket(bucket_name, region, type):
     if region == 'us-east-1':
         create_bucket_params.pop('CreateBucketConfiguration')
 
+    acquire('s3:CreateBucket')
     s3.create_bucket(**create_bucket_params)
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_versioning(
         Bucket=bucket_name,
         VersioningConfiguration={'Status': 'Enabled'}
@@ -175,27 +214,46 @@ def create_logging_bucket(bucket_name, region, type):
     else:
         raise Exception(f"Unsupported bucket type for encryption configuration: {type}")
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_encryption(
         Bucket=bucket_name,
         ServerSideEncryptionConfiguration=encryption_config
     )
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_lifecycle_configuration(
         Bucket=bucket_name,
         LifecycleConfiguration={
             'Rules': [ {
                 'ID': 'LifecycleRuleArchivingAndExpiration',
-                'Filter': {'Prefix': ''},
+                'Filter': {
+                    'And': {
+                        'Prefix': COMPACTED_PREFIX,
+                        'ObjectSizeGreaterThan': MIN_TRANSITION_SIZE_BYTES
+                    }
+                },
                 'Status': 'Enabled',
                 'Transitions': [ {
                     'Days': TRANSITION_IN_DAYS,
                     'StorageClass': STORAGE_CLASS
                 }],
-                'Expiration': {'Days': EXPIRATION_IN_DAYS}
+                'Expiration': {'Days': EXPIRATION_IN_DAYS},
+                'NoncurrentVersionExpiration': {'NoncurrentDays': NONCURRENT_EXPIRATION_IN_DAYS}
+            },
+            {
+                'ID': 'LifecycleRuleExpiration',
+                'Filter': {'Prefix': ''},
+                'Status': 'Enabled',
+                'Expiration': {'Days': EXPIRATION_IN_DAYS},
+                'NoncurrentVersionExpiration': {'NoncurrentDays': NONCURRENT_EXPIRATION_IN_DAYS}
             }]
         }
     )
 
+    # When the central log archive is configured, the new bucket is replicated to it (only NLB buckets use SSE-KMS).
+
+    configure_replication(s3, bucket_name, kms_encrypted=(type == 'nlb'))
+
 # This functions apply the bucket policy itself depending of the ELB type.
 
 def apply_bucket_policy(bucket_name, region, type):
@@ -261,6 +319,7 @@ def apply_bucket_policy(bucket_name, region, type):
     else:
         raise Exception(f"Unsupported Load Balancer type for policy generation: {type}")
 
+    acquire('s3:PutBucketConfiguration', defer=False)
     s3.put_bucket_policy(
         Bucket=bucket_name,
         Policy=json.dumps(policy)
@@ -269,6 +328,7 @@ def apply_bucket_policy(bucket_name, region, type):
 # This function enables the Access Logs in the Elastic Load Balancer.
 
 def configure_lb_logging(lb_arn, bucket_name):
+    acquire('elasticloadbalancing:ModifyLoadBalancerAttributes')
     elbv2.modify_load_balancer_attributes(
         LoadBalancerArn=lb_arn,
         Attributes=[
@@ -1,9 +1,15 @@
+from fallprofiler import profiled
 import boto3
 import os
 import logging
 import json
 import urllib.request
 from botocore.exceptions import ClientError
+from fallratelimiter import acquire, rate_limited, RateLimitDeferred
+from falleventclassifier import classify_event, tags_to_dict, EXCLUDED, PROCESS
+from fallevent import parse_event, log_event, InvalidEvent
+from fallarchive import configure_replication, archive_enabled, check_archive
+from fallpreflight import require, check_kms_key, check_region
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -18,7 +24,11 @@ KMS_KEY_ARN = os.environ.get('KMS_KEY_ARN')                 # Used to encrypt th
 TRANSITION_IN_DAYS = int(os.environ['TRANSITION_IN_DAYS'])  # Used in the Lifecycle Rule of the S3 Bucket.
 STORAGE_CLASS = os.environ['STORAGE_CLASS']                 # S3 Storage Class used to send the logs after the days defined in TRANSITION_IN_DAYS variable.
 EXPIRATION_IN_DAYS = int(os.environ['EXPIRATION_IN_DAYS'])  # Used to define when the log files will be deleted from our S3 Bucket
+NONCURRENT_EXPIRATION_IN_DAYS = int(os.environ.get('NONCURRENT_EXPIRATION_IN_DAYS', '1'))  # Days the noncurrent versions (e.g. the originals purged after the compaction) are kept in the versioned buckets.
+COMPACTED_PREFIX = os.environ.get('COMPACTED_PREFIX', 'compacted/')                    # Prefix where the compaction job stores the merged log objects, only these objects are transitioned.
+MIN_TRANSITION_SIZE_BYTES = int(os.environ.get('MIN_TRANSITION_SIZE_BYTES', '131072'))  # Objects smaller than this value are never transitioned to STORAGE_CLASS.
 WEBHOOK_GOOGLE_CHAT = os.environ.get("WEBHOOK_GOOGLE_CHAT") # Used to forward our notification status to a Google Chat Space.
+LAMBDA_REGION = os.environ.get('AWS_REGION', DEPLOYMENT_REGION)  # Region of the Lambda Function (set by the Lambda runtime), the source buckets are in this region.
 
 """
 Principal function or entry point to start the execution of Lambda where first of all we extract the S3 Bucket Name parameter and then validate the presence of the ExcludeLogging tag,
@@ -26,37 +36,36 @@ we validate if the created bucket is an Logging Bucket or not to decide if skip
 in the new S3 Bucket which will store the Server Access Logs and finally send a Google Chat Notification.
 """
 
+@profiled
+@rate_limited
 def lambda_handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
+    try:
+        record = parse_event(event)
+    except InvalidEvent as e:
+        logger.error(f"Invalid CloudTrail Event: {e}")
+        log_event(event)
+        return {"status": "invalid-event"}
+    log_event(event, record)
 
     created_bucket_name = None
     access_logging_bucket = None
     account_id = sts.get_caller_identity()["Account"]
-    principal = event['detail'].get('userIdentity', {}).get('arn', 'Unknown')
+    principal = record.principal
 
     try:
-        created_bucket_name = event['detail']['requestParameters']['bucketName']
+        created_bucket_name = record.resource_id
         logger.info(f"Bucket detected: {created_bucket_name}")
 
-        if created_bucket_name.startswith("s3bkt-access-logging-"):
-            logger.info("This S3 Bucket is an Logging Bucket, stop the process to avoid recursive operation.")
-            return
-
-        try:
-            tag_set = s3.get_bucket_tagging(Bucket=created_bucket_name)['TagSet']
-            tags = {tag['Key'].lower(): tag['Value'].lower() for tag in tag_set}
-            exclude_logging = tags.get("excludelogging", "false")
-        except ClientError as e:
-            if e.response['Error']['Code'] == 'NoSuchTagSet':
-                exclude_logging = "false"
-            else:
-                raise
+# Failed calls and our own Logging Buckets are discarded by the EventBridge Rule, the classifier keeps the same checks as a safeguard.
+
+        classification = classify_event(record, lambda: get_bucket_tags(created_bucket_name))
+        if classification not in (PROCESS, EXCLUDED):
+            return {"status": classification}
 
 # Validate the presence of the Tag/Value ExcludeLogging.
 
-        if exclude_logging == "true":
+        if classification == EXCLUDED:
             logger.info(f"Bucket {created_bucket_name} has the tag and value ExcludeLogging=True. Skip logging process.")
-            principal = event['detail'].get('userIdentity', {}).get('arn', 'Unknown')
             send_chat_card(
                 bucket_name=created_bucket_name,
                 account_id=account_id,
@@ -65,7 +74,7 @@ def lambda_handler(event, context):
                 excluded_reason="Tag ExcludeLogging=True",
                 principal=principal
             )
-            return
+            return {"status": "excluded"}
 
 # Validate the new S3 Bucket name and if this already exists or not to continue with CreateBucket API and Security Best Practices.
 
@@ -73,8 +82,17 @@ def lambda_handler(event, context):
 
         existing_buckets = [b['Name'] for b in s3.list_buckets()['Buckets']]
         if access_logging_bucket not in existing_buckets:
+
+# Pre-flight validation (cached per container), the target bucket must be in the region of the source bucket and the KMS Key is checked before CreateBucket.
+
+            require(
+                check_region(DEPLOYMENT_REGION, (LAMBDA_REGION,), "DEPLOYMENT_REGION"),
+                check_kms_key(KMS_KEY_ARN, DEPLOYMENT_REGION),
+                *check_archive(kms_encrypted=True)
+            )
             logger.info(f"Creating S3 Bucket named: {access_logging_bucket}")
 
+            acquire('s3:CreateBucket')
             if DEPLOYMENT_REGION == 'us-east-1':
                 s3.create_bucket(Bucket=access_logging_bucket)
             else:
@@ -83,11 +101,13 @@ def lambda_handler(event, context):
                     CreateBucketConfiguration={'LocationConstraint': DEPLOYMENT_REGION}
                 )
 
+            acquire('s3:PutBucketConfiguration', defer=False)
             s3.put_bucket_versioning(
                 Bucket=access_logging_bucket,
                 VersioningConfiguration={'Status': 'Enabled'}
             )
 
+            acquire('s3:PutBucketConfiguration', defer=False)
             s3.put_bucket_encryption(
                 Bucket=access_logging_bucket,
                 ServerSideEncryptionConfiguration={
@@ -102,13 +122,22 @@ def lambda_handler(event, context):
                 }
             )
 
+# Only the objects merged by the compaction job (tools/compactlogobjects.py) are transitioned, every object of the bucket (the originals, the
+# small compacted objects and the manifests) expires.
+
+            acquire('s3:PutBucketConfiguration', defer=False)
             s3.put_bucket_lifecycle_configuration(
                 Bucket=access_logging_bucket,
                 LifecycleConfiguration={
                     'Rules': [
                         {
                             'ID': 'LifecycleRuleArchivingAndExpiration',
-                            'Prefix': 'logs/',
+                            'Filter': {
+                                'And': {
+                                    'Prefix': COMPACTED_PREFIX,
+                                    'ObjectSizeGreaterThan': MIN_TRANSITION_SIZE_BYTES
+                                }
+                            },
                             'Status': 'Enabled',
                             'Transitions': [
                                 {
@@ -118,6 +147,20 @@ def lambda_handler(event, context):
                             ],
                             'Expiration': {
                                 'Days': EXPIRATION_IN_DAYS
+                            },
+                            'NoncurrentVersionExpiration': {
+                                'NoncurrentDays': NONCURRENT_EXPIRATION_IN_DAYS
+                            }
+                        },
+                        {
+                            'ID': 'LifecycleRuleExpiration',
+                            'Filter': {'Prefix': ''},
+                            'Status': 'Enabled',
+                            'Expiration': {
+                                'Days': EXPIRATION_IN_DAYS
+                            },
+                            'NoncurrentVersionExpiration': {
+                                'NoncurrentDays': NONCURRENT_EXPIRATION_IN_DAYS
                             }
                         }
                     ]
@@ -147,19 +190,30 @@ def lambda_handler(event, context):
                 ]
             }
 
+            acquire('s3:PutBucketConfiguration', defer=False)
             s3.put_bucket_policy(
                 Bucket=access_logging_bucket,
                 Policy=json.dumps(bucket_policy)
             )
 
+# When the central log archive is configured, the new bucket is replicated to it.
+
+            configure_replication(s3, access_logging_bucket, kms_encrypted=True)
+
+# With the central log archive the partitioned prefix is used (logs/{account}/{region}/{bucket}/yyyy/mm/dd/), so the logs of
+# every bucket keep their own account, region and source bucket prefix once replicated.
+
+        logging_enabled = {
+            'TargetBucket': access_logging_bucket,
+            'TargetPrefix': 'logs/'
+        }
+        if archive_enabled():
+            logging_enabled['TargetObjectKeyFormat'] = {'PartitionedPrefix': {'PartitionDateSource': 'EventTime'}}
+
+        acquire('s3:PutBucketConfiguration')
         s3.put_bucket_logging(
             Bucket=created_bucket_name,
-            BucketLoggingStatus={
-                'LoggingEnabled': {
-                    'TargetBucket': access_logging_bucket,
-                    'TargetPrefix': 'logs/'
-                }
-            }
+            BucketLoggingStatus={'LoggingEnabled': logging_enabled}
         )
 
         send_chat_card(
@@ -170,8 +224,11 @@ def lambda_handler(event, context):
             principal=principal,
             success=True
         )
+        return {"status": "success"}
 
-
+    except RateLimitDeferred as e:
+        logger.warning(f"Deferring Server Access Logging configuration for the Bucket {created_bucket_name}: {e}")
+        raise
     except Exception as e:
         logger.error(f"Error: {str(e)}")
         send_chat_card(
@@ -185,6 +242,16 @@ def lambda_handler(event, context):
         )
         raise
 
+# CreateBucket events do not include the tags of the bucket, so they are retrieved using the API.
+
+def get_bucket_tags(bucket_name):
+    try:
+        return tags_to_dict(s3.get_bucket_tagging(Bucket=bucket_name)['TagSet'])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchTagSet':
+            return {}
+        raise
+
 # This function is used to send Google Chat messages to indicate the status logging
 
 def send_chat_card(bucket_name, account_id, region, access_logging_bucket, success=True, error_message=None, excluded_reason=None, principal=None):
@@ -1,11 +1,25 @@
+from fallprofiler import profiled
 import boto3
 import os
 import json
+import logging
 import urllib.request
+from fallratelimiter import acquire, rate_limited, RateLimitDeferred
+from falleventclassifier import classify_event, tags_to_dict, EXCLUDED, PROCESS
+from fallinventory import FlowLogInventory
+from fallevent import parse_event, log_event, InvalidEvent
+from fallpreflight import require, check_kms_key, check_role
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 logs_client = boto3.client('logs')
 ec2_client = boto3.client('ec2')
 
+# Flow Logs that already exist in the account, loaded once per container and updated with the CreateFlowLogs and DeleteFlowLogs events.
+
+flow_logs = FlowLogInventory(ec2_client)
+
 # Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
 
 LOG_GROUP_PREFIX = os.environ.get("LOG_GROUP_PREFIX", "/vpc-flow-logs/")    # Used as part of the name of the CloudWatch Log Group.
@@ -16,20 +30,32 @@ WEBHOOK_GOOGLE_CHAT = os.environ.get("WEBHOOK_GOOGLE_CHAT")                 # Us
 
 """
 Principal function or entry point to start the execution of Lambda where first of all we extract the VPC_ID parameter from CloudTrail Event
-We validate the presence of the ExcludeLogging tag, we defined the CloudWatch Log Group name and after that create it with some parameters like
+We validate the presence of the ExcludeLogging tag (using the tags included in the CloudTrail Event when possible) and if the VPC already has Flow Logs, we defined the CloudWatch Log Group name and after that create it with some parameters like
 RETENTION_DAYS and KMS_KEY_ARN, and finally send a Google Chat Notification.
 """
 
+@profiled
+@rate_limited
 def lambda_handler(event, context):
-    detail = event.get("detail", {})
-    vpc_id = detail.get("responseElements", {}).get("vpc", {}).get("vpcId")
-    account_id = detail.get("userIdentity", {}).get("accountId", "Unknown Account")
-    region = detail.get("awsRegion", "Invalid Region")
-    principal = detail.get("userIdentity", {}).get("arn", "Unknown")
+    try:
+        record = parse_event(event)
+    except InvalidEvent as e:
+        print(f"Invalid CloudTrail Event: {e}")
+        log_event(event)
+        return {'status': 'invalid-event'}
+    log_event(event, record)
+
+    if flow_logs.apply_event(record):
+        return {'status': 'inventory-updated'}
+
+    vpc_id = record.resource_id
+    account_id = record.account_id or "Unknown Account"
+    region = record.region or "Invalid Region"
+    principal = record.principal
 
     if not vpc_id:
         print("No VPC ID found in the CloudTrail Event")
-        return
+        return {'status': 'invalid-event'}
 
     if not KMS_KEY_ARN or not FLOW_LOG_ROLE_ARN or not WEBHOOK_GOOGLE_CHAT:
         raise Exception("Missing required environment variables")
@@ -37,17 +63,9 @@ def lambda_handler(event, context):
     log_group_name = f"{LOG_GROUP_PREFIX}{vpc_id}"
 
     try:
-        tags_response = ec2_client.describe_tags(
-            Filters=[
-                {'Name': 'resource-id', 'Values': [vpc_id]},
-                {'Name': 'resource-type', 'Values': ['vpc']}
-            ]
-        )
-
-        tags = {tag['Key'].lower(): tag['Value'].lower() for tag in tags_response.get('Tags', [])}
-        exclude_logging = tags.get("excludelogging", "false")
+        classification = classify_event(record, lambda: get_vpc_tags(vpc_id))
 
-        if exclude_logging == "true":
+        if classification == EXCLUDED:
             print(f"VPC {vpc_id} has the tag ExcludeLogging=True. Skipping creation of VPC Flow Logs.")
             send_google_chat_message(
                 WEBHOOK_GOOGLE_CHAT, vpc_id, account_id, region,
@@ -56,9 +74,35 @@ def lambda_handler(event, context):
                 excluded_reason="Tag ExcludeLogging=True",
                 principal=principal
             )
-            return
+            return {'status': 'excluded'}
+
+        if classification != PROCESS:
+            return {'status': classification}
+
+        if flow_logs.is_enabled(vpc_id):
+            print(f"VPC {vpc_id} already has Flow Logs. Skipping creation of VPC Flow Logs.")
+            send_google_chat_message(
+                WEBHOOK_GOOGLE_CHAT, vpc_id, account_id, region,
+                log_group_name=None,
+                success=True,
+                already_enabled=True,
+                principal=principal
+            )
+            return {
+                'statusCode': 200,
+                'status': 'already-enabled',
+                'body': f'VPC Flow Logs already enabled for VPC {vpc_id}'
+            }
+
+        # Pre-flight validation (cached per container), a bad KMS Key or Flow Log Role fails here instead of leaving a Log Group without Flow Log.
+
+        require(
+            check_kms_key(KMS_KEY_ARN, region),
+            check_role(FLOW_LOG_ROLE_ARN, 'vpc-flow-logs.amazonaws.com', 'FLOW_LOG_ROLE_ARN')
+        )
 
         try:
+            acquire('logs:CreateLogGroup')
             logs_client.create_log_group(
                 logGroupName=log_group_name,
                 kmsKeyId=KMS_KEY_ARN
@@ -67,11 +111,13 @@ def lambda_handler(event, context):
         except logs_client.exceptions.ResourceAlreadyExistsException:
             print(f"Log group already exists: {log_group_name}")
 
+        acquire('logs:PutRetentionPolicy')
         logs_client.put_retention_policy(
             logGroupName=log_group_name,
             retentionInDays=RETENTION_DAYS
         )
 
+        acquire('ec2:CreateFlowLogs')
         response = ec2_client.create_flow_logs(
             ResourceIds=[vpc_id],
             ResourceType='VPC',
@@ -82,13 +128,18 @@ def lambda_handler(event, context):
         )
 
         print(f"Created Flow Log: {response}")
+        flow_logs.record(vpc_id, response.get('FlowLogIds', []))
         send_google_chat_message(WEBHOOK_GOOGLE_CHAT, vpc_id, account_id, region, log_group_name, success=True, principal=principal)
 
         return {
             'statusCode': 200,
+            'status': 'success',
             'body': f'VPC Flow Log created for VPC {vpc_id}'
         }
 
+    except RateLimitDeferred as e:
+        print(f"Deferring VPC Flow Logs creation for VPC {vpc_id}: {e}")
+        raise
     except Exception as e:
         print(f"Error: {str(e)}")
         send_google_chat_message(
@@ -100,14 +151,29 @@ def lambda_handler(event, context):
         )
         return {
             'statusCode': 500,
-            'body': f'Failed to create VPC Flow Log for VPC {vpc_id}'
+            'status': 'error',
+            'body': f'Failed to create VPC Flow Log for VPC {vpc_id}',
+            'message': str(e)
         }
 
+# This function is used only when the CloudTrail Event does not include the tags of the VPC.
+
+def get_vpc_tags(vpc_id):
+    tags_response = ec2_client.describe_tags(
+        Filters=[
+            {'Name': 'resource-id', 'Values': [vpc_id]},
+            {'Name': 'resource-type', 'Values': ['vpc']}
+        ]
+    )
+    return tags_to_dict(tags_response.get('Tags', []))
+
 # This function is used to send Google Chat messages to indicate the status logging
 
-def send_google_chat_message(WEBHOOK_GOOGLE_CHAT, vpc_id, account_id, region, log_group_name=None, success=True, error_message=None, excluded_reason=None, principal=None):
+def send_google_chat_message(WEBHOOK_GOOGLE_CHAT, vpc_id, account_id, region, log_group_name=None, success=True, error_message=None, excluded_reason=None, principal=None, already_enabled=False):
     if excluded_reason:
         status_text = "⚠️ VPC Flow Logs was skipped due to ExcludeLogging tag"
+    elif already_enabled:
+        status_text = "ℹ️ VPC already had Flow Logs enabled"
     else:
         status_text = "✅ VPC Flow Logs successfully enabled" if success else "❌ Error enabling VPC Flow Logs"
 
@@ -0,0 +1,86 @@
+import os
+import logging
+from fallratelimiter import acquire
+from fallpreflight import check_role
+
+logger = logging.getLogger()
+
+# Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
+
+ARCHIVE_BUCKET = os.environ.get("ARCHIVE_BUCKET", "")                               # Central log archive bucket, if empty the logging buckets are not replicated.
+ARCHIVE_ACCOUNT_ID = os.environ.get("ARCHIVE_ACCOUNT_ID", "")                       # Account that owns the archive bucket, the replicas are owned by this account.
+ARCHIVE_KMS_KEY_ARN = os.environ.get("ARCHIVE_KMS_KEY_ARN", "")                     # KMS Key of the archive bucket used to encrypt the replicas of KMS encrypted logs.
+ARCHIVE_REPLICATION_ROLE_ARN = os.environ.get("ARCHIVE_REPLICATION_ROLE_ARN", "")   # IAM Role used by S3 to replicate the objects (created by the global StackSet).
+ARCHIVE_STORAGE_CLASS = os.environ.get("ARCHIVE_STORAGE_CLASS", "STANDARD_IA")      # Storage Class of the replicas in the archive bucket.
+
+"""
+Replication of the logging buckets (s3bkt-access-logging-*) into a central archive bucket, shared by the ELB, CloudFront
+and S3 Lambda Functions. S3 Replication keeps the key of each object, so the archive is organized by account, region and
+service thanks to the layout of each log source:
+
+    * ELB:        AWSLogs/{account}/elasticloadbalancing/{region}/...
+    * CloudFront: AWSLogs/{account}/CloudFront/... (or AWSLogs/aws-account-id={account}/CloudFront/... with Hive paths)
+    * S3:         logs/{account}/{region}/{source_bucket}/... (partitioned prefix, enabled when the archive is used)
+
+Delete markers are not replicated, so the objects purged by the compaction job are kept in the archive. The prefix index
+used by the queries is built from the archive bucket with tools/indexlogarchive.py.
+"""
+
+def archive_enabled():
+    return bool(ARCHIVE_BUCKET and ARCHIVE_REPLICATION_ROLE_ARN)
+
+# This function returns the pre-flight errors of the archive configuration, checked by the handlers before creating a bucket.
+
+def check_archive(kms_encrypted):
+    if not archive_enabled():
+        return []
+    errors = [check_role(ARCHIVE_REPLICATION_ROLE_ARN, 's3.amazonaws.com', 'ARCHIVE_REPLICATION_ROLE_ARN')]
+    if kms_encrypted and not ARCHIVE_KMS_KEY_ARN:
+        errors.append("ARCHIVE_KMS_KEY_ARN is required to replicate the KMS encrypted logging buckets")
+    return errors
+
+# This function configures the replication of a logging bucket, kms_encrypted tells us if the objects of the bucket are
+# encrypted with SSE-KMS, in that case the replicas are encrypted with the KMS Key of the archive.
+
+def configure_replication(s3, bucket_name, kms_encrypted):
+    if not archive_enabled():
+        return False
+    if kms_encrypted and not ARCHIVE_KMS_KEY_ARN:
+        raise Exception(f"ARCHIVE_KMS_KEY_ARN is required to replicate the KMS encrypted bucket {bucket_name}.")
+
+    destination = {
+        'Bucket': f'arn:aws:s3:::{ARCHIVE_BUCKET}',
+        'StorageClass': ARCHIVE_STORAGE_CLASS
+    }
+    if ARCHIVE_ACCOUNT_ID:
+        destination['Account'] = ARCHIVE_ACCOUNT_ID
+        destination['AccessControlTranslation'] = {'Owner': 'Destination'}
+
+    rule = {
+        'ID': 'ReplicationToLogArchive',
+        'Priority': 1,
+        'Status': 'Enabled',
+        'Filter': {'Prefix': ''},
+        'DeleteMarkerReplication': {'Status': 'Disabled'},
+        'Destination': destination
+    }
+    if kms_encrypted:
+        rule['SourceSelectionCriteria'] = {'SseKmsEncryptedObjects': {'Status': 'Enabled'}}
+        destination['EncryptionConfiguration'] = {'ReplicaKmsKeyID': ARCHIVE_KMS_KEY_ARN}
+
+    acquire('s3:PutBucketConfiguration', defer=False)
+    s3.put_bucket_versioning(
+        Bucket=bucket_name,
+        VersioningConfiguration={'Status': 'Enabled'}
+    )
+
+    acquire('s3:PutBucketConfiguration', defer=False)
+    s3.put_bucket_replication(
+        Bucket=bucket_name,
+        ReplicationConfiguration={
+            'Role': ARCHIVE_REPLICATION_ROLE_ARN,
+            'Rules': [rule]
+        }
+    )
+    logger.info(f"Replication of {bucket_name} to the archive bucket {ARCHIVE_BUCKET} configured.")
+    return True
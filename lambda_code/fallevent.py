@@ -0,0 +1,99 @@
+import os
+import json
+import random
+import logging
+
+logger = logging.getLogger()
+
+# Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
+
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get("EVENT_LOG_SAMPLE_RATE", "0.05"))   # Fraction of the invocations that log the full event received, 1 logs all of them.
+EVENT_LOG_MAX_CHARS = int(os.environ.get("EVENT_LOG_MAX_CHARS", "4096"))          # Events logged are truncated to this size.
+
+"""
+Event model shared by the FALL Lambda Functions. parse_event() reads once the EventBridge event (CloudTrail "AWS API
+Call" detail) into a CloudTrailEvent object with only the fields used by the handlers, the id of the created resource is
+extracted by the parser of each event type and the event is rejected with InvalidEvent if a successful call does not
+include it. The principal is always the ARN of the identity (principalId when the ARN is not present).
+
+Instead of serializing the whole event on every invocation, log_event() logs a one line summary and only a sample of
+the invocations (EVENT_LOG_SAMPLE_RATE) log the event itself, truncated to EVENT_LOG_MAX_CHARS. Invalid events are
+always logged.
+"""
+
+class InvalidEvent(ValueError):
+    pass
+
+class CloudTrailEvent:
+    __slots__ = ("event_name", "event_source", "region", "account_id", "principal", "error_code", "resource_id", "request_parameters", "response_elements")
+
+    def __init__(self, event_name, event_source, region, account_id, principal, error_code, request_parameters, response_elements):
+        self.event_name = event_name
+        self.event_source = event_source
+        self.region = region
+        self.account_id = account_id
+        self.principal = principal
+        self.error_code = error_code
+        self.request_parameters = request_parameters
+        self.response_elements = response_elements
+        self.resource_id = None
+
+    def __repr__(self):
+        status = f"failed with {self.error_code}" if self.error_code else "succeeded"
+        return f"{self.event_name} {self.resource_id or ''} in {self.account_id}/{self.region} by {self.principal} {status}"
+
+# Parsers of the events that create a resource, each one returns the id of the resource used by the handler.
+
+def parse_create_vpc(parameters, response):
+    return (response.get("vpc") or {}).get("vpcId")
+
+def parse_create_load_balancer(parameters, response):
+    return ((response.get("loadBalancers") or [{}])[0]).get("loadBalancerArn")
+
+def parse_create_distribution(parameters, response):
+    return (response.get("distribution") or {}).get("id")
+
+def parse_create_bucket(parameters, response):
+    return parameters.get("bucketName")
+
+RESOURCE_PARSERS = {
+    "CreateVpc": parse_create_vpc,
+    "CreateLoadBalancer": parse_create_load_balancer,
+    "CreateDistributionWithTags": parse_create_distribution,
+    "CreateBucket": parse_create_bucket
+}
+
+def parse_event(event):
+    detail = event.get("detail") if isinstance(event, dict) else None
+    if not isinstance(detail, dict) or not detail.get("eventName"):
+        raise InvalidEvent("The event does not include the detail of a CloudTrail API call")
+
+    identity = detail.get("userIdentity") or {}
+    record = CloudTrailEvent(
+        event_name=detail["eventName"],
+        event_source=detail.get("eventSource"),
+        region=detail.get("awsRegion") or event.get("region"),
+        account_id=identity.get("accountId") or event.get("account"),
+        principal=identity.get("arn") or identity.get("principalId") or "Unknown",
+        error_code=detail.get("errorCode"),
+        request_parameters=detail.get("requestParameters") or {},
+        response_elements=detail.get("responseElements") or {}
+    )
+
+    parser = RESOURCE_PARSERS.get(record.event_name)
+    if parser and not record.error_code:
+        record.resource_id = parser(record.request_parameters, record.response_elements)
+        if not record.resource_id:
+            raise InvalidEvent(f"The {record.event_name} event does not include the id of the resource created")
+    return record
+
+def log_event(event, record=None):
+    if record is not None:
+        logger.info(f"Received {record}")
+        if random.random() >= EVENT_LOG_SAMPLE_RATE:
+            return
+
+    payload = json.dumps(event, default=str)
+    if len(payload) > EVENT_LOG_MAX_CHARS:
+        payload = f"{payload[:EVENT_LOG_MAX_CHARS]}... (truncated, {len(payload)} chars)"
+    logger.info(f"Received event: {payload}")
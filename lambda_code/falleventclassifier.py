@@ -0,0 +1,122 @@
+import json
+import logging
+from fallinventory import FLOW_LOG_EVENTS, DELIVERY_EVENTS
+
+logger = logging.getLogger()
+
+# Prefix of the buckets created by FALL to store the logs, CreateBucket events of these buckets must not be processed.
+
+LOGGING_BUCKET_PREFIX = "s3bkt-access-logging-"
+
+# Role of the CloudFront function (Defined in the global CloudFormation Template), the delivery events of its own calls
+# must not invoke it again.
+
+CLOUDFRONT_ROLE_NAME = "iamrole-fall-enable-cloudfront-access-logs"
+
+# Result of the classification of a CloudTrail event.
+
+PROCESS = "process"
+FAILED = "failed"
+SELF_GENERATED = "self-generated"
+EXCLUDED = "excluded"
+
+"""
+Event pre-classifier shared by the FALL Lambda Functions. CreateVpc, CreateLoadBalancer and CreateDistributionWithTags
+carry the tags of the new resource in the requestParameters of the CloudTrail event, so the ExcludeLogging tag is
+resolved from the event itself and the tag APIs (describe_tags, list_tags_for_resource, get_bucket_tagging) are called
+only when the event does not include the tags.
+
+event_patterns() generates the EventBridge patterns used in the CloudFormation Template, they stop failed API calls and
+the CreateBucket events of our own logging buckets before the Lambda Functions are invoked. EventBridge cannot match a
+key and its value inside the same element of an array, so the ExcludeLogging tag is still evaluated here.
+"""
+
+def classify_event(record, fallback_tags):
+    if record.error_code:
+        logger.info(f"The API call {record.event_name} failed with {record.error_code}, nothing to enable.")
+        return FAILED
+
+    if is_self_generated(record):
+        logger.info("The resource was created by FALL itself, stop the process to avoid recursive operation.")
+        return SELF_GENERATED
+
+    tags = tags_from_event(record)
+    if tags is None:
+        logger.info("The CloudTrail event does not include the tags of the resource, using the API to retrieve them.")
+        tags = fallback_tags()
+
+    if tags.get("excludelogging", "false") == "true":
+        return EXCLUDED
+    return PROCESS
+
+def is_self_generated(record):
+    return record.event_name == "CreateBucket" and record.resource_id.startswith(LOGGING_BUCKET_PREFIX)
+
+# This function returns the tags included in the CloudTrail event as a dictionary with keys and values in lower case,
+# or None when the event has no information about the tags and the API must be used.
+
+def tags_from_event(record):
+    event_name = record.event_name
+    parameters = record.request_parameters
+
+    if event_name == "CreateVpc":
+        specifications = (parameters.get("tagSpecificationSet") or {}).get("items")
+        if specifications is None:
+            return None
+        tags = [tag for specification in specifications if specification.get("resourceType") == "vpc" for tag in specification.get("tags", [])]
+    elif event_name == "CreateLoadBalancer":
+        if "tags" not in parameters:
+            return None
+        tags = parameters.get("tags") or []
+    elif event_name == "CreateDistributionWithTags":
+        distribution_tags = (parameters.get("distributionConfigWithTags") or {}).get("tags")
+        if distribution_tags is None:
+            return None
+        tags = distribution_tags.get("items") or []
+    else:
+        return None
+
+    return {str(tag.get("key", "")).lower(): str(tag.get("value", "")).lower() for tag in tags}
+
+# Tags returned by the AWS APIs use Key/Value, this function converts them to the same format used by tags_from_event.
+
+def tags_to_dict(tags):
+    return {tag["Key"].lower(): tag.get("Value", "").lower() for tag in tags}
+
+# EventBridge patterns of the four rules, only successful calls are delivered and CreateBucket events of the logging
+# buckets created by FALL are discarded by EventBridge itself. The Flow Logs and delivery events keep the inventory of
+# the functions updated (see fallinventory.py), the delivery events made by the CloudFront function are discarded
+# because it records its own changes, and an IAM User or the root user has no sessionIssuer to compare.
+
+def event_patterns():
+    def pattern(sources, event_sources, event_names, extra_detail=None):
+        detail = {
+            "eventSource": event_sources,
+            "eventName": event_names,
+            "errorCode": [{"exists": False}]
+        }
+        detail.update(extra_detail or {})
+        return {"source": sources, "detail-type": ["AWS API Call via CloudTrail"], "detail": detail}
+
+    return {
+        "eventrule-fall-new-vpc-created": pattern(["aws.ec2"], ["ec2.amazonaws.com"], ["CreateVpc", *FLOW_LOG_EVENTS]),
+        "eventrule-fall-new-elb-created": pattern(["aws.elasticloadbalancing"], ["elasticloadbalancing.amazonaws.com"], ["CreateLoadBalancer"]),
+        "eventrule-fall-new-cloudfront-distribution-created": {
+            "source": ["aws.cloudfront", "aws.logs"],
+            "detail-type": ["AWS API Call via CloudTrail"],
+            "detail": {
+                "errorCode": [{"exists": False}],
+                "$or": [
+                    {"eventSource": ["cloudfront.amazonaws.com"], "eventName": ["CreateDistributionWithTags"]},
+                    {"eventSource": ["logs.amazonaws.com"], "eventName": list(DELIVERY_EVENTS), "userIdentity": {"type": [{"anything-but": "AssumedRole"}]}},
+                    {"eventSource": ["logs.amazonaws.com"], "eventName": list(DELIVERY_EVENTS), "userIdentity": {"sessionContext": {"sessionIssuer": {"userName": [{"anything-but": CLOUDFRONT_ROLE_NAME}]}}}}
+                ]
+            }
+        },
+        "eventrule-fall-new-s3-bucket-created": pattern(["aws.s3"], ["s3.amazonaws.com"], ["CreateBucket"], {
+            "requestParameters": {"bucketName": [{"anything-but": {"prefix": LOGGING_BUCKET_PREFIX}}]}
+        })
+    }
+
+if __name__ == "__main__":
+    print(json.dumps(event_patterns(), indent=2))
@@ -0,0 +1,198 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger()
+
+# Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
+
+INVENTORY_TTL_SECONDS = int(os.environ.get("INVENTORY_TTL_SECONDS", "900"))     # Max age of the inventory loaded in the container before it is loaded again.
+
+# CloudTrail events used to keep the inventory updated, they are delivered by the same EventBridge Rules of the functions.
+
+FLOW_LOG_EVENTS = ("CreateFlowLogs", "DeleteFlowLogs")
+DELIVERY_EVENTS = ("PutDeliverySource", "DeleteDeliverySource", "PutDeliveryDestination", "DeleteDeliveryDestination", "CreateDelivery", "DeleteDelivery")
+
+"""
+Inventory of the logging configuration that already exists in the account, shared by the FALL Lambda Functions. The
+first invocation served by a container loads every Flow Log, or every Delivery Source, Destination and Delivery, with
+paginated describe calls, and the following invocations reuse it. The CloudTrail events of those resources update the
+inventory incrementally, and it is loaded again after INVENTORY_TTL_SECONDS.
+
+With the inventory the handlers decide if a resource already has logging enabled before any mutation, instead of
+creating duplicated Flow Logs or learning about an existing setup from a ConflictException. When a resource is not
+found, a describe limited to that resource confirms it, because another container may have enabled it after the
+inventory was loaded. Flow Logs are always confirmed that way: a DeleteFlowLogs event reaches a single container, so
+the positive answer cached by the others may be stale.
+"""
+
+# This function returns all the strings starting with the prefix found in a CloudTrail element, the requestParameters
+# and responseElements of the EC2 API use different nestings ("item", "content") depending on the call.
+
+def find_ids(value, prefix):
+    if isinstance(value, str):
+        return [value] if value.startswith(prefix) else []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [found for element in value for found in find_ids(element, prefix)]
+    return []
+
+class Inventory:
+    def __init__(self, ttl=INVENTORY_TTL_SECONDS):
+        self.ttl = ttl
+        self.loaded_at = None
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            started = time.monotonic()
+            self.load()
+            self.loaded_at = time.monotonic()
+            logger.info(f"{type(self).__name__} loaded in {(self.loaded_at - started) * 1000:.0f} ms")
+
+    def invalidate(self):
+        self.loaded_at = None
+
+# Flow Logs of the account indexed by the resource (VPC, Subnet or ENI) they belong to.
+
+class FlowLogInventory(Inventory):
+    def __init__(self, ec2_client, ttl=INVENTORY_TTL_SECONDS):
+        super().__init__(ttl)
+        self.ec2 = ec2_client
+        self.flow_logs = {}
+
+    def load(self):
+        flow_logs = {}
+        for page in self.ec2.get_paginator("describe_flow_logs").paginate():
+            for flow_log in page["FlowLogs"]:
+                flow_logs.setdefault(flow_log["ResourceId"], set()).add(flow_log["FlowLogId"])
+        self.flow_logs = flow_logs
+
+    # A cached positive is not trusted, DeleteFlowLogs only updates the container that receives the event and the other
+    # warm containers would skip a resource whose Flow Logs were removed. The answer always comes from a describe
+    # limited to the resource, and the entry of the inventory is replaced with it.
+
+    def is_enabled(self, resource_id):
+        flow_log_ids = set()
+        for page in self.ec2.get_paginator("describe_flow_logs").paginate(Filters=[{"Name": "resource-id", "Values": [resource_id]}]):
+            flow_log_ids.update(flow_log["FlowLogId"] for flow_log in page["FlowLogs"])
+
+        if flow_log_ids:
+            self.flow_logs[resource_id] = flow_log_ids
+        else:
+            self.flow_logs.pop(resource_id, None)
+        return bool(flow_log_ids)
+
+    def record(self, resource_id, flow_log_ids):
+        if flow_log_ids:
+            self.flow_logs.setdefault(resource_id, set()).update(flow_log_ids)
+
+    # Returns True when the event belongs to the inventory, in that case the handler has nothing else to do.
+
+    def apply_event(self, record):
+        event_name = record.event_name
+        if event_name not in FLOW_LOG_EVENTS:
+            return False
+        if record.error_code or self.loaded_at is None:
+            return True
+
+        if event_name == "CreateFlowLogs":
+            resource_ids = find_ids(record.request_parameters, ("vpc-", "subnet-", "eni-"))
+            flow_log_ids = find_ids(record.response_elements, "fl-")
+            if len(resource_ids) == 1 and flow_log_ids:
+                self.record(resource_ids[0], flow_log_ids)
+            else:
+                self.invalidate()
+        else:
+            deleted = set(find_ids(record.request_parameters, "fl-"))
+            if not deleted:
+                self.invalidate()
+            for resource_id in list(self.flow_logs):
+                self.flow_logs[resource_id] -= deleted
+                if not self.flow_logs[resource_id]:
+                    del self.flow_logs[resource_id]
+
+        logger.info(f"Flow Logs inventory updated with the event {event_name}")
+        return True
+
+# Delivery Sources, Destinations and Deliveries of CloudWatch Logs (used by CloudFront Standard Logging v2).
+
+class DeliveryInventory(Inventory):
+    def __init__(self, logs_client, ttl=INVENTORY_TTL_SECONDS):
+        super().__init__(ttl)
+        self.logs = logs_client
+        self.sources = {}
+        self.destinations = {}
+        self.deliveries = {}
+
+    def load(self):
+        sources, destinations, deliveries = {}, {}, {}
+        for page in self.logs.get_paginator("describe_delivery_sources").paginate():
+            for source in page["deliverySources"]:
+                sources[source["name"]] = source.get("resourceArns", [])
+        for page in self.logs.get_paginator("describe_delivery_destinations").paginate():
+            for destination in page["deliveryDestinations"]:
+                destinations[destination["name"]] = destination["arn"]
+        for page in self.logs.get_paginator("describe_deliveries").paginate():
+            for delivery in page["deliveries"]:
+                deliveries[delivery["id"]] = (delivery["deliverySourceName"], delivery["deliveryDestinationArn"])
+        self.sources, self.destinations, self.deliveries = sources, destinations, deliveries
+
+    # Returns the name of the Delivery Source of the resource (or None) and if that source already has a Delivery.
+
+    def source_of(self, resource_arn, expected_name=None):
+        self.ensure_loaded()
+        source_name = next((name for name, arns in self.sources.items() if resource_arn in arns), None)
+
+        if source_name is None and expected_name:
+            try:
+                source = self.logs.get_delivery_source(name=expected_name)["deliverySource"]
+                self.sources[expected_name] = source.get("resourceArns", [])
+                if resource_arn in self.sources[expected_name]:
+                    self.load()
+                    source_name = expected_name
+            except self.logs.exceptions.ResourceNotFoundException:
+                pass
+
+        if source_name is None:
+            return None, False
+        return source_name, self.has_delivery(source_name)
+
+    def has_delivery(self, source_name, destination_arn=None):
+        return any(source == source_name and destination_arn in (None, destination) for source, destination in self.deliveries.values())
+
+    def record_source(self, name, resource_arn):
+        self.sources[name] = [resource_arn]
+
+    def record_destination(self, name, arn):
+        self.destinations[name] = arn
+
+    def record_delivery(self, delivery):
+        self.deliveries[delivery["id"]] = (delivery["deliverySourceName"], delivery["deliveryDestinationArn"])
+
+    def apply_event(self, record):
+        event_name = record.event_name
+        if event_name not in DELIVERY_EVENTS:
+            return False
+        if record.error_code or self.loaded_at is None:
+            return True
+
+        parameters = record.request_parameters
+        response = record.response_elements
+        if event_name == "PutDeliverySource" and parameters.get("name") and parameters.get("resourceArn"):
+            self.record_source(parameters["name"], parameters["resourceArn"])
+        elif event_name == "DeleteDeliverySource" and parameters.get("name"):
+            self.sources.pop(parameters["name"], None)
+        elif event_name == "PutDeliveryDestination" and (response.get("deliveryDestination") or {}).get("arn"):
+            self.record_destination(response["deliveryDestination"]["name"], response["deliveryDestination"]["arn"])
+        elif event_name == "DeleteDeliveryDestination" and parameters.get("name"):
+            self.destinations.pop(parameters["name"], None)
+        elif event_name == "CreateDelivery" and (response.get("delivery") or {}).get("id"):
+            self.record_delivery(response["delivery"])
+        elif event_name == "DeleteDelivery" and parameters.get("id"):
+            self.deliveries.pop(parameters["id"], None)
+        else:
+            self.invalidate()
+
+        logger.info(f"Delivery inventory updated with the event {event_name}")
+        return True
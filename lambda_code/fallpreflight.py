@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
+
+PREFLIGHT_FAILURE_TTL_SECONDS = int(os.environ.get("PREFLIGHT_FAILURE_TTL_SECONDS", "300"))   # A failed check is repeated after this time, so a fixed Key or Role is detected without a new deployment.
+
+# Error codes that do not tell us anything about the configuration, the check is skipped and the real call decides.
+
+INCONCLUSIVE_ERRORS = ("AccessDenied", "AccessDeniedException", "Throttling", "ThrottlingException", "RequestLimitExceeded",
+                       "ServiceUnavailable", "ServiceFailure", "InternalFailure", "KMSInternalException", "DependencyTimeoutException")
+
+"""
+Pre-flight validation of the configuration of the FALL Lambda Functions. Before the first mutation of an invocation the
+handlers validate their inputs (the KMS Key with kms:DescribeKey, the IAM Roles passed to AWS services with iam:GetRole
+and the regions supported by the static tables) and raise PreflightError with every problem found, so a bad
+configuration never leaves an empty bucket or a Log Group without Flow Log behind.
+
+The result of each check is cached in the container: a valid input is validated only once, and a failed one is validated
+again after PREFLIGHT_FAILURE_TTL_SECONDS. When a check cannot be completed (e.g. the key policy does not allow
+kms:DescribeKey to our role, which the service using the key does not need), a warning is logged and the check passes.
+"""
+
+class PreflightError(Exception):
+    pass
+
+results = {}
+clients = {}
+
+def client(service, region=None):
+    key = (service, region)
+    if key not in clients:
+        clients[key] = boto3.client(service, region_name=region) if region else boto3.client(service)
+    return clients[key]
+
+# This function runs a check only when its result is not cached, validate returns the error message or None.
+
+def cached(key, validate):
+    result = results.get(key)
+    if result and (result[0] is None or time.time() - result[1] < PREFLIGHT_FAILURE_TTL_SECONDS):
+        return result[0]
+
+    try:
+        error = validate()
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in INCONCLUSIVE_ERRORS:
+            logger.warning(f"Pre-flight check {key[0]} of {key[1]} skipped: {code}")
+            error = None
+        else:
+            error = f"{code}: {e.response['Error'].get('Message', '')}"
+
+    results[key] = (error, time.time())
+    return error
+
+# The KMS Key must be enabled, symmetric and in the same region of the Bucket or Log Group encrypted with it.
+
+def check_kms_key(key_arn, region, name="KMS_KEY_ARN"):
+    if not key_arn:
+        return f"{name} is not set"
+
+    def validate():
+        parts = key_arn.split(":")
+        key_region = parts[3] if key_arn.startswith("arn:") and len(parts) > 5 else region
+        if key_region != region:
+            return f"the key is in {key_region}, it must be in {region}"
+
+        metadata = client('kms', key_region).describe_key(KeyId=key_arn)['KeyMetadata']
+        if metadata['KeyState'] != 'Enabled':
+            return f"the key is {metadata['KeyState']}"
+        if metadata.get('KeyUsage') != 'ENCRYPT_DECRYPT' or metadata.get('KeySpec', 'SYMMETRIC_DEFAULT') != 'SYMMETRIC_DEFAULT':
+            return "the key is not a symmetric encryption key"
+        return None
+
+    error = cached(("kms:DescribeKey", key_arn, region), validate)
+    return f"{name} {key_arn}: {error}" if error else None
+
+# The IAM Role must exist and trust the AWS service that assumes it (e.g. vpc-flow-logs.amazonaws.com).
+
+def check_role(role_arn, service, name):
+    if not role_arn:
+        return f"{name} is not set"
+
+    def validate():
+        role = client('iam').get_role(RoleName=role_arn.rsplit("/", 1)[-1])['Role']
+        if role['Arn'] != role_arn:
+            return f"the existing Role is {role['Arn']}"
+
+        for statement in role['AssumeRolePolicyDocument'].get('Statement', []):
+            services = statement.get('Principal', {}).get('Service', [])
+            services = [services] if isinstance(services, str) else services
+            if statement.get('Effect') == 'Allow' and service in services:
+                return None
+        return f"the Role does not trust {service}"
+
+    error = cached(("iam:GetRole", role_arn, service), validate)
+    return f"{name} {role_arn}: {error}" if error else None
+
+def check_region(region, supported, feature):
+    if region not in supported:
+        return f"{feature} is not supported in the region {region} (supported: {', '.join(sorted(supported))})"
+    return None
+
+# This function raises PreflightError with every failed check, the arguments are the results of the check functions.
+
+def require(*errors):
+    errors = [error for error in errors if error]
+    if errors:
+        raise PreflightError("Pre-flight validation failed: " + "; ".join(errors))
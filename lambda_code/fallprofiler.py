@@ -0,0 +1,87 @@
+import io
+import os
+import time
+import random
+import pstats
+import cProfile
+import logging
+import functools
+import tracemalloc
+
+logger = logging.getLogger()
+
+# Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))                 # Fraction of the invocations profiled, 0 disables the profiler.
+PROFILE_COLD_START = os.environ.get("PROFILE_COLD_START", "false").lower() == "true"     # Profile the imports and the first invocation of every new container.
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "25"))                                  # Functions and allocations written to the log.
+PROFILE_DUMP_DIR = os.environ.get("PROFILE_DUMP_DIR", "")                               # Optional folder (e.g. /tmp) where the .prof file of each profile is written.
+PROFILE_TRACEBACK_FRAMES = int(os.environ.get("PROFILE_TRACEBACK_FRAMES", "1"))         # Frames stored by tracemalloc for each allocation.
+
+"""
+Opt-in profiler of the FALL Lambda Functions. The handlers decorate lambda_handler with @profiled, when
+PROFILE_SAMPLE_RATE is 0 (default) the decorator only adds a random() call to each invocation. In a sampled invocation
+the handler runs under cProfile and tracemalloc, and the top functions by cumulative time and the top allocations are
+written to the log, together with the peak memory. With PROFILE_DUMP_DIR the profile is also written as a .prof file
+that can be opened with pstats or snakeviz (e.g. after copying it from an invocation with a debugger or a layer).
+
+This module must be the first one imported by each handler, with PROFILE_COLD_START the profiler is started here so the
+import of boto3 and the creation of the clients are included in the profile of the first invocation.
+"""
+
+IMPORT_STARTED = time.perf_counter()
+
+def start_profile():
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+cold_start_profiler = start_profile() if PROFILE_COLD_START and PROFILE_SAMPLE_RATE > 0 else None
+
+def profiled(handler):
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global cold_start_profiler
+        profiler, cold_start_profiler = cold_start_profiler, None
+        cold_start = profiler is not None
+
+        if profiler is None:
+            if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+                return handler(event, context)
+            profiler = start_profile()
+
+        started = time.perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            write_report(profiler, snapshot, peak, time.perf_counter() - started, cold_start, context)
+
+    return wrapper
+
+def write_report(profiler, snapshot, peak, duration, cold_start, context):
+    request_id = getattr(context, "aws_request_id", "local")
+    function_name = getattr(context, "function_name", "handler")
+
+    stats_output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stats_output)
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+
+    allocations = "\n".join(str(statistic) for statistic in snapshot.statistics("lineno")[:PROFILE_TOP])
+    header = f"Profile of {function_name} ({request_id}): handler {duration * 1000:.0f} ms, peak memory {peak / 1024:.0f} KiB"
+    if cold_start:
+        header += f", cold start including imports {(time.perf_counter() - IMPORT_STARTED) * 1000:.0f} ms"
+    logger.info(f"{header}\nTop functions by cumulative time:\n{stats_output.getvalue()}\nTop allocations:\n{allocations}")
+
+    if PROFILE_DUMP_DIR:
+        path = os.path.join(PROFILE_DUMP_DIR, f"{function_name}-{request_id}.prof")
+        try:
+            stats.dump_stats(path)
+            logger.info(f"Profile written to {path}")
+        except OSError as e:
+            logger.warning(f"Unable to write the profile to {path}: {e}")
@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import urllib.request
+from datetime import datetime, timezone
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# Retrieve the corresponding values from the Lambda Environment Variables (Defined in CloudFormation Template)
+
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE")                                   # DynamoDB Table shared by all the FALL Lambda Functions, if empty an in-memory limiter is used.
+RATE_LIMIT_ENDPOINT_URL = os.environ.get("RATE_LIMIT_ENDPOINT_URL")                     # Optional DynamoDB compatible endpoint (for example DynamoDB Local) used as stand-in.
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_WAIT_SECONDS", "10"))  # Max time an invocation waits for a token before deferring the event.
+RATE_LIMITS = os.environ.get("RATE_LIMITS")                                             # JSON used to override the quotas, e.g. {"s3:CreateBucket": {"rate": 2, "burst": 5}}
+RATE_LIMIT_RESERVED_SECONDS = float(os.environ.get("RATE_LIMIT_RESERVED_SECONDS", "5"))   # Time of the invocation never spent waiting, kept to finish the configuration and notify.
+DEFERRED_QUEUE_URL = os.environ.get("DEFERRED_QUEUE_URL")                               # SQS Queue where the deferred events are sent again with a delay, if empty Lambda retries them.
+DEFERRED_RETRY_DELAY_SECONDS = int(os.environ.get("DEFERRED_RETRY_DELAY_SECONDS", "60"))  # Delay of the first retry of a deferred event, doubled on each retry (max 900, the SQS limit).
+DEFERRED_EVENT_MAX_AGE_SECONDS = int(os.environ.get("DEFERRED_EVENT_MAX_AGE_SECONDS", "3600"))  # A deferred event older than this value is dropped and notified.
+WEBHOOK_GOOGLE_CHAT = os.environ.get("WEBHOOK_GOOGLE_CHAT")                             # Used to notify the events dropped after the retry window.
+
+# Default quotas (tokens per second and burst) for the control-plane mutations performed by the FALL Lambda Functions,
+# they are kept below the account quotas so the four functions together never flood them. Operations not listed here
+# are not rate limited.
+
+DEFAULT_RATE_LIMITS = {
+    "s3:CreateBucket": {"rate": 5, "burst": 10},
+    "s3:PutBucketConfiguration": {"rate": 20, "burst": 40},
+    "ec2:CreateFlowLogs": {"rate": 5, "burst": 10},
+    "logs:CreateLogGroup": {"rate": 5, "burst": 10},
+    "logs:PutDeliverySource": {"rate": 2, "burst": 5},
+    "logs:PutDeliveryDestination": {"rate": 2, "burst": 5},
+    "logs:CreateDelivery": {"rate": 2, "burst": 5},
+    "elasticloadbalancing:ModifyLoadBalancerAttributes": {"rate": 5, "burst": 10}
+}
+
+"""
+Token bucket rate limiter shared by the FALL Lambda Functions. Before each mutating API call the handlers call
+acquire(operation), the tokens of every operation are stored in a DynamoDB Table (one item per operation) and refilled
+according to the elapsed time, so the quota is respected by all the concurrent invocations of the four functions.
+
+If a token is not available within RATE_LIMIT_MAX_WAIT_SECONDS, RateLimitDeferred is raised. The handlers let this
+exception reach @rate_limited, which sends the EventBridge event to DEFERRED_QUEUE_URL with a delay of
+DEFERRED_RETRY_DELAY_SECONDS, doubled on each retry, and the queue invokes the function again with it. The event is
+retried while it is younger than DEFERRED_EVENT_MAX_AGE_SECONDS (by default 60s, 120s, 240s, 480s and then every 900s,
+about an hour), after that it is dropped and a notification is sent to WEBHOOK_GOOGLE_CHAT. Events not delivered by
+EventBridge (e.g. the synchronous invocations of tools/orchestrateorganization.py, which retries them itself) or
+received without DEFERRED_QUEUE_URL raise the exception to the caller. Calls that complete a configuration already
+started (for example the encryption of a bucket just created) use defer=False, they wait the same time but then
+continue, because retrying the event at that point would leave the resource half configured.
+
+The quotas are regional, so the tokens are stored in the table of the region whose API is called: the CloudFront
+delivery calls, always made to us-east-1, pass region="us-east-1" and share the tokens of that region.
+
+All the waits of an invocation are also bounded by its remaining time (lambda_handler is decorated with @rate_limited),
+keeping RATE_LIMIT_RESERVED_SECONDS free. Once that time is used, defer=True calls defer the event and defer=False calls
+continue without waiting, so several throttled calls can never exceed the Timeout of the function.
+"""
+
+class RateLimitDeferred(Exception):
+    def __init__(self, operation, waited):
+        super().__init__(f"Rate limit reached for {operation} after waiting {waited:.2f}s, the event will be retried later.")
+        self.operation = operation
+        self.waited = waited
+
+# This function returns the quotas in use, the values defined in RATE_LIMITS take precedence over the default ones.
+
+def load_rate_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    if RATE_LIMITS:
+        limits.update(json.loads(RATE_LIMITS))
+    return limits
+
+# Token buckets stored in DynamoDB, each item has the available tokens and the time of the last refill. Updates are
+# conditional on the last refill value read, so two invocations never consume the same token.
+
+class DynamoDBBackend:
+    def __init__(self, table_name, endpoint_url=None):
+        self.table_name = table_name
+        self.endpoint_url = endpoint_url
+        self.clients = {None: boto3.client("dynamodb", endpoint_url=endpoint_url)}
+
+    def client(self, region):
+        if region not in self.clients:
+            self.clients[region] = boto3.client("dynamodb", region_name=region, endpoint_url=self.endpoint_url)
+        return self.clients[region]
+
+    def try_consume(self, operation, rate, burst, now, region=None):
+        dynamodb = self.client(region)
+        item = dynamodb.get_item(
+            TableName=self.table_name,
+            Key={"operation": {"S": operation}},
+            ConsistentRead=True
+        ).get("Item")
+
+        if item:
+            last_refill = item["last_refill"]["N"]
+            tokens = min(burst, float(item["tokens"]["N"]) + (now - float(last_refill)) * rate)
+            condition = "#last_refill = :previous"
+            names = {"#tokens": "tokens", "#last_refill": "last_refill"}
+            values = {":previous": {"N": last_refill}}
+        else:
+            tokens = float(burst)
+            condition = "attribute_not_exists(#operation)"
+            names = {"#tokens": "tokens", "#last_refill": "last_refill", "#operation": "operation"}
+            values = {}
+
+        if tokens < 1:
+            return (1 - tokens) / rate
+
+        values.update({":tokens": {"N": repr(tokens - 1)}, ":now": {"N": repr(now)}})
+        try:
+            dynamodb.update_item(
+                TableName=self.table_name,
+                Key={"operation": {"S": operation}},
+                UpdateExpression="SET #tokens = :tokens, #last_refill = :now",
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return 0.05
+            raise
+        return 0
+
+# In-memory stand-in with the same behaviour, it only limits the invocations served by the same container and is used
+# when RATE_LIMIT_TABLE is not defined (local executions and tests).
+
+class LocalBackend:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def try_consume(self, operation, rate, burst, now, region=None):
+        with self.lock:
+            tokens, last_refill = self.buckets.get((region, operation), (float(burst), now))
+            tokens = min(burst, tokens + (now - last_refill) * rate)
+            if tokens < 1:
+                self.buckets[(region, operation)] = (tokens, now)
+                return (1 - tokens) / rate
+            self.buckets[(region, operation)] = (tokens - 1, now)
+            return 0
+
+class RateLimiter:
+    def __init__(self, backend, limits, max_wait):
+        self.backend = backend
+        self.limits = limits
+        self.max_wait = max_wait
+        self.waited = {}
+        self.deadline = None
+
+    # Called at the start of each invocation, the waits of the invocation must end before the deadline.
+
+    def start(self, context):
+        remaining = getattr(context, "get_remaining_time_in_millis", None)
+        self.deadline = time.monotonic() + remaining() / 1000 - RATE_LIMIT_RESERVED_SECONDS if remaining else None
+
+    # Waits until a token of the operation is available, the time waited is accumulated per operation and logged so the
+    # queue wait can be metered from CloudWatch Logs. region is only given when the API is called in another region.
+
+    def acquire(self, operation, defer=True, region=None):
+        limit = self.limits.get(operation)
+        if not limit:
+            return 0
+
+        max_wait = self.max_wait
+        if self.deadline is not None:
+            max_wait = max(0, min(max_wait, self.deadline - time.monotonic()))
+
+        started = time.monotonic()
+        while True:
+            wait = self.backend.try_consume(operation, limit["rate"], limit["burst"], time.time(), region)
+            waited = time.monotonic() - started
+            if wait == 0:
+                break
+            if waited + wait > max_wait:
+                self.record(operation, waited)
+                if defer:
+                    raise RateLimitDeferred(operation, waited)
+                logger.warning(f"Rate limit reached for {operation}, continuing to complete the configuration in progress.")
+                return waited
+            time.sleep(wait)
+
+        self.record(operation, waited)
+        return waited
+
+    def record(self, operation, waited):
+        self.waited[operation] = self.waited.get(operation, 0) + waited
+        if waited > 0:
+            logger.info(f"Rate limiter waited {waited * 1000:.0f} ms for {operation}")
+
+# The limiter is created once per container, the same object is reused by all the invocations it serves.
+
+limiter = RateLimiter(
+    DynamoDBBackend(RATE_LIMIT_TABLE, RATE_LIMIT_ENDPOINT_URL) if RATE_LIMIT_TABLE else LocalBackend(),
+    load_rate_limits(),
+    RATE_LIMIT_MAX_WAIT_SECONDS
+)
+
+def acquire(operation, defer=True, region=None):
+    return limiter.acquire(operation, defer, region)
+
+sqs = boto3.client("sqs") if DEFERRED_QUEUE_URL else None
+
+# The decorated handler receives the EventBridge events and the messages of DEFERRED_QUEUE_URL (one per invocation, the
+# Event Source Mapping uses BatchSize 1), each message holds the deferred event, the retries made and the time of the
+# event (or of its first deferral when the event has no time).
+
+def rate_limited(handler):
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if isinstance(event, dict) and event.get("Records") and event["Records"][0].get("eventSource") == "aws:sqs":
+            results = []
+            for message in event["Records"]:
+                body = json.loads(message["body"])
+                results.append(run(handler, body["event"], context, body["retries"], body["since"]))
+            return results[0] if len(results) == 1 else {"status": "batch", "results": results}
+        return run(handler, event, context, 0, None)
+    return wrapper
+
+def run(handler, event, context, retries, since):
+    limiter.start(context)
+    try:
+        return handler(event, context)
+    except RateLimitDeferred as e:
+        if not DEFERRED_QUEUE_URL or not isinstance(event, dict) or "id" not in event:
+            raise
+        return requeue(event, retries, since or event_time(event), e)
+
+# This function sends the event again to the queue, or drops it (with a notification) when the next retry would be made
+# after DEFERRED_EVENT_MAX_AGE_SECONDS.
+
+def requeue(event, retries, since, error):
+    delay = min(900, DEFERRED_RETRY_DELAY_SECONDS * 2 ** retries)
+    age = time.time() - since
+    if age + delay > DEFERRED_EVENT_MAX_AGE_SECONDS:
+        message = f"Event {event['id']} ({event.get('detail', {}).get('eventName', event.get('detail-type'))}) dropped after {retries} retries in {age:.0f}s: {error}"
+        logger.error(message)
+        notify_dropped(message)
+        return {"status": "error", "message": message}
+
+    sqs.send_message(
+        QueueUrl=DEFERRED_QUEUE_URL,
+        MessageBody=json.dumps({"event": event, "retries": retries + 1, "since": since}),
+        DelaySeconds=delay
+    )
+    logger.info(f"Event {event['id']} deferred, retry {retries + 1} in {delay}s: {error}")
+    return {"status": "deferred", "message": str(error)}
+
+def event_time(event):
+    try:
+        return datetime.strptime(event["time"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+def notify_dropped(message):
+    if not WEBHOOK_GOOGLE_CHAT:
+        return
+    data = json.dumps({"text": f"FALL - Force and Lock Logs: {message}"}).encode("utf-8")
+    request = urllib.request.Request(WEBHOOK_GOOGLE_CHAT, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+    except Exception as e:
+        logger.error(f"Error sending the notification of the dropped event: {e}")
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+import aggregatevpcflowlogs
+from aggregatevpcflowlogs import main, read_chunks, FlowLogAggregator
+from logsources import open_location
+
+# Records of the AWS documentation (Flow log record examples), plus one NODATA and one SKIPDATA record.
+
+def write_flow_logs(path):
+    table = pa.table({
+        "version": [2, 2, 2, 2],
+        "account_id": ["123456789012"] * 4,
+        "interface_id": ["eni-1235b8ca123456789", "eni-1235b8ca123456789", "eni-11111111111111111", "eni-22222222222222222"],
+        "srcaddr": ["172.31.16.139", "172.31.9.69", None, None],
+        "dstaddr": ["172.31.16.21", "172.31.9.12", None, None],
+        "srcport": [20641, 49761, None, None],
+        "dstport": [22, 3389, None, None],
+        "protocol": [6, 6, None, None],
+        "packets": [20, 20, None, None],
+        "bytes": [4249, 4249, None, None],
+        "start": [1418530010, 1418530010, 1431280876, 1431280876],
+        "end": [1418530070, 1418530070, 1431280934, 1431280934],
+        "action": ["ACCEPT", "REJECT", None, None],
+        "log_status": ["OK", "OK", "NODATA", "SKIPDATA"]
+    })
+    pq.write_table(table, path)
+
+def test_parquet_records_without_data_are_skipped(tmp_path):
+    write_flow_logs(tmp_path / "flowlogs.parquet")
+    chunks = list(read_chunks(open_location(str(tmp_path)), "flowlogs.parquet", "parquet", 2))
+
+    aggregator = FlowLogAggregator(24)
+    for chunk in chunks:
+        aggregator.add_chunk(chunk)
+
+    assert aggregator.records == 2
+    assert aggregator.summary(5)["rejects"]["eni_port"] == [{"key": "eni-1235b8ca123456789:3389", "records": 1, "packets": 20, "bytes": 4249}]
+
+def test_parquet_summary(tmp_path):
+    source = tmp_path / "source"
+    source.mkdir()
+    write_flow_logs(source / "flowlogs.parquet")
+
+    assert main(["--source", str(source), "--input-format", "parquet", "--output", str(tmp_path / "summary.json")]) == 0
+    summary = json.loads((tmp_path / "summary.json").read_text())
+
+    assert summary["records"] == 2
+    assert summary["truncated"] is False
+    assert summary["top_talkers"]["eni"] == [{"key": "eni-1235b8ca123456789", "records": 2, "packets": 40, "bytes": 8498}]
+    assert {entry["key"] for entry in summary["top_talkers"]["src_cidr"]} == {"172.31.16.0/24", "172.31.9.0/24"}
+    assert summary["port_histograms"] == {"ACCEPT": {"22": [1, 20, 4249]}, "REJECT": {"3389": [1, 20, 4249]}}
+
+def test_pruned_rollups_are_reported(monkeypatch):
+    monkeypatch.setattr(aggregatevpcflowlogs, "MAX_KEYS", 2)
+    aggregator = FlowLogAggregator(24)
+    aggregator.add_chunk({
+        "interface_id": ["eni-1", "eni-2", "eni-3"],
+        "srcaddr": ["10.0.0.1"] * 3,
+        "dstaddr": ["10.0.1.1"] * 3,
+        "dstport": [443] * 3,
+        "packets": [1, 2, 3],
+        "bytes": [100, 200, 300],
+        "action": ["ACCEPT"] * 3
+    })
+
+    summary = aggregator.summary(5)
+    assert summary["truncated"] is True
+    assert summary["pruned"] == {"top_talkers.eni": {"entries": 2, "records": 2, "packets": 3, "bytes": 300}}
+    assert summary["top_talkers"]["eni"] == [{"key": "eni-3", "records": 1, "packets": 3, "bytes": 300}]
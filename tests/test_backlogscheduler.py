@@ -0,0 +1,78 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from backlogscheduler import PriorityScheduler, classify_priority
+
+def drain(scheduler, count=None):
+    popped = []
+    while count is None or len(popped) < count:
+        item = scheduler.pop()
+        if item is None:
+            break
+        popped.append(item[:4])
+    return popped
+
+def test_services_are_served_by_weight():
+    scheduler = PriorityScheduler({"elb": 3, "s3": 1})
+    for number in range(8):
+        scheduler.push("normal", "elb", "111111111111", f"elb-{number}")
+        scheduler.push("normal", "s3", "111111111111", f"bucket-{number}")
+
+    services = [service for _, service, _, _ in drain(scheduler, 8)]
+
+    assert services[:4] == ["elb", "elb", "s3", "elb"]
+    assert services.count("elb") == 6 and services.count("s3") == 2
+    assert scheduler.depths()["normal"] == 8
+
+def test_classes_are_served_in_strict_order():
+    scheduler = PriorityScheduler({})
+    scheduler.push("low", "vpc", "111111111111", "vpc-default")
+    scheduler.push("normal", "s3", "111111111111", "bucket")
+    scheduler.push("critical", "elb", "111111111111", "payments-alb")
+
+    assert [priority for priority, _, _, _ in drain(scheduler)] == ["critical", "normal", "low"]
+    assert scheduler.pop() is None
+
+def test_accounts_of_a_service_are_served_in_rotation():
+    scheduler = PriorityScheduler({})
+    for number in range(3):
+        scheduler.push("normal", "s3", "111111111111", f"a-{number}")
+    scheduler.push("normal", "s3", "222222222222", "b-0")
+
+    assert [item for _, _, _, item in drain(scheduler)] == ["a-0", "b-0", "a-1", "a-2"]
+
+def test_blocked_account_is_skipped_until_unblocked():
+    scheduler = PriorityScheduler({})
+    scheduler.push("normal", "s3", "111111111111", "a-0")
+    scheduler.push("normal", "s3", "222222222222", "b-0")
+    scheduler.push("normal", "s3", "111111111111", "a-1")
+    scheduler.block("111111111111")
+
+    assert drain(scheduler) == [("normal", "s3", "222222222222", "b-0")]
+    assert len(scheduler) == 2
+
+    # Items pushed while blocked do not put the account back in the rotation.
+    scheduler.push("high", "elb", "111111111111", "alb")
+    assert scheduler.pop() is None
+
+    scheduler.unblock("111111111111")
+    assert [item for _, _, _, item in drain(scheduler)] == ["alb", "a-0", "a-1"]
+
+def test_metrics_report_depth_and_time_to_enable():
+    scheduler = PriorityScheduler({"elb": 2})
+    scheduler.push("high", "elb", "111111111111", "alb", queued_at=scheduler.started - 10)
+    priority, _, _, _, queued_at = scheduler.pop()
+    scheduler.completed(priority, queued_at)
+
+    metrics = scheduler.metrics()["classes"]["high"]
+    assert metrics["completed"] == 1 and metrics["max_queue_depth"] == 1
+    assert metrics["time_to_enable_seconds"]["max"] >= 10
+
+def test_priority_from_exposure_environment_and_tag():
+    assert classify_priority("elb", {"scheme": "internet-facing"}, {}) == "high"
+    assert classify_priority("elb", {"scheme": "internet-facing"}, {"environment": "prod"}) == "critical"
+    assert classify_priority("vpc", {"is_default": True}, {"env": "dev"}) == "low"
+    assert classify_priority("cloudfront", {"enabled": False}, {"stage": "production"}) == "normal"
+    assert classify_priority("s3", {}, {"loggingpriority": "critical", "environment": "sandbox"}) == "critical"
@@ -0,0 +1,94 @@
+import os
+import sys
+import gzip
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from compactlogobjects import classify, compact_bucket, purge_originals, load_reader, MANIFESTS_PREFIX
+from indexs3accesslogs import update_index
+from logsources import open_location
+
+def test_cloudfront_default_and_suffix_paths():
+    assert classify("AWSLogs/123456789012/CloudFront/E1ABCDEF2GHIJK.2024-11-14-21.a1b2c3d4.gz") == ("cloudfront/123456789012/E1ABCDEF2GHIJK", "2024/11/14/21")
+    assert classify("AWSLogs/123456789012/CloudFront/E1ABCDEF2GHIJK/2024/11/14/21/E1ABCDEF2GHIJK.2024-11-14-21.a1b2c3d4.gz") == ("cloudfront/123456789012/E1ABCDEF2GHIJK", "2024/11/14/21")
+
+def test_cloudfront_hive_compatible_path():
+    key = "AWSLogs/aws-account-id=123456789012/CloudFront/DistributionId=E1ABCDEF2GHIJK/year=2024/month=11/day=14/hour=21/E1ABCDEF2GHIJK.2024-11-14-21.a1b2c3d4.gz"
+    assert classify(key) == ("cloudfront/123456789012/E1ABCDEF2GHIJK", "2024/11/14/21")
+
+def test_parquet_and_compacted_objects_are_not_compacted():
+    assert classify("AWSLogs/123456789012/CloudFront/E1ABCDEF2GHIJK/2024/11/14/21/E1ABCDEF2GHIJK.2024-11-14-21.a1b2c3d4.parquet") is None
+    assert classify("AWSLogs/aws-account-id=123456789012/CloudFront/DistributionId=E1ABCDEF2GHIJK/E1ABCDEF2GHIJK.2024-11-14-21.a1b2c3d4.parquet") is None
+    assert classify("compacted/cloudfront/123456789012/E1ABCDEF2GHIJK/2024/11/14/21/part-0123456789abcdef.log.gz") is None
+
+RECORD = ('79a59df900b949e55d96a1e698fbacedfd6e09d98eacf8f8d5218e7cd47ef2be amzn-s3-demo-bucket1 [06/Feb/2019:00:{second} +0000] '
+          '192.0.2.3 79a59df900b949e55d96a1e698fbacedfd6e09d98eacf8f8d5218e7cd47ef2be 3E57427F3EXAMPLE REST.GET.OBJECT '
+          'photos/2019/puppy.jpg "GET /amzn-s3-demo-bucket1/photos/2019/puppy.jpg HTTP/1.1" 200 - 113 113 7 - "-" "S3Console/0.4" -')
+
+ORIGINALS = ["logs/2019-02-06-00-00-38-0000000000000001", "logs/2019-02-06-00-05-12-0000000000000002", "logs/2019-02-06-00-09-51-0000000000000003"]
+ALONE = "logs/2019-02-06-01-00-02-0000000000000004"
+
+def delivered_bucket(tmp_path):
+    root = tmp_path / "bucket"
+    (root / "logs").mkdir(parents=True)
+    for number, key in enumerate(ORIGINALS + [ALONE]):
+        (root / key).write_text(RECORD.format(second=f"{number:02d}:00") + "\n")
+    return open_location(str(root))
+
+def manifests(bucket):
+    return [json.loads(bucket.get_bytes(item["Key"])) for item in bucket.list_objects(MANIFESTS_PREFIX)]
+
+def keys(bucket):
+    return {item["Key"] for item in bucket.list_objects()}
+
+def test_compact_merges_the_hour_and_writes_the_manifest(tmp_path):
+    bucket = delivered_bucket(tmp_path)
+    originals = {item["Key"]: item for item in bucket.list_objects("logs/")}
+
+    compact_bucket(bucket, 2, 2)
+
+    [manifest] = manifests(bucket)
+    assert manifest["source"] == "s3"
+    assert manifest["hour"] == "2019/02/06/00"
+    assert manifest["lines"] == 3
+    assert manifest["purged"] is False
+    assert manifest["originals"] == [{"Key": key, "ETag": originals[key]["ETag"], "Size": originals[key]["Size"]} for key in ORIGINALS]
+
+    assert manifest["compacted_key"].startswith("compacted/s3/2019/02/06/00/part-")
+    merged = gzip.decompress(bucket.get_bytes(manifest["compacted_key"])).decode("utf-8").splitlines()
+    assert merged == [bucket.get_bytes(key).decode("utf-8").strip() for key in ORIGINALS]
+
+def test_purge_only_deletes_the_originals_of_a_manifest(tmp_path):
+    bucket = delivered_bucket(tmp_path)
+    compact_bucket(bucket, 2, 2)
+
+    purge_originals(bucket, dry_run=True)
+    assert set(ORIGINALS) <= keys(bucket)
+
+    purge_originals(bucket, dry_run=False)
+    assert not set(ORIGINALS) & keys(bucket)
+    assert ALONE in keys(bucket)
+    assert manifests(bucket)[0]["purged"] is True
+
+def test_purge_waits_for_the_readers_of_the_originals(tmp_path):
+    bucket = delivered_bucket(tmp_path)
+    compact_bucket(bucket, 2, 2)
+    index = tmp_path / "index"
+    reader = f"s3-index={index}"
+
+    purge_originals(bucket, False, [load_reader(reader, None)])
+    assert set(ORIGINALS) <= keys(bucket)
+    assert manifests(bucket)[0]["purged"] is False
+
+    update_index([bucket.name], str(index), None, 2)
+    purge_originals(bucket, False, [load_reader(reader, None)])
+    assert not set(ORIGINALS) & keys(bucket)
+    assert manifests(bucket)[0]["purged"] is True
+
+def test_readers_of_other_sources_do_not_block_the_purge(tmp_path):
+    bucket = delivered_bucket(tmp_path)
+    compact_bucket(bucket, 2, 2)
+
+    purge_originals(bucket, False, [load_reader(f"cloudfront-rollups={tmp_path / 'rollups'}", None)])
+    assert not set(ORIGINALS) & keys(bucket)
@@ -0,0 +1,65 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from convertelblogstoparquet import main, parse_line, NLB_FIELDS, ALB_FIELDS
+from logsources import Checkpoint
+
+# Example entries of the AWS documentation (Access logs for your Network Load Balancer / Application Load Balancer).
+
+NLB_LINE = (
+    'tls 2.0 2018-12-20T02:59:40 net/my-network-loadbalancer/c6e77e28c25b2234 g3d4b5e8bb8464cd '
+    '72.21.218.154:51341 172.100.100.185:443 5 2 98 246 - '
+    'arn:aws:acm:us-east-2:671290407336:certificate/2a108f19-aded-46b0-8493-c63eb1ef4a99 - '
+    'ECDHE-RSA-AES128-SHA tlsv12 - my-network-loadbalancer-c6e77e28c25b2234.elb.us-east-2.amazonaws.com '
+    'h2 h2 "h2","http/1.1" 2020-04-01T08:51:42'
+)
+
+ALB_LINE = (
+    'https 2018-07-02T22:23:00.186641Z app/my-loadbalancer/50dc6c495c0c9188 192.168.131.39:2817 10.0.0.1:80 '
+    '0.086 0.048 0.037 200 200 0 57 "GET https://www.example.com:443/ HTTP/1.1" "curl/7.46.0" '
+    'ECDHE-RSA-AES128-GCM-SHA256 TLSv1.2 '
+    'arn:aws:elasticloadbalancing:us-east-2:123456789012:targetgroup/my-targets/73e2d6bc24d8a067 '
+    '"Root=1-58337281-1d84f3d73c47ec4e58577259" "www.example.com" '
+    '"arn:aws:acm:us-east-2:123456789012:certificate/12345678-1234-1234-1234-123456789012" 1 '
+    '2018-07-02T22:22:48.364000Z "authenticate,forward" "-" "-" "10.0.0.1:80" "200" "-" "-" TID_123456'
+)
+
+def as_record(fields, values):
+    return dict(zip([name for name, _ in fields], values))
+
+def test_nlb_alpn_client_preference_list_is_one_field():
+    log_format, values = parse_line(NLB_LINE)
+    record = as_record(NLB_FIELDS, values)
+
+    assert log_format == "nlb"
+    assert record["alpn_fe_protocol"] == "h2"
+    assert record["alpn_be_protocol"] == "h2"
+    assert record["alpn_client_preference_list"] == "h2,http/1.1"
+    assert record["tls_connection_creation_time"] == "2020-04-01T08:51:42"
+
+def test_alb_quoted_fields_are_not_merged():
+    log_format, values = parse_line(ALB_LINE)
+    record = as_record(ALB_FIELDS, values)
+
+    assert log_format == "alb"
+    assert record["request"] == "GET https://www.example.com:443/ HTTP/1.1"
+    assert record["user_agent"] == "curl/7.46.0"
+    assert record["actions_executed"] == "authenticate,forward"
+    assert record["target_status_code_list"] == "200"
+    assert record["conn_trace_id"] == "TID_123456"
+
+def test_checkpoint_is_saved_every_n_objects(tmp_path, monkeypatch):
+    folder = tmp_path / "source" / "AWSLogs" / "123456789012" / "elasticloadbalancing" / "us-east-2" / "2018" / "12" / "20"
+    folder.mkdir(parents=True)
+    for number in range(5):
+        name = f"123456789012_elasticloadbalancing_us-east-2_net.my-network-loadbalancer.c6e77e28c25b2234_20181220T0{number}00Z_172.160.001.192_{number:08d}.log"
+        (folder / name).write_text(NLB_LINE + "\n")
+    saves = []
+    save = Checkpoint.save
+    monkeypatch.setattr(Checkpoint, "save", lambda self, location=None: (saves.append(len(self.entries)), save(self, location)))
+
+    main(["--source", str(tmp_path / "source"), "--output", str(tmp_path / "output"), "--checkpoint-every", "2"])
+
+    assert saves == [2, 4, 5]
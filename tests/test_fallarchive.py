@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+
+import fallarchive
+from fallarchive import configure_replication
+
+ROLE_ARN = "arn:aws:iam::123456789012:role/iamrole-fall-log-archive-replication"
+KMS_KEY_ARN = "arn:aws:kms:us-east-1:210987654321:key/1234abcd-12ab-34cd-56ef-1234567890ab"
+
+class StubS3:
+    def __init__(self):
+        self.calls = []
+
+    def put_bucket_versioning(self, **kwargs):
+        self.calls.append(("put_bucket_versioning", kwargs))
+
+    def put_bucket_replication(self, **kwargs):
+        self.calls.append(("put_bucket_replication", kwargs))
+
+@pytest.fixture
+def archive(monkeypatch):
+    acquired = []
+    monkeypatch.setattr(fallarchive, "acquire", lambda operation, defer=True, region=None: acquired.append((operation, defer)))
+    monkeypatch.setattr(fallarchive, "ARCHIVE_BUCKET", "s3bkt-fall-log-archive")
+    monkeypatch.setattr(fallarchive, "ARCHIVE_ACCOUNT_ID", "210987654321")
+    monkeypatch.setattr(fallarchive, "ARCHIVE_KMS_KEY_ARN", KMS_KEY_ARN)
+    monkeypatch.setattr(fallarchive, "ARCHIVE_REPLICATION_ROLE_ARN", ROLE_ARN)
+    monkeypatch.setattr(fallarchive, "ARCHIVE_STORAGE_CLASS", "STANDARD_IA")
+    return acquired
+
+def test_replication_of_an_sse_s3_bucket(archive):
+    s3 = StubS3()
+
+    assert configure_replication(s3, "s3bkt-access-logging-elb-123456789012-us-east-1", kms_encrypted=False)
+
+    assert s3.calls == [
+        ("put_bucket_versioning", {"Bucket": "s3bkt-access-logging-elb-123456789012-us-east-1", "VersioningConfiguration": {"Status": "Enabled"}}),
+        ("put_bucket_replication", {
+            "Bucket": "s3bkt-access-logging-elb-123456789012-us-east-1",
+            "ReplicationConfiguration": {
+                "Role": ROLE_ARN,
+                "Rules": [{
+                    "ID": "ReplicationToLogArchive",
+                    "Priority": 1,
+                    "Status": "Enabled",
+                    "Filter": {"Prefix": ""},
+                    "DeleteMarkerReplication": {"Status": "Disabled"},
+                    "Destination": {
+                        "Bucket": "arn:aws:s3:::s3bkt-fall-log-archive",
+                        "StorageClass": "STANDARD_IA",
+                        "Account": "210987654321",
+                        "AccessControlTranslation": {"Owner": "Destination"}
+                    }
+                }]
+            }
+        })
+    ]
+    assert archive == [("s3:PutBucketConfiguration", False), ("s3:PutBucketConfiguration", False)]
+
+def test_replication_of_a_kms_encrypted_bucket(archive):
+    s3 = StubS3()
+
+    configure_replication(s3, "s3bkt-access-logging-cloudfront-123456789012", kms_encrypted=True)
+
+    rule = s3.calls[1][1]["ReplicationConfiguration"]["Rules"][0]
+    assert rule["SourceSelectionCriteria"] == {"SseKmsEncryptedObjects": {"Status": "Enabled"}}
+    assert rule["Destination"]["EncryptionConfiguration"] == {"ReplicaKmsKeyID": KMS_KEY_ARN}
+
+def test_replicas_in_the_same_account_keep_the_owner(archive, monkeypatch):
+    monkeypatch.setattr(fallarchive, "ARCHIVE_ACCOUNT_ID", "")
+    s3 = StubS3()
+
+    configure_replication(s3, "s3bkt-access-logging-s3-123456789012-us-east-1", kms_encrypted=False)
+
+    destination = s3.calls[1][1]["ReplicationConfiguration"]["Rules"][0]["Destination"]
+    assert "Account" not in destination and "AccessControlTranslation" not in destination
+
+def test_kms_encrypted_bucket_requires_the_archive_key(archive, monkeypatch):
+    monkeypatch.setattr(fallarchive, "ARCHIVE_KMS_KEY_ARN", "")
+    s3 = StubS3()
+
+    with pytest.raises(Exception, match="ARCHIVE_KMS_KEY_ARN"):
+        configure_replication(s3, "s3bkt-access-logging-cloudfront-123456789012", kms_encrypted=True)
+    assert s3.calls == []
+
+def test_nothing_is_configured_without_the_archive(archive, monkeypatch):
+    monkeypatch.setattr(fallarchive, "ARCHIVE_BUCKET", "")
+    s3 = StubS3()
+
+    assert not configure_replication(s3, "s3bkt-access-logging-elb-123456789012-us-east-1", kms_encrypted=True)
+    assert s3.calls == [] and archive == []
@@ -0,0 +1,92 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("TRANSITION_IN_DAYS", "30")
+os.environ.setdefault("STORAGE_CLASS", "GLACIER_IR")
+os.environ.setdefault("EXPIRATION_IN_DAYS", "365")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+
+import enableelbaccesslogs
+from fallevent import parse_event, InvalidEvent, RESOURCE_PARSERS
+
+LB_ARN = "arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app/my-alb/50dc6c495c0c9188"
+
+def eventbridge(event_name, request_parameters=None, response_elements=None, error_code=None, identity=None):
+    detail = {
+        "eventName": event_name,
+        "eventSource": "ec2.amazonaws.com",
+        "awsRegion": "us-east-2",
+        "userIdentity": {"accountId": "123456789012", "arn": "arn:aws:iam::123456789012:user/alice"} if identity is None else identity,
+        "requestParameters": request_parameters,
+        "responseElements": response_elements
+    }
+    if error_code:
+        detail["errorCode"] = error_code
+    return {"id": "7bf73129-1428-4cd3-a780-95db273d1602", "account": "210987654321", "region": "eu-west-1", "detail": detail}
+
+def test_parse_event_reads_the_fields_used_by_the_handlers():
+    record = parse_event(eventbridge("CreateVpc", {"cidrBlock": "10.0.0.0/16"}, {"vpc": {"vpcId": "vpc-0123456789abcdef0"}}))
+
+    assert record.event_name == "CreateVpc"
+    assert record.event_source == "ec2.amazonaws.com"
+    assert record.region == "us-east-2"
+    assert record.account_id == "123456789012"
+    assert record.principal == "arn:aws:iam::123456789012:user/alice"
+    assert record.error_code is None
+    assert record.request_parameters == {"cidrBlock": "10.0.0.0/16"}
+    assert record.resource_id == "vpc-0123456789abcdef0"
+
+def test_parse_event_falls_back_to_the_envelope_and_principal_id():
+    event = eventbridge("PutDeliverySource", None, None, identity={"principalId": "AIDAEXAMPLE"})
+    del event["detail"]["awsRegion"]
+
+    record = parse_event(event)
+
+    assert record.region == "eu-west-1"
+    assert record.account_id == "210987654321"
+    assert record.principal == "AIDAEXAMPLE"
+    assert record.request_parameters == {} and record.response_elements == {}
+    assert record.resource_id is None
+
+@pytest.mark.parametrize("event_name, request_parameters, response_elements, resource_id", [
+    ("CreateVpc", {}, {"vpc": {"vpcId": "vpc-0123456789abcdef0"}}, "vpc-0123456789abcdef0"),
+    ("CreateLoadBalancer", {"name": "my-alb"}, {"loadBalancers": [{"loadBalancerArn": LB_ARN}]}, LB_ARN),
+    ("CreateDistributionWithTags", {}, {"distribution": {"id": "E1ABCDEF2GHIJK"}}, "E1ABCDEF2GHIJK"),
+    ("CreateBucket", {"bucketName": "my-bucket"}, None, "my-bucket")
+])
+def test_resource_parsers(event_name, request_parameters, response_elements, resource_id):
+    assert parse_event(eventbridge(event_name, request_parameters, response_elements)).resource_id == resource_id
+
+def test_every_resource_parser_is_tested():
+    assert set(RESOURCE_PARSERS) == {"CreateVpc", "CreateLoadBalancer", "CreateDistributionWithTags", "CreateBucket"}
+
+@pytest.mark.parametrize("event_name, request_parameters, response_elements", [
+    ("CreateVpc", {}, None),
+    ("CreateVpc", {}, {"vpc": None}),
+    ("CreateLoadBalancer", {"name": "my-alb"}, None),
+    ("CreateLoadBalancer", {"name": "my-alb"}, {"loadBalancers": []}),
+    ("CreateDistributionWithTags", {}, {}),
+    ("CreateBucket", {}, None)
+])
+def test_successful_event_without_the_resource_id_is_invalid(event_name, request_parameters, response_elements):
+    with pytest.raises(InvalidEvent):
+        parse_event(eventbridge(event_name, request_parameters, response_elements))
+
+def test_failed_event_without_the_resource_id_is_valid():
+    record = parse_event(eventbridge("CreateLoadBalancer", {"name": "my-alb"}, None, error_code="AccessDenied"))
+
+    assert record.error_code == "AccessDenied"
+    assert record.resource_id is None
+
+@pytest.mark.parametrize("event", [None, [], {}, {"detail": None}, {"detail": "CreateVpc"}, {"detail": {"eventName": ""}}])
+def test_event_without_cloudtrail_detail_is_invalid(event):
+    with pytest.raises(InvalidEvent):
+        parse_event(event)
+
+def test_handler_rejects_create_load_balancer_without_response_elements():
+    event = eventbridge("CreateLoadBalancer", {"name": "my-alb"}, None)
+
+    assert enableelbaccesslogs.lambda_handler(event, None) == {"status": "invalid-event"}
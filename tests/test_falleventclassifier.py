@@ -0,0 +1,92 @@
+import os
+import sys
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+
+from fallevent import parse_event
+from falleventclassifier import classify_event, tags_from_event, event_patterns, tags_to_dict, PROCESS, FAILED, SELF_GENERATED, EXCLUDED
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "templates", "regional_resources_stackset_fall.yaml")
+
+def cloudtrail(event_name, request_parameters=None, response_elements=None, error_code=None):
+    detail = {
+        "eventName": event_name,
+        "awsRegion": "us-east-1",
+        "userIdentity": {"accountId": "123456789012", "arn": "arn:aws:iam::123456789012:user/alice"},
+        "requestParameters": request_parameters or {},
+        "responseElements": response_elements
+    }
+    if error_code:
+        detail["errorCode"] = error_code
+    return parse_event({"detail": detail})
+
+def create_vpc(specifications):
+    parameters = {"cidrBlock": "10.0.0.0/16"}
+    if specifications is not None:
+        parameters["tagSpecificationSet"] = {"items": specifications}
+    return cloudtrail("CreateVpc", parameters, {"vpc": {"vpcId": "vpc-0123456789abcdef0"}})
+
+def create_load_balancer(tags=None, with_tags=True):
+    parameters = {"name": "my-alb", "tags": tags} if with_tags else {"name": "my-alb"}
+    return cloudtrail("CreateLoadBalancer", parameters, {"loadBalancers": [{"loadBalancerArn": "arn:aws:elasticloadbalancing:us-east-1:123456789012:loadbalancer/app/my-alb/50dc6c495c0c9188"}]})
+
+def create_distribution(items):
+    config = {"distributionConfig": {}}
+    if items is not None:
+        config["tags"] = {"items": items}
+    return cloudtrail("CreateDistributionWithTags", {"distributionConfigWithTags": config}, {"distribution": {"id": "E1ABCDEF2GHIJK"}})
+
+def fail_fallback():
+    raise AssertionError("the tag API must not be called")
+
+def test_vpc_tags_are_read_from_the_tag_specifications():
+    record = create_vpc([
+        {"resourceType": "vpc", "tags": [{"key": "ExcludeLogging", "value": "True"}, {"key": "Name", "value": "Lab"}]},
+        {"resourceType": "vpc-endpoint", "tags": [{"key": "Owner", "value": "other"}]}
+    ])
+    assert tags_from_event(record) == {"excludelogging": "true", "name": "lab"}
+    assert classify_event(record, fail_fallback) == EXCLUDED
+
+def test_vpc_without_tag_specifications_uses_the_api():
+    calls = []
+    record = create_vpc(None)
+    assert tags_from_event(record) is None
+    assert classify_event(record, lambda: calls.append(1) or {}) == PROCESS
+    assert calls == [1]
+
+def test_load_balancer_tags():
+    assert classify_event(create_load_balancer([{"key": "excludelogging", "value": "TRUE"}]), fail_fallback) == EXCLUDED
+    assert classify_event(create_load_balancer([{"key": "ExcludeLogging", "value": "false"}]), fail_fallback) == PROCESS
+    assert tags_from_event(create_load_balancer(None)) == {}
+    assert tags_from_event(create_load_balancer(with_tags=False)) is None
+
+def test_distribution_tags():
+    assert classify_event(create_distribution([{"key": "ExcludeLogging", "value": "true"}]), fail_fallback) == EXCLUDED
+    assert classify_event(create_distribution([]), fail_fallback) == PROCESS
+    assert classify_event(create_distribution([{"key": "ExcludeLogging", "value": "False"}]), fail_fallback) == PROCESS
+    assert tags_from_event(create_distribution(None)) is None
+
+def test_bucket_tags_come_from_the_api():
+    record = cloudtrail("CreateBucket", {"bucketName": "my-bucket"})
+    assert tags_from_event(record) is None
+    assert classify_event(record, lambda: tags_to_dict([{"Key": "ExcludeLogging", "Value": "True"}])) == EXCLUDED
+    assert classify_event(record, lambda: tags_to_dict([{"Key": "ExcludeLogging", "Value": "False"}])) == PROCESS
+    assert classify_event(record, lambda: {}) == PROCESS
+
+def test_failed_and_self_generated_events():
+    assert classify_event(cloudtrail("CreateVpc", error_code="VpcLimitExceeded"), fail_fallback) == FAILED
+    assert classify_event(cloudtrail("CreateBucket", {"bucketName": "s3bkt-access-logging-my-bucket"}), fail_fallback) == SELF_GENERATED
+
+# The patterns of the rules in the template must be the ones generated by event_patterns().
+
+def test_event_patterns_match_the_template():
+    class Loader(yaml.SafeLoader):
+        pass
+    Loader.add_multi_constructor("!", lambda loader, suffix, node: None)
+    with open(TEMPLATE) as handler:
+        resources = yaml.load(handler, Loader=Loader)["Resources"]
+
+    rules = {resource["Properties"]["Name"]: resource["Properties"]["EventPattern"] for resource in resources.values() if resource["Type"] == "AWS::Events::Rule"}
+    assert rules == event_patterns()
@@ -0,0 +1,179 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+
+import fallinventory
+from fallevent import parse_event
+from fallinventory import FlowLogInventory, DeliveryInventory
+
+DISTRIBUTION_ARN = "arn:aws:cloudfront::123456789012:distribution/E1ABCDEF2GHIJK"
+
+class Paginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        self.client.calls.append((self.operation, kwargs))
+        return [self.client.pages(self.operation, kwargs)]
+
+class EC2:
+    def __init__(self, flow_logs):
+        self.flow_logs = flow_logs
+        self.calls = []
+
+    def get_paginator(self, operation):
+        return Paginator(self, operation)
+
+    def pages(self, operation, kwargs):
+        resource_ids = kwargs["Filters"][0]["Values"] if "Filters" in kwargs else None
+        return {"FlowLogs": [{"ResourceId": resource_id, "FlowLogId": flow_log_id} for resource_id, flow_log_id in self.flow_logs if resource_ids is None or resource_id in resource_ids]}
+
+class Logs:
+    class exceptions:
+        class ResourceNotFoundException(Exception):
+            pass
+
+    def __init__(self):
+        self.sources = {}
+        self.deliveries = []
+        self.calls = []
+
+    def get_paginator(self, operation):
+        return Paginator(self, operation)
+
+    def pages(self, operation, kwargs):
+        if operation == "describe_delivery_sources":
+            return {"deliverySources": [{"name": name, "resourceArns": arns} for name, arns in self.sources.items()]}
+        if operation == "describe_delivery_destinations":
+            return {"deliveryDestinations": []}
+        return {"deliveries": self.deliveries}
+
+    def get_delivery_source(self, name):
+        self.calls.append(("get_delivery_source", name))
+        if name not in self.sources:
+            raise self.exceptions.ResourceNotFoundException(name)
+        return {"deliverySource": {"name": name, "resourceArns": self.sources[name]}}
+
+def cloudtrail(event_name, request_parameters=None, response_elements=None, error_code=None):
+    detail = {
+        "eventName": event_name,
+        "awsRegion": "us-east-1",
+        "userIdentity": {"accountId": "123456789012", "arn": "arn:aws:iam::123456789012:user/alice"},
+        "requestParameters": request_parameters or {},
+        "responseElements": response_elements
+    }
+    if error_code:
+        detail["errorCode"] = error_code
+    return parse_event({"detail": detail})
+
+def loads(client):
+    return [operation for operation, kwargs in client.calls if operation.startswith("describe_") and not kwargs]
+
+def test_inventory_is_loaded_again_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fallinventory.time, "monotonic", lambda: now[0])
+    logs = Logs()
+    deliveries = DeliveryInventory(logs, ttl=900)
+
+    deliveries.ensure_loaded()
+    now[0] += 900
+    deliveries.ensure_loaded()
+    assert loads(logs).count("describe_delivery_sources") == 1
+
+    now[0] += 1
+    deliveries.ensure_loaded()
+    assert loads(logs).count("describe_delivery_sources") == 2
+
+    deliveries.invalidate()
+    deliveries.ensure_loaded()
+    assert loads(logs).count("describe_delivery_sources") == 3
+
+def test_delivery_source_falls_back_to_the_expected_name():
+    logs = Logs()
+    deliveries = DeliveryInventory(logs)
+    deliveries.ensure_loaded()
+
+    # Created by another container after the inventory was loaded.
+    logs.sources["fall-E1ABCDEF2GHIJK"] = [DISTRIBUTION_ARN]
+    logs.deliveries = [{"id": "abc", "deliverySourceName": "fall-E1ABCDEF2GHIJK", "deliveryDestinationArn": "arn:destination"}]
+
+    assert deliveries.source_of(DISTRIBUTION_ARN) == (None, False)
+    assert deliveries.source_of(DISTRIBUTION_ARN, expected_name="fall-E1ABCDEF2GHIJK") == ("fall-E1ABCDEF2GHIJK", True)
+
+def test_delivery_source_not_found_by_the_fallback():
+    logs = Logs()
+    deliveries = DeliveryInventory(logs)
+
+    assert deliveries.source_of(DISTRIBUTION_ARN, expected_name="fall-E1ABCDEF2GHIJK") == (None, False)
+    assert ("get_delivery_source", "fall-E1ABCDEF2GHIJK") in logs.calls
+
+def test_delivery_events_update_the_inventory():
+    deliveries = DeliveryInventory(Logs())
+    deliveries.ensure_loaded()
+
+    assert deliveries.apply_event(cloudtrail("PutDeliverySource", {"name": "src", "resourceArn": DISTRIBUTION_ARN}))
+    assert deliveries.apply_event(cloudtrail("PutDeliveryDestination", {"name": "dst"}, {"deliveryDestination": {"name": "dst", "arn": "arn:destination"}}))
+    assert deliveries.apply_event(cloudtrail("CreateDelivery", {}, {"delivery": {"id": "abc", "deliverySourceName": "src", "deliveryDestinationArn": "arn:destination"}}))
+    assert deliveries.source_of(DISTRIBUTION_ARN) == ("src", True)
+    assert deliveries.destinations == {"dst": "arn:destination"}
+
+    assert deliveries.apply_event(cloudtrail("DeleteDelivery", {"id": "abc"}))
+    assert deliveries.source_of(DISTRIBUTION_ARN) == ("src", False)
+    assert deliveries.apply_event(cloudtrail("DeleteDeliverySource", {"name": "src"}))
+    assert deliveries.apply_event(cloudtrail("DeleteDeliveryDestination", {"name": "dst"}))
+    assert deliveries.sources == {} and deliveries.destinations == {}
+
+def test_delivery_event_without_the_identifiers_invalidates_the_inventory():
+    deliveries = DeliveryInventory(Logs())
+    deliveries.ensure_loaded()
+
+    assert deliveries.apply_event(cloudtrail("CreateDelivery", {}, None))
+    assert deliveries.loaded_at is None
+
+def test_events_of_other_services_are_not_consumed():
+    assert not DeliveryInventory(Logs()).apply_event(cloudtrail("CreateDistributionWithTags", {}, {"distribution": {"id": "E1ABCDEF2GHIJK"}}))
+    assert not FlowLogInventory(EC2([])).apply_event(cloudtrail("CreateVpc", {}, {"vpc": {"vpcId": "vpc-1"}}))
+
+def test_failed_events_and_unloaded_inventory_are_ignored():
+    flow_logs = FlowLogInventory(EC2([]))
+    assert flow_logs.apply_event(cloudtrail("CreateFlowLogs", {"resourceIdSet": {"item": "vpc-1"}}, {"flowLogIdSet": {"item": "fl-1"}}))
+    assert flow_logs.flow_logs == {}
+
+    flow_logs.ensure_loaded()
+    assert flow_logs.apply_event(cloudtrail("CreateFlowLogs", {"resourceIdSet": {"item": "vpc-1"}}, None, error_code="AccessDenied"))
+    assert flow_logs.flow_logs == {}
+
+def test_flow_log_events_update_the_inventory():
+    flow_logs = FlowLogInventory(EC2([]))
+    flow_logs.ensure_loaded()
+
+    assert flow_logs.apply_event(cloudtrail("CreateFlowLogs", {"resourceIdSet": {"item": "vpc-1"}}, {"flowLogIdSet": {"item": "fl-1"}}))
+    assert flow_logs.flow_logs == {"vpc-1": {"fl-1"}}
+
+    assert flow_logs.apply_event(cloudtrail("DeleteFlowLogs", {"flowLogId": {"item": "fl-1"}}))
+    assert flow_logs.flow_logs == {}
+
+def test_cached_flow_log_is_verified_before_skipping():
+    ec2 = EC2([("vpc-1", "fl-1")])
+    flow_logs = FlowLogInventory(ec2)
+    flow_logs.ensure_loaded()
+    assert flow_logs.flow_logs == {"vpc-1": {"fl-1"}}
+
+    # DeleteFlowLogs delivered to another container.
+    ec2.flow_logs = []
+
+    assert not flow_logs.is_enabled("vpc-1")
+    assert flow_logs.flow_logs == {}
+    assert ec2.calls[-1] == ("describe_flow_logs", {"Filters": [{"Name": "resource-id", "Values": ["vpc-1"]}]})
+
+def test_flow_log_created_by_another_container_is_found():
+    ec2 = EC2([])
+    flow_logs = FlowLogInventory(ec2)
+    flow_logs.ensure_loaded()
+
+    ec2.flow_logs = [("vpc-1", "fl-1")]
+
+    assert flow_logs.is_enabled("vpc-1")
+    assert flow_logs.flow_logs == {"vpc-1": {"fl-1"}}
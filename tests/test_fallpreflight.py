@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+
+import fallpreflight
+from fallpreflight import cached, check_kms_key, check_role, check_region, require, PreflightError
+
+KEY_ARN = "arn:aws:kms:us-east-1:123456789012:key/1234abcd-12ab-34cd-56ef-1234567890ab"
+ROLE_ARN = "arn:aws:iam::123456789012:role/iamrole-fall-publish-vpc-flow-logs"
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": f"{code} message"}}, "DescribeKey")
+
+class StubKMS:
+    def __init__(self, metadata=None, error=None):
+        self.metadata = metadata or {"KeyState": "Enabled", "KeyUsage": "ENCRYPT_DECRYPT", "KeySpec": "SYMMETRIC_DEFAULT"}
+        self.error = error
+        self.calls = 0
+
+    def describe_key(self, KeyId):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {"KeyMetadata": self.metadata}
+
+class StubIAM:
+    def __init__(self, services):
+        self.services = services
+
+    def get_role(self, RoleName):
+        return {"Role": {
+            "Arn": f"arn:aws:iam::123456789012:role/{RoleName}",
+            "AssumeRolePolicyDocument": {"Statement": [{"Effect": "Allow", "Principal": {"Service": self.services}, "Action": "sts:AssumeRole"}]}
+        }}
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(fallpreflight, "results", {})
+    monkeypatch.setattr(fallpreflight, "clients", {})
+
+def stub(service, region, client):
+    fallpreflight.clients[(service, region)] = client
+    return client
+
+def test_valid_check_is_cached():
+    kms = stub("kms", "us-east-1", StubKMS())
+
+    assert check_kms_key(KEY_ARN, "us-east-1") is None
+    assert check_kms_key(KEY_ARN, "us-east-1") is None
+    assert kms.calls == 1
+
+def test_failed_check_is_repeated_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fallpreflight.time, "time", lambda: now[0])
+    kms = stub("kms", "us-east-1", StubKMS({"KeyState": "Disabled"}))
+
+    assert check_kms_key(KEY_ARN, "us-east-1") == f"KMS_KEY_ARN {KEY_ARN}: the key is Disabled"
+    now[0] += fallpreflight.PREFLIGHT_FAILURE_TTL_SECONDS - 1
+    check_kms_key(KEY_ARN, "us-east-1")
+    assert kms.calls == 1
+
+    kms.metadata = {"KeyState": "Enabled", "KeyUsage": "ENCRYPT_DECRYPT"}
+    now[0] += 1
+    assert check_kms_key(KEY_ARN, "us-east-1") is None
+    assert kms.calls == 2
+
+@pytest.mark.parametrize("code", ["AccessDeniedException", "ThrottlingException", "KMSInternalException"])
+def test_inconclusive_error_counts_as_pass(code, caplog):
+    stub("kms", "us-east-1", StubKMS(error=client_error(code)))
+
+    assert check_kms_key(KEY_ARN, "us-east-1") is None
+    assert fallpreflight.results[("kms:DescribeKey", KEY_ARN, "us-east-1")][0] is None
+    assert f"Pre-flight check kms:DescribeKey of {KEY_ARN} skipped: {code}" in caplog.text
+
+def test_cached_returns_the_error_of_validate():
+    assert cached(("check", "a"), lambda: "broken") == "broken"
+    assert cached(("check", "a"), lambda: None) == "broken"
+    assert cached(("check", "b"), lambda: None) is None
+
+def test_other_errors_fail_the_check():
+    stub("kms", "us-east-1", StubKMS(error=client_error("NotFoundException")))
+
+    assert check_kms_key(KEY_ARN, "us-east-1") == f"KMS_KEY_ARN {KEY_ARN}: NotFoundException: NotFoundException message"
+
+def test_kms_key_of_another_region_fails_without_calls():
+    kms = stub("kms", "us-east-1", StubKMS())
+
+    assert check_kms_key(KEY_ARN, "sa-east-1") == f"KMS_KEY_ARN {KEY_ARN}: the key is in us-east-1, it must be in sa-east-1"
+    assert check_kms_key("", "us-east-1") == "KMS_KEY_ARN is not set"
+    assert kms.calls == 0
+
+def test_asymmetric_kms_key_fails():
+    stub("kms", "us-east-1", StubKMS({"KeyState": "Enabled", "KeyUsage": "SIGN_VERIFY", "KeySpec": "RSA_2048"}))
+
+    assert check_kms_key(KEY_ARN, "us-east-1") == f"KMS_KEY_ARN {KEY_ARN}: the key is not a symmetric encryption key"
+
+def test_role_must_trust_the_service():
+    stub("iam", None, StubIAM(["vpc-flow-logs.amazonaws.com"]))
+
+    assert check_role(ROLE_ARN, "vpc-flow-logs.amazonaws.com", "FLOW_LOG_ROLE_ARN") is None
+    assert check_role(ROLE_ARN, "s3.amazonaws.com", "ARCHIVE_REPLICATION_ROLE_ARN") == f"ARCHIVE_REPLICATION_ROLE_ARN {ROLE_ARN}: the Role does not trust s3.amazonaws.com"
+
+def test_require_raises_every_failed_check():
+    require(None, None)
+
+    with pytest.raises(PreflightError) as error:
+        require(None, "KMS_KEY_ARN is not set", check_region("ap-south-2", {"us-east-1", "sa-east-1"}, "ELB Access Logs"))
+    assert str(error.value) == ("Pre-flight validation failed: KMS_KEY_ARN is not set; "
+                                "ELB Access Logs is not supported in the region ap-south-2 (supported: sa-east-1, us-east-1)")
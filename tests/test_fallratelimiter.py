@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_code"))
+
+import fallratelimiter
+from fallratelimiter import rate_limited, RateLimitDeferred, LocalBackend
+
+class StubSQS:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, **kwargs):
+        self.messages.append(kwargs)
+
+@pytest.fixture
+def sqs(monkeypatch):
+    stub = StubSQS()
+    monkeypatch.setattr(fallratelimiter, "sqs", stub)
+    monkeypatch.setattr(fallratelimiter, "DEFERRED_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/123456789012/sqsqueue-fall-deferred-vpc-flow-logs")
+    monkeypatch.setattr(fallratelimiter, "DEFERRED_RETRY_DELAY_SECONDS", 60)
+    monkeypatch.setattr(fallratelimiter, "DEFERRED_EVENT_MAX_AGE_SECONDS", 3600)
+    return stub
+
+@rate_limited
+def deferred_handler(event, context):
+    raise RateLimitDeferred("ec2:CreateFlowLogs", 10)
+
+def eventbridge_event(age_seconds=0):
+    delivered = datetime.fromtimestamp(time.time() - age_seconds, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {"id": "7bf73129-1428-4cd3-a780-95db273d1602", "time": delivered, "detail-type": "AWS API Call via CloudTrail", "detail": {"eventName": "CreateVpc"}}
+
+def sqs_event(message):
+    return {"Records": [{"eventSource": "aws:sqs", "body": message["MessageBody"]}]}
+
+def test_deferred_event_is_requeued_with_growing_delay(sqs):
+    assert deferred_handler(eventbridge_event(), None)["status"] == "deferred"
+    assert deferred_handler(sqs_event(sqs.messages[0]), None)["status"] == "deferred"
+
+    assert [message["DelaySeconds"] for message in sqs.messages] == [60, 120]
+    body = json.loads(sqs.messages[1]["MessageBody"])
+    assert body["retries"] == 2
+    assert body["event"]["detail"]["eventName"] == "CreateVpc"
+
+def test_delay_is_capped_by_sqs(sqs):
+    message = {"MessageBody": json.dumps({"event": eventbridge_event(), "retries": 6, "since": time.time()})}
+    deferred_handler(sqs_event(message), None)
+    assert sqs.messages[-1]["DelaySeconds"] == 900
+
+def test_event_older_than_the_window_is_dropped_and_notified(sqs, monkeypatch):
+    notifications = []
+    monkeypatch.setattr(fallratelimiter, "notify_dropped", notifications.append)
+
+    result = deferred_handler(eventbridge_event(age_seconds=3590), None)
+
+    assert result["status"] == "error"
+    assert sqs.messages == []
+    assert "dropped" in notifications[0]
+
+def test_events_not_delivered_by_eventbridge_are_raised(sqs):
+    with pytest.raises(RateLimitDeferred):
+        deferred_handler({"detail": {"eventName": "CreateVpc"}}, None)
+    assert sqs.messages == []
+
+def test_without_queue_the_exception_reaches_lambda(sqs, monkeypatch):
+    monkeypatch.setattr(fallratelimiter, "DEFERRED_QUEUE_URL", None)
+    with pytest.raises(RateLimitDeferred):
+        deferred_handler(eventbridge_event(), None)
+
+def test_tokens_are_kept_per_region():
+    backend = LocalBackend()
+    assert backend.try_consume("logs:CreateDelivery", 1, 1, 100.0, "us-east-1") == 0
+    assert backend.try_consume("logs:CreateDelivery", 1, 1, 100.0, "us-east-1") > 0
+    assert backend.try_consume("logs:CreateDelivery", 1, 1, 100.0, "sa-east-1") == 0
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from indexlogarchive import main, INDEX_KEY
+
+KEYS = [
+    "AWSLogs/123456789012/elasticloadbalancing/us-east-1/2024/05/01/123456789012_elasticloadbalancing_us-east-1_app.my-alb.50dc6c495c0c9188_20240501T0000Z_10.0.0.1_abc.log.gz",
+    "AWSLogs/123456789012/elasticloadbalancing/sa-east-1/2024/05/01/123456789012_elasticloadbalancing_sa-east-1_net.my-nlb.c6e77e28c25b2234_20240501T0000Z_abc.log.gz",
+    "AWSLogs/aws-account-id=210987654321/CloudFront/DistributionId=E1ABCDEF2GHIJK/2024/05/01/E1ABCDEF2GHIJK.2024-05-01-00.abc.gz",
+    "AWSLogs/123456789012/CloudFront/E2ZYXWVU3TSRQP.2024-05-01-00.abc.gz",
+    "AWSLogs/not-an-account/elasticloadbalancing/us-east-1/ignored.log",
+    "logs/123456789012/us-east-1/my-bucket/2024-05-01-00-00-00-ABCDEF",
+    "compacted/elb/123456789012/us-east-1/my-alb/2024-05-01.log.gz",
+    "compacted/cloudfront/210987654321/E1ABCDEF2GHIJK/2024-05-01.gz",
+    "compacted/_manifest/ignored.json"
+]
+
+def write_archive(folder):
+    for key in KEYS:
+        (folder / key).parent.mkdir(parents=True, exist_ok=True)
+        (folder / key).write_text("log\n")
+
+def locate(archive, capsys, *filters):
+    main(["locate", "--archive", str(archive), *filters])
+    return [line[len(str(archive)) + 1:] for line in capsys.readouterr().out.splitlines()]
+
+def test_update_indexes_every_log_source(tmp_path):
+    write_archive(tmp_path)
+
+    main(["update", "--archive", str(tmp_path)])
+
+    entries = json.loads((tmp_path / INDEX_KEY).read_text())["entries"]
+    assert sorted((item["prefix"], item["account"], item["region"], item["service"], item["resource"], item["compacted"]) for item in entries) == sorted([
+        ("AWSLogs/123456789012/elasticloadbalancing/us-east-1/", "123456789012", "us-east-1", "elb", None, False),
+        ("AWSLogs/123456789012/elasticloadbalancing/sa-east-1/", "123456789012", "sa-east-1", "elb", None, False),
+        ("AWSLogs/aws-account-id=210987654321/CloudFront/DistributionId=E1ABCDEF2GHIJK/", "210987654321", "global", "cloudfront", "E1ABCDEF2GHIJK", False),
+        ("AWSLogs/123456789012/CloudFront/", "123456789012", "global", "cloudfront", None, False),
+        ("logs/123456789012/us-east-1/my-bucket/", "123456789012", "us-east-1", "s3", "my-bucket", False),
+        ("compacted/elb/123456789012/us-east-1/my-alb/", "123456789012", "us-east-1", "elb", "my-alb", True),
+        ("compacted/cloudfront/210987654321/E1ABCDEF2GHIJK/", "210987654321", "global", "cloudfront", "E1ABCDEF2GHIJK", True)
+    ])
+
+def test_locate_filters_the_index(tmp_path, capsys):
+    write_archive(tmp_path)
+    main(["update", "--archive", str(tmp_path)])
+
+    assert locate(tmp_path, capsys, "--account", "123456789012", "--region", "us-east-1") == [
+        "AWSLogs/123456789012/elasticloadbalancing/us-east-1/",
+        "logs/123456789012/us-east-1/my-bucket/"
+    ]
+    # The CloudFront prefix without distribution folders may hold the logs of any distribution.
+    assert sorted(locate(tmp_path, capsys, "--service", "cloudfront", "--resource", "E1ABCDEF2GHIJK", "--include-compacted")) == [
+        "AWSLogs/123456789012/CloudFront/",
+        "AWSLogs/aws-account-id=210987654321/CloudFront/DistributionId=E1ABCDEF2GHIJK/",
+        "compacted/cloudfront/210987654321/E1ABCDEF2GHIJK/"
+    ]
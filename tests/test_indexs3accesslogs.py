@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+import indexs3accesslogs
+from indexs3accesslogs import update_index, top_n
+
+RECORD = ('79a59df900b949e55d96a1e698fbacedfd6e09d98eacf8f8d5218e7cd47ef2be amzn-s3-demo-bucket1 [06/Feb/2019:00:00:38 +0000] '
+          '192.0.2.3 79a59df900b949e55d96a1e698fbacedfd6e09d98eacf8f8d5218e7cd47ef2be 3E57427F3EXAMPLE REST.GET.OBJECT '
+          'photos/2019/puppy.jpg "GET /amzn-s3-demo-bucket1/photos/2019/puppy.jpg HTTP/1.1" 200 - 113 113 7 - "-" "S3Console/0.4" -')
+
+def deliver(source, name, records):
+    logs = source / "logs"
+    logs.mkdir(parents=True, exist_ok=True)
+    (logs / name).write_text("\n".join([RECORD] * records) + "\n")
+
+def requests(index):
+    return dict(top_n(str(index), "prefix", "requests", 10))[("amzn-s3-demo-bucket1", "photos/2019/")]
+
+def test_failed_update_does_not_count_twice(tmp_path, monkeypatch):
+    source, index = tmp_path / "source", tmp_path / "index"
+    deliver(source, "2019-02-06-00-00-38-0000000000000001", 2)
+    update_index([str(source)], str(index), None, 2)
+    assert requests(index) == 2
+
+    deliver(source, "2019-02-06-00-05-12-0000000000000002", 3)
+    monkeypatch.setattr(indexs3accesslogs, "fsync_file", lambda path: (_ for _ in ()).throw(OSError("disk full")))
+    with pytest.raises(OSError):
+        update_index([str(source)], str(index), None, 2)
+    assert requests(index) == 2
+
+    monkeypatch.undo()
+    update_index([str(source)], str(index), None, 2)
+    update_index([str(source)], str(index), None, 2)
+    assert requests(index) == 5
+    assert sorted(os.listdir(index)) == ["CURRENT", "generation-00000002"]
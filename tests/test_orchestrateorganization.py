@@ -0,0 +1,138 @@
+import io
+import os
+import sys
+import json
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+import orchestrateorganization
+from orchestrateorganization import Orchestrator, FUNCTIONS
+
+PRINCIPAL = "arn:aws:sts::999999999999:assumed-role/admin/fall"
+
+# VPCs of each account and region, the VPCs in FLOW_LOGS already have Flow Logs.
+
+VPCS = {
+    ("111111111111", "us-east-1"): [{"VpcId": "vpc-1a", "IsDefault": True}, {"VpcId": "vpc-1b", "Tags": [{"Key": "Environment", "Value": "prod"}]}],
+    ("111111111111", "sa-east-1"): [{"VpcId": "vpc-1c"}],
+    ("222222222222", "us-east-1"): [{"VpcId": "vpc-2a"}, {"VpcId": "vpc-2b"}],
+    ("222222222222", "sa-east-1"): []
+}
+FLOW_LOGS = {"vpc-2b"}
+
+class Paginator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return self.pages
+
+class EC2:
+    def __init__(self, vpcs):
+        self.vpcs = vpcs
+
+    def get_paginator(self, operation):
+        if operation == "describe_flow_logs":
+            return Paginator([{"FlowLogs": [{"ResourceId": vpc["VpcId"]} for vpc in self.vpcs if vpc["VpcId"] in FLOW_LOGS]}])
+        return Paginator([{"Vpcs": self.vpcs}])
+
+class Lambda:
+    def __init__(self, sessions, account_id, region):
+        self.sessions = sessions
+        self.account_id = account_id
+        self.region = region
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        event = json.loads(Payload)
+        with self.sessions.lock:
+            self.sessions.invocations.append((self.account_id, self.region, FunctionName, event))
+            self.sessions.running[self.account_id] = self.sessions.running.get(self.account_id, 0) + 1
+            self.sessions.max_running = max(self.sessions.max_running, self.sessions.running[self.account_id])
+        time.sleep(0.01)
+        with self.sessions.lock:
+            self.sessions.running[self.account_id] -= 1
+        response = self.sessions.responses.get(event["detail"]["responseElements"]["vpc"]["vpcId"], [{"status": "success"}])
+        result = response.pop(0) if len(response) > 1 else response[0]
+        if "errorType" in result:
+            return {"FunctionError": "Unhandled", "Payload": io.BytesIO(json.dumps(result).encode("utf-8"))}
+        return {"Payload": io.BytesIO(json.dumps(result).encode("utf-8"))}
+
+class STS:
+    def get_caller_identity(self):
+        return {"Account": "999999999999", "Arn": PRINCIPAL}
+
+class StubSessions:
+    def __init__(self, responses=None):
+        self.sts = STS()
+        self.assumed = 0
+        self.responses = responses or {}
+        self.invocations = []
+        self.running = {}
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def client(self, account_id, region, service):
+        if service == "ec2":
+            return EC2(VPCS[(account_id, region)])
+        return Lambda(self, account_id, region)
+
+def orchestrator(sessions, services=("vpc",), max_per_account=4):
+    return Orchestrator(sessions, ["us-east-1", "sa-east-1"], list(services), max_workers=8, max_per_account=max_per_account, metrics_interval=1)
+
+def test_scan_plans_every_account_and_region():
+    sessions = StubSessions()
+
+    report = orchestrator(sessions).run(["111111111111", "222222222222"])
+
+    assert report["accounts"] == {
+        "111111111111": {
+            "us-east-1": [
+                {"service": "vpc", "resource": "vpc-1a", "priority": "low", "status": "missing"},
+                {"service": "vpc", "resource": "vpc-1b", "priority": "high", "status": "missing"}
+            ],
+            "sa-east-1": [{"service": "vpc", "resource": "vpc-1c", "priority": "normal", "status": "missing"}]
+        },
+        "222222222222": {"us-east-1": [{"service": "vpc", "resource": "vpc-2a", "priority": "normal", "status": "missing"}]}
+    }
+    assert report["totals"]["scans"] == 4 and report["totals"]["missing"] == 4
+    assert report["priorities"] == {"low": 1, "high": 1, "normal": 2}
+    assert sessions.invocations == []
+
+def test_enable_invokes_the_function_of_each_account_and_region(monkeypatch):
+    monkeypatch.setattr(orchestrateorganization, "DEFERRED_RETRY_SECONDS", 0)
+    sessions = StubSessions({
+        "vpc-1a": [{"status": "excluded"}],
+        "vpc-1c": [{"errorType": "RateLimitDeferred", "errorMessage": "Rate limit reached"}, {"status": "already-enabled"}],
+        "vpc-2a": [{"status": "self-generated"}]
+    })
+
+    report = orchestrator(sessions, max_per_account=1).run(["111111111111", "222222222222"], enable=True)
+
+    invoked = sorted((account_id, region, function, event["detail"]["responseElements"]["vpc"]["vpcId"]) for account_id, region, function, event in sessions.invocations)
+    assert invoked == [
+        ("111111111111", "sa-east-1", FUNCTIONS["vpc"], "vpc-1c"),
+        ("111111111111", "sa-east-1", FUNCTIONS["vpc"], "vpc-1c"),
+        ("111111111111", "us-east-1", FUNCTIONS["vpc"], "vpc-1a"),
+        ("111111111111", "us-east-1", FUNCTIONS["vpc"], "vpc-1b"),
+        ("222222222222", "us-east-1", FUNCTIONS["vpc"], "vpc-2a")
+    ]
+    assert all(event["account"] == account_id and event["detail"]["userIdentity"]["arn"] == PRINCIPAL for account_id, _, _, event in sessions.invocations)
+
+    statuses = {entry["resource"]: entry["status"] for regions in report["accounts"].values() for entries in regions.values() for entry in entries}
+    assert statuses == {"vpc-1a": "excluded", "vpc-1b": "enabled", "vpc-1c": "already_enabled", "vpc-2a": "skipped"}
+    assert report["totals"]["deferred"] == 1 and report["totals"]["errors"] == 0
+    assert sessions.max_running == 1
+
+def test_high_priority_resources_are_enabled_first():
+    sessions = StubSessions()
+
+    orchestrator(sessions, max_per_account=1).run(["111111111111"], enable=True)
+
+    assert [event["detail"]["responseElements"]["vpc"]["vpcId"] for _, _, _, event in sessions.invocations][0] == "vpc-1b"
+
+def test_cloudfront_is_skipped_without_the_global_region():
+    cloudfront_only = Orchestrator(StubSessions(), ["sa-east-1"], ["cloudfront"], max_workers=1, max_per_account=1)
+
+    assert cloudfront_only.invoke("cloudfront", "111111111111", {"id": "E1ABCDEF2GHIJK", "region": "us-east-1"}) == ("skipped", "The CloudFront function is only deployed in us-east-1")
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from logsources import open_location, Checkpoint
+from rollupcloudfrontlogs import update_rollups, view_rollups
+
+def deliver(source, name, records):
+    folder = source / "AWSLogs" / "123456789012" / "CloudFront"
+    folder.mkdir(parents=True, exist_ok=True)
+    record = {"date": "2025-06-18", "time": "10:15:02", "DistributionId": "E1ABCDEF2GHIJK", "x-edge-location": "GRU1-C1",
+              "sc-bytes": "1024", "sc-status": "200", "x-edge-result-type": "Hit", "time-taken": "0.012"}
+    (folder / name).write_text("\n".join([json.dumps(record)] * records) + "\n")
+
+def requests(store):
+    rows = list(view_rollups(open_location(str(store)), "E1ABCDEF2GHIJK", "2025-06-18", "day"))
+    return rows[0]["requests"]
+
+def test_objects_merged_before_a_failed_checkpoint_are_not_counted_twice(tmp_path, monkeypatch):
+    source, store = tmp_path / "source", tmp_path / "store"
+    deliver(source, "E1ABCDEF2GHIJK.2025-06-18-10.a1b2c3d4", 2)
+    update_rollups([str(source)], open_location(str(store)), "AWSLogs/", None)
+    assert requests(store) == 2
+
+    deliver(source, "E1ABCDEF2GHIJK.2025-06-18-10.e5f6a7b8", 3)
+    save = Checkpoint.save
+    monkeypatch.setattr(Checkpoint, "save", lambda self, location=None: (_ for _ in ()).throw(OSError("disk full")))
+    with pytest.raises(OSError):
+        update_rollups([str(source)], open_location(str(store)), "AWSLogs/", None)
+    assert requests(store) == 5
+
+    monkeypatch.setattr(Checkpoint, "save", save)
+    update_rollups([str(source)], open_location(str(store)), "AWSLogs/", None)
+    assert requests(store) == 5
+
+def test_rollups_are_flushed_in_batches(tmp_path, monkeypatch):
+    source, store = tmp_path / "source", tmp_path / "store"
+    for number in range(5):
+        deliver(source, f"E1ABCDEF2GHIJK.2025-06-18-10.{number:08x}", 1)
+    saves = []
+    save = Checkpoint.save
+    monkeypatch.setattr(Checkpoint, "save", lambda self, location=None: (saves.append(len(self.entries)), save(self, location)))
+
+    update_rollups([str(source)], open_location(str(store)), "AWSLogs/", None, flush_objects=2)
+
+    assert saves == [2, 4, 5]
+    assert requests(store) == 5
+
+def test_parquet_objects_are_skipped_and_logged(tmp_path, caplog):
+    source, store = tmp_path / "source", tmp_path / "store"
+    deliver(source, "E1ABCDEF2GHIJK.2025-06-18-10.a1b2c3d4", 2)
+    (source / "AWSLogs" / "123456789012" / "CloudFront" / "E1ABCDEF2GHIJK.2025-06-18-10.e5f6a7b8.parquet").write_bytes(b"PAR1")
+
+    update_rollups([str(source)], open_location(str(store)), "AWSLogs/", None)
+
+    assert requests(store) == 2
+    assert "E1ABCDEF2GHIJK.2025-06-18-10.e5f6a7b8.parquet, only the JSON output format is supported" in caplog.text
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import ipaddress
+import numpy as np
+from logsources import open_location, iter_lines, is_compressed
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+CHUNK_ROWS = int(os.environ.get("CHUNK_ROWS", "500000"))    # Records converted to NumPy arrays and aggregated at once.
+MAX_KEYS = int(os.environ.get("MAX_KEYS", "100000"))        # Max entries kept per rollup, the smallest ones are pruned when exceeded.
+CIDR_PREFIX = int(os.environ.get("CIDR_PREFIX", "24"))      # IPv4 prefix length used to group source and destination addresses.
+TOP_N = int(os.environ.get("TOP_N", "25"))                  # Entries written in the summary for each top talkers list.
+
+# enablevpcflowlogs creates the Flow Logs with the default format (version 2), these are the fields in the order written by AWS.
+
+FIELDS = ("version", "account_id", "interface_id", "srcaddr", "dstaddr", "srcport", "dstport", "protocol",
+          "packets", "bytes", "start", "end", "action", "log_status")
+FIELD_POSITIONS = {name: position for position, name in enumerate(FIELDS)}
+
+# Columns used by the aggregations, the Parquet export of Flow Logs uses the same names.
+
+COLUMNS = ("interface_id", "srcaddr", "dstaddr", "dstport", "packets", "bytes", "action")
+
+"""
+Entry point of the aggregation engine. Flow Log records are read from an exported log group (the text files generated by
+"create-export-task" or the JSON lines of "filter-log-events") or from a Flow Logs export to S3 (text or Parquet) in
+chunks of CHUNK_ROWS records. Each chunk is aggregated with vectorized group-bys and merged into bounded rollups which are
+finally written as a compact JSON summary:
+
+    * top talkers by bytes per ENI, per source CIDR and per destination CIDR
+    * REJECT rollups per ENI and destination port, and per source CIDR
+    * destination port histograms (records, packets and bytes) for ACCEPT and REJECT traffic
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate VPC Flow Logs into top talkers and rejected-traffic summaries.")
+    parser.add_argument("--source", action="append", required=True, help="Export location (s3://bucket/prefix or local folder), can be repeated.")
+    parser.add_argument("--prefix", default="", help="Only read the objects under this prefix.")
+    parser.add_argument("--input-format", choices=("text", "jsonl", "parquet"), default="text")
+    parser.add_argument("--output", required=True, help="Path of the JSON summary.")
+    parser.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--cidr-prefix", type=int, default=CIDR_PREFIX)
+    parser.add_argument("--top", type=int, default=TOP_N)
+    args = parser.parse_args(argv)
+
+    aggregator = FlowLogAggregator(args.cidr_prefix)
+    for source_uri in args.source:
+        source = open_location(source_uri, args.endpoint_url)
+        for item in source.list_objects(args.prefix):
+            for chunk in read_chunks(source, item["Key"], args.input_format, args.chunk_rows):
+                aggregator.add_chunk(chunk)
+            logger.info(f"Aggregated {item['Key']} from {source.name}")
+
+    with open(args.output, "w") as handler:
+        json.dump(aggregator.summary(args.top), handler, separators=(",", ":"))
+    logger.info(f"Summary of {aggregator.records} records written to {args.output}")
+    return 0
+
+# This generator yields the records of an object as column dictionaries of at most chunk_rows entries.
+
+def read_chunks(source, key, input_format, chunk_rows):
+    if input_format == "parquet":
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        # Only the records with data are aggregated, NODATA / SKIPDATA records have null ports, packets and bytes.
+
+        stream = source.open_seekable(key)
+        try:
+            parquet_file = pq.ParquetFile(stream)
+            for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=list(COLUMNS) + ["log_status"]):
+                batch = batch.filter(pc.equal(batch.column("log_status"), "OK"))
+                if batch.num_rows:
+                    yield {name: batch.column(name).to_numpy(zero_copy_only=False) for name in COLUMNS}
+        finally:
+            stream.close()
+        return
+
+    stream = source.open_object(key)
+    try:
+        rows = []
+        for line in iter_lines(stream, compressed=is_compressed(key)):
+            if input_format == "jsonl":
+                line = json.loads(line).get("message", "")
+            tokens = parse_record(line)
+            if tokens is not None:
+                rows.append(tokens)
+            if len(rows) >= chunk_rows:
+                yield to_columns(rows)
+                rows = []
+        if rows:
+            yield to_columns(rows)
+    finally:
+        stream.close()
+
+# Exports of a log group prefix every message with its timestamp, that value and the header of the S3 text export are
+# removed. Records without data (NODATA / SKIPDATA) are discarded.
+
+def parse_record(line):
+    tokens = line.split()
+    if len(tokens) == len(FIELDS) + 1:
+        tokens = tokens[1:]
+    if len(tokens) != len(FIELDS) or tokens[0] == "version" or tokens[FIELD_POSITIONS["log_status"]] != "OK":
+        return None
+    return tokens
+
+def to_columns(rows):
+    return {name: [row[FIELD_POSITIONS[name]] for row in rows] for name in COLUMNS}
+
+# Accumulates the rollups of every chunk, each rollup is a dictionary keyed by the group and holding NumPy int64 vectors.
+
+class FlowLogAggregator:
+    def __init__(self, cidr_prefix):
+        self.cidr_prefix = cidr_prefix
+        self.records = 0
+        self.eni_talkers = {}
+        self.src_cidr_talkers = {}
+        self.dst_cidr_talkers = {}
+        self.rejects_by_eni_port = {}
+        self.rejects_by_src_cidr = {}
+        self.pruned = {}
+        self.port_histograms = {
+            "ACCEPT": np.zeros((65536, 3), dtype=np.int64),
+            "REJECT": np.zeros((65536, 3), dtype=np.int64)
+        }
+
+    def add_chunk(self, columns):
+        packets = np.asarray(columns["packets"], dtype=np.int64)
+        sent_bytes = np.asarray(columns["bytes"], dtype=np.int64)
+        dstport = np.asarray(columns["dstport"], dtype=np.int64) & 0xFFFF
+        action = np.asarray(columns["action"])
+        rejected = action == "REJECT"
+        metrics = np.stack([np.ones_like(packets), packets, sent_bytes], axis=1)
+
+        eni = np.asarray(columns["interface_id"])
+        src_cidr = self.to_cidr(np.asarray(columns["srcaddr"]))
+        dst_cidr = self.to_cidr(np.asarray(columns["dstaddr"]))
+
+        self.merge("top_talkers.eni", self.eni_talkers, *group_sum(eni, metrics))
+        self.merge("top_talkers.src_cidr", self.src_cidr_talkers, *group_sum(src_cidr, metrics))
+        self.merge("top_talkers.dst_cidr", self.dst_cidr_talkers, *group_sum(dst_cidr, metrics))
+
+        if rejected.any():
+            eni_port = np.char.add(np.char.add(eni[rejected].astype(str), ":"), dstport[rejected].astype(str))
+            self.merge("rejects.eni_port", self.rejects_by_eni_port, *group_sum(eni_port, metrics[rejected]))
+            self.merge("rejects.src_cidr", self.rejects_by_src_cidr, *group_sum(src_cidr[rejected], metrics[rejected]))
+
+        for action_name, histogram in self.port_histograms.items():
+            selected = action == action_name
+            np.add.at(histogram, dstport[selected], metrics[selected])
+
+        self.records += len(packets)
+
+    # The entries pruned from a rollup are counted, so the summary tells which top lists are computed from partial totals.
+
+    def merge(self, name, rollup, keys, sums):
+        pruned_entries, pruned_sums = merge(rollup, keys, sums)
+        if pruned_entries:
+            pruned = self.pruned.setdefault(name, {"entries": 0, "records": 0, "packets": 0, "bytes": 0})
+            pruned["entries"] += pruned_entries
+            for metric, value in zip(("records", "packets", "bytes"), pruned_sums.tolist()):
+                pruned[metric] += value
+
+    # Addresses are converted to their network only once per distinct value of the chunk.
+
+    def to_cidr(self, addresses):
+        distinct, inverse = np.unique(addresses, return_inverse=True)
+        networks = np.array([network_of(address, self.cidr_prefix) for address in distinct])
+        return networks[inverse]
+
+    def summary(self, top):
+        return {
+            "records": self.records,
+            "cidr_prefix": self.cidr_prefix,
+            "truncated": bool(self.pruned),
+            "pruned": self.pruned,
+            "top_talkers": {
+                "eni": top_entries(self.eni_talkers, top),
+                "src_cidr": top_entries(self.src_cidr_talkers, top),
+                "dst_cidr": top_entries(self.dst_cidr_talkers, top)
+            },
+            "rejects": {
+                "eni_port": top_entries(self.rejects_by_eni_port, top),
+                "src_cidr": top_entries(self.rejects_by_src_cidr, top)
+            },
+            "port_histograms": {
+                action_name: {
+                    str(port): histogram[port].tolist()
+                    for port in np.flatnonzero(histogram[:, 0])
+                }
+                for action_name, histogram in self.port_histograms.items()
+            }
+        }
+
+# Vectorized group by: the keys are encoded as integers and the metrics are summed per code with a single np.add.at.
+
+def group_sum(keys, metrics):
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    sums = np.zeros((len(distinct), metrics.shape[1]), dtype=np.int64)
+    np.add.at(sums, inverse.reshape(-1), metrics)
+    return distinct, sums
+
+# Merges the partial sums of a chunk into a rollup, when the rollup grows beyond MAX_KEYS only the biggest half (by bytes)
+# is kept, this bounds the memory used no matter how many distinct values the logs have. Returns the number of entries
+# pruned and the sum of their metrics.
+
+def merge(rollup, keys, sums):
+    for key, values in zip(keys.tolist(), sums):
+        current = rollup.get(key)
+        if current is None:
+            rollup[key] = values.copy()
+        else:
+            current += values
+
+    pruned_sums = np.zeros(3, dtype=np.int64)
+    if len(rollup) <= MAX_KEYS:
+        return 0, pruned_sums
+
+    ranked = sorted(rollup.items(), key=lambda entry: entry[1][2], reverse=True)
+    for _, values in ranked[MAX_KEYS // 2:]:
+        pruned_sums += values
+    rollup.clear()
+    rollup.update(ranked[:MAX_KEYS // 2])
+    return len(ranked) - MAX_KEYS // 2, pruned_sums
+
+def top_entries(rollup, top):
+    ranked = sorted(rollup.items(), key=lambda entry: entry[1][2], reverse=True)[:top]
+    return [{"key": key, "records": int(values[0]), "packets": int(values[1]), "bytes": int(values[2])} for key, values in ranked]
+
+def network_of(address, cidr_prefix):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    prefix = cidr_prefix if ip.version == 4 else 64
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+PRIORITY_TAG = os.environ.get("PRIORITY_TAG", "LoggingPriority")                      # Tag used to force the priority class of a resource.
+ENVIRONMENT_TAGS = os.environ.get("ENVIRONMENT_TAGS", "Environment,Env,Stage").split(",")  # Tags read to know the environment of a resource.
+
+PRIORITY_CLASSES = ("critical", "high", "normal", "low")
+PRODUCTION = ("prod", "production", "prd", "live")
+NON_PRODUCTION = ("dev", "development", "test", "testing", "qa", "sandbox", "staging", "stage", "sbx", "poc")
+
+"""
+Priority scheduling of the enablement backlog, used by orchestrateorganization.py. Every resource found by the scan is
+assigned a priority class from its attributes and tags, and the enablements are dispatched from one queue per class
+instead of in the order the scans finish:
+
+    * The exposure of the resource gives the base class: internet-facing Load Balancers and enabled CloudFront
+      Distributions are "high", internal Load Balancers, VPCs and Buckets are "normal", default VPCs and disabled
+      Distributions are "low".
+    * An environment tag (ENVIRONMENT_TAGS) with a production value promotes the resource one class, a non-production
+      value demotes it one class.
+    * The PRIORITY_TAG tag (e.g. LoggingPriority=critical) overrides the result.
+
+Classes are served in strict order. Inside a class the services are served with smooth weighted round robin, so a
+flood of test buckets cannot delay the Load Balancers of the same class, and the accounts of each service in rotation.
+The scheduler also keeps the queue depth and the time-to-enable of each class, which are included in the report of the
+orchestrator.
+"""
+
+def normalize_tags(tags):
+    if isinstance(tags, dict):
+        return {str(key).lower(): str(value).lower() for key, value in tags.items()}
+    return {str(tag.get("Key", "")).lower(): str(tag.get("Value", "")).lower() for tag in tags or []}
+
+# This function returns the priority class of a resource found by the scan, attributes are the fields returned by the
+# describe call (scheme, enabled, is_default) and tags a dict with lowercase keys and values.
+
+def classify_priority(service, attributes, tags):
+    forced = tags.get(PRIORITY_TAG.lower())
+    if forced in PRIORITY_CLASSES:
+        return forced
+
+    if service == "elb":
+        base = "high" if attributes.get("scheme") == "internet-facing" else "normal"
+    elif service == "cloudfront":
+        base = "high" if attributes.get("enabled", True) else "low"
+    elif service == "vpc":
+        base = "low" if attributes.get("is_default") else "normal"
+    else:
+        base = "normal"
+
+    index = PRIORITY_CLASSES.index(base)
+    environment = next((tags[key.lower()] for key in ENVIRONMENT_TAGS if key.lower() in tags), None)
+    if environment in PRODUCTION:
+        index = max(index - 1, 0)
+    elif environment in NON_PRODUCTION:
+        index = min(index + 1, len(PRIORITY_CLASSES) - 1)
+    return PRIORITY_CLASSES[index]
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)], 3)
+
+# Inside each class and service the items are kept in one queue per account, and the accounts with work are served in
+# rotation. An account blocked by the caller (e.g. it reached its max concurrent operations) is dropped from the rotation
+# the first time it is found and added again by unblock(), so a pop never walks the items of a saturated account.
+
+class PriorityScheduler:
+    def __init__(self, weights):
+        self.weights = weights
+        self.queues = {priority: {} for priority in PRIORITY_CLASSES}
+        self.rotations = {priority: {} for priority in PRIORITY_CLASSES}
+        self.current = {priority: {} for priority in PRIORITY_CLASSES}
+        self.depth = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.blocked = set()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.max_depth = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.timeline = []
+        self.waits = {priority: [] for priority in PRIORITY_CLASSES}
+        self.times_to_enable = {priority: [] for priority in PRIORITY_CLASSES}
+
+    # queued_at is only given when an item is queued again (e.g. deferred), so its time-to-enable starts when it was found.
+
+    def push(self, priority, service, account, item, queued_at=None):
+        with self.lock:
+            accounts = self.queues[priority].setdefault(service, {})
+            if account not in accounts:
+                accounts[account] = deque()
+                if account not in self.blocked:
+                    self.rotations[priority].setdefault(service, deque()).append(account)
+            accounts[account].append((queued_at or time.time(), item))
+            self.depth[priority] += 1
+            self.max_depth[priority] = max(self.max_depth[priority], self.depth[priority])
+
+    def block(self, account):
+        with self.lock:
+            self.blocked.add(account)
+
+    def unblock(self, account):
+        with self.lock:
+            if account not in self.blocked:
+                return
+            self.blocked.discard(account)
+            for priority in PRIORITY_CLASSES:
+                for service, accounts in self.queues[priority].items():
+                    rotation = self.rotations[priority].setdefault(service, deque())
+                    if account in accounts and account not in rotation:
+                        rotation.append(account)
+
+    def depths(self):
+        with self.lock:
+            return dict(self.depth)
+
+    def __len__(self):
+        return sum(self.depths().values())
+
+    # This function returns the next account of the rotation of a service that is not blocked, the blocked ones found
+    # on the way are dropped from the rotation (each one only once until it is unblocked).
+
+    def _next_account(self, priority, service):
+        rotation = self.rotations[priority].get(service)
+        while rotation:
+            if rotation[0] not in self.blocked:
+                return rotation[0]
+            rotation.popleft()
+        return None
+
+    # Smooth weighted round robin between the services with a dispatchable account: the services are tried by their
+    # credit plus their weight, the one served gains its weight like the others and pays the total weight.
+
+    def pop(self):
+        with self.lock:
+            for priority in PRIORITY_CLASSES:
+                credits = self.current[priority]
+                services = [service for service in self.queues[priority] if self._next_account(priority, service)]
+                if not services:
+                    continue
+                service = max(services, key=lambda service: credits.get(service, 0) + self.weights.get(service, 1))
+                for other in services:
+                    credits[other] = credits.get(other, 0) + self.weights.get(other, 1)
+                credits[service] -= sum(self.weights.get(other, 1) for other in services)
+
+                rotation = self.rotations[priority][service]
+                account = rotation.popleft()
+                queue = self.queues[priority][service][account]
+                queued_at, item = queue.popleft()
+                if queue:
+                    rotation.append(account)
+                else:
+                    del self.queues[priority][service][account]
+                self.depth[priority] -= 1
+                self.waits[priority].append(time.time() - queued_at)
+                return priority, service, account, item, queued_at
+            return None
+
+    def completed(self, priority, queued_at):
+        with self.lock:
+            self.times_to_enable[priority].append(time.time() - queued_at)
+
+    def sample(self):
+        depths = self.depths()
+        self.timeline.append({"elapsed_seconds": round(time.time() - self.started, 1), **depths})
+        return depths
+
+    def metrics(self):
+        metrics = {}
+        for priority in PRIORITY_CLASSES:
+            times = self.times_to_enable[priority]
+            metrics[priority] = {
+                "completed": len(times),
+                "max_queue_depth": self.max_depth[priority],
+                "queue_wait_seconds": {"p50": percentile(self.waits[priority], 0.5), "p90": percentile(self.waits[priority], 0.9)},
+                "time_to_enable_seconds": {"p50": percentile(times, 0.5), "p90": percentile(times, 0.9), "max": percentile(times, 1.0)}
+            }
+        return {"classes": metrics, "weights": self.weights, "queue_depth_timeline": self.timeline}
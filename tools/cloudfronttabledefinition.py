@@ -0,0 +1,156 @@
+import re
+import sys
+import logging
+import argparse
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Fields of CloudFront Standard Logging v2 in the order they are delivered when recordFields is not defined, with the
+# type used in the table. Fields not listed here are created as string.
+
+FIELDS = [
+    ("date", "string"), ("time", "string"), ("x-edge-location", "string"), ("sc-bytes", "bigint"), ("c-ip", "string"),
+    ("cs-method", "string"), ("cs(Host)", "string"), ("cs-uri-stem", "string"), ("sc-status", "int"), ("cs(Referer)", "string"),
+    ("cs(User-Agent)", "string"), ("cs-uri-query", "string"), ("cs(Cookie)", "string"), ("x-edge-result-type", "string"),
+    ("x-edge-request-id", "string"), ("x-host-header", "string"), ("cs-protocol", "string"), ("cs-bytes", "bigint"),
+    ("time-taken", "double"), ("x-forwarded-for", "string"), ("ssl-protocol", "string"), ("ssl-cipher", "string"),
+    ("x-edge-response-result-type", "string"), ("cs-protocol-version", "string"), ("fle-status", "string"),
+    ("fle-encrypted-fields", "string"), ("c-port", "int"), ("time-to-first-byte", "double"),
+    ("x-edge-detailed-result-type", "string"), ("sc-content-type", "string"), ("sc-content-len", "bigint"),
+    ("sc-range-start", "bigint"), ("sc-range-end", "bigint"), ("timestamp(ms)", "bigint"), ("origin-fbl", "double"),
+    ("origin-lbl", "double"), ("asn", "bigint"), ("c-country", "string"), ("cache-behavior-path-pattern", "string"),
+    ("DistributionId", "string")
+]
+
+# Variables accepted in suffixPath, the partition column created for each one, the folder name used when the Hive
+# compatible path is enabled and the projection of the partition.
+
+PATH_VARIABLES = {
+    "{DistributionId}": ("distribution", "DistributionId", None),
+    "{accountid}": ("account", "aws-account-id", None),
+    "{region}": ("region", "aws-region", None),
+    "{yyyy}": ("year", "year", ("2024", "2100", 4)),
+    "{MM}": ("month", "month", ("1", "12", 2)),
+    "{dd}": ("day", "day", ("1", "31", 2)),
+    "{HH}": ("hour", "hour", ("0", "23", 2))
+}
+
+SERDES = {
+    "json": ("org.openx.data.jsonserde.JsonSerDe", "org.apache.hadoop.mapred.TextInputFormat", "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"),
+    "parquet": ("org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe", "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat", "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat")
+}
+
+"""
+Entry point of the table definition generator. It reads the configuration of the Delivery created by the CloudFront
+Lambda Function (output format, suffixPath, Hive compatible path and recordFields) from CloudWatch Logs, or receives it
+in the command line, and prints the Athena CREATE EXTERNAL TABLE statement that matches that layout.
+
+Every variable of the suffixPath becomes a partition resolved with partition projection, so the queries filtering by
+distribution, year, month, day or hour only list and read those prefixes (no MSCK REPAIR or crawlers are needed), and
+with Parquet only the selected columns are read.
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the Athena table of the CloudFront Standard Logging v2 files.")
+    parser.add_argument("--distribution", action="append", required=True, help="Distribution ID, can be repeated (all of them must share the same layout).")
+    parser.add_argument("--account", required=True)
+    parser.add_argument("--from-aws", action="store_true", help="Read the format, suffixPath and fields from the Delivery of the first distribution.")
+    parser.add_argument("--bucket", default=None, help="Logging bucket, by default s3bkt-access-logging-{distribution}.")
+    parser.add_argument("--output-format", choices=sorted(SERDES), default="json")
+    parser.add_argument("--suffix-path", default="{DistributionId}/{yyyy}/{MM}/{dd}/{HH}")
+    parser.add_argument("--hive-compatible-path", action="store_true")
+    parser.add_argument("--record-fields", default="", help="Comma separated list of fields, empty means all of them.")
+    parser.add_argument("--database", default="fall")
+    parser.add_argument("--table", default="cloudfront_logs")
+    args = parser.parse_args(argv)
+
+    bucket = args.bucket or f"s3bkt-access-logging-{sanitize_name(args.distribution[0])}"
+    config = {
+        "output_format": args.output_format,
+        "suffix_path": args.suffix_path,
+        "hive_compatible_path": args.hive_compatible_path,
+        "record_fields": [field.strip() for field in args.record_fields.split(",") if field.strip()]
+    }
+    if args.from_aws:
+        config = read_delivery_config(args.distribution[0], args.account)
+
+    print(build_table_definition(args.database, args.table, bucket, args.account, args.distribution, **config))
+    return 0
+
+# Same name used by the Lambda Function for the bucket and the Delivery Source.
+
+def sanitize_name(name):
+    return re.sub(r'[^a-zA-Z0-9\-]', '-', name.lower())
+
+# This function reads the configuration of the Delivery from CloudWatch Logs (us-east-1, where CloudFront deliveries live).
+
+def read_delivery_config(distribution_id, account_id):
+    import boto3
+    logs = boto3.client("logs", region_name="us-east-1")
+    source_name = f"CF-{distribution_id}-{sanitize_name(distribution_id)}"
+
+    delivery = None
+    for page in logs.get_paginator("describe_deliveries").paginate():
+        delivery = next((item for item in page["deliveries"] if item["deliverySourceName"] == source_name), delivery)
+    if delivery is None:
+        raise SystemExit(f"No delivery found for the source {source_name} in the account {account_id}")
+
+    destination = logs.get_delivery_destination(name=delivery["deliveryDestinationArn"].split(":")[-1])["deliveryDestination"]
+    s3_configuration = delivery.get("s3DeliveryConfiguration", {})
+    return {
+        "output_format": destination.get("outputFormat", "json"),
+        "suffix_path": s3_configuration.get("suffixPath", ""),
+        "hive_compatible_path": s3_configuration.get("enableHiveCompatiblePath", False),
+        "record_fields": delivery.get("recordFields", [])
+    }
+
+def build_table_definition(database, table, bucket, account_id, distributions, output_format, suffix_path, hive_compatible_path, record_fields):
+    if output_format not in SERDES:
+        raise SystemExit(f"The output format {output_format} is not supported, use json or parquet.")
+
+    types = dict(FIELDS)
+    names = record_fields or [name for name, _ in FIELDS]
+    columns = ",\n".join(f"  `{name}` {types.get(name, 'string')}" for name in names)
+
+    account_folder = f"aws-account-id={account_id}" if hive_compatible_path else account_id
+    location = f"s3://{bucket}/AWSLogs/{account_folder}/CloudFront/"
+
+    partitions = []
+    properties = {"projection.enabled": "true"}
+    for variable in re.findall(r"\{[A-Za-z]+\}", suffix_path):
+        if variable not in PATH_VARIABLES:
+            raise SystemExit(f"The variable {variable} of the suffixPath is not supported.")
+        column, hive_name, projection = PATH_VARIABLES[variable]
+        partitions.append(f"  `{column}` string")
+        if projection:
+            first, last, digits = projection
+            properties.update({f"projection.{column}.type": "integer", f"projection.{column}.range": f"{first},{last}", f"projection.{column}.digits": str(digits)})
+        elif column == "distribution":
+            properties.update({f"projection.{column}.type": "enum", f"projection.{column}.values": ",".join(distributions)})
+        else:
+            properties.update({f"projection.{column}.type": "injected"})
+
+    segments = []
+    for segment in suffix_path.strip("/").split("/") if suffix_path else []:
+        for variable, (column, hive_name, _) in PATH_VARIABLES.items():
+            segment = segment.replace(variable, f"{hive_name}=${{{column}}}" if hive_compatible_path else f"${{{column}}}")
+        segments.append(segment)
+    properties["storage.location.template"] = location + "".join(f"{segment}/" for segment in segments)
+
+    serde, input_format, output_format_class = SERDES[output_format]
+    statement = [f"CREATE EXTERNAL TABLE IF NOT EXISTS `{database}`.`{table}` (", columns, ")"]
+    if partitions:
+        statement += ["PARTITIONED BY (", ",\n".join(partitions), ")"]
+    statement += [
+        f"ROW FORMAT SERDE '{serde}'",
+        f"STORED AS INPUTFORMAT '{input_format}'",
+        f"OUTPUTFORMAT '{output_format_class}'",
+        f"LOCATION '{location}'"
+    ]
+    if partitions:
+        statement += ["TBLPROPERTIES (", ",\n".join(f"  '{key}' = '{value}'" for key, value in properties.items()), ")"]
+    return "\n".join(statement) + ";"
+
+if __name__ == "__main__":
+    sys.exit(main())
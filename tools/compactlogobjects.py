@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from logsources import open_location, iter_lines, is_compressed
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+COMPACTED_PREFIX = os.environ.get("COMPACTED_PREFIX", "compacted/")     # Same prefix used by the Lambda Functions in the Lifecycle Rule of the logging buckets.
+GRACE_HOURS = int(os.environ.get("GRACE_HOURS", "2"))                   # Hours that must pass before an hour is considered complete and can be compacted.
+MIN_OBJECTS = int(os.environ.get("MIN_OBJECTS", "2"))                   # Groups with less objects than this value are not compacted.
+
+MANIFESTS_PREFIX = f"{COMPACTED_PREFIX}_manifests/"
+
+# Layout of the objects delivered by each log source, the groups are built using the source (and resource) and the hour
+# of delivery contained in the key.
+#   ELB:        AWSLogs/{account}/elasticloadbalancing/{region}/yyyy/mm/dd/{account}_elasticloadbalancing_{region}_{lb}_{yyyymmddThhmm}Z_...
+#   S3:         logs/yyyy-mm-dd-hh-mm-ss-{unique}
+#               logs/{account}/{region}/{bucket}/yyyy/mm/dd/yyyy-mm-dd-hh-mm-ss-{unique} (partitioned prefix, used with the log archive)
+#   CloudFront: AWSLogs/{account}/CloudFront/{suffixPath}/{distribution}.yyyy-mm-dd-hh.{unique}.gz
+#               AWSLogs/aws-account-id={account}/CloudFront/{suffixPath}/... (Hive compatible path, e.g. DistributionId={distribution}/year=yyyy/...)
+# Only text logs are compacted (they are merged line by line), the CloudFront Parquet files are never grouped or purged.
+
+BINARY_SUFFIXES = (".parquet",)
+
+SOURCE_PATTERNS = [
+    ("elb", re.compile(r"AWSLogs/(?P<account>\d{12})/elasticloadbalancing/(?P<region>[a-z0-9-]+)/\d{4}/\d{2}/\d{2}/\d{12}_elasticloadbalancing_[a-z0-9-]+_(?P<resource>[^_]+)_(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})T(?P<hour>\d{2})\d{2}Z_")),
+    ("s3", re.compile(r"^logs/(?:(?P<account>\d{12})/(?P<region>[a-z0-9-]+)/(?P<resource>[^/]+)/\d{4}/\d{2}/\d{2}/)?(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})-(?P<hour>\d{2})-\d{2}-\d{2}-[0-9A-Za-z]+$")),
+    ("cloudfront", re.compile(r"AWSLogs/(?:aws-account-id=)?(?P<account>\d{12})/CloudFront/(?:.+/)?(?P<resource>[A-Z0-9]+)\.(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})-(?P<hour>\d{2})\.[^/]+$"))
+]
+
+# Tools of this folder that read the original objects and keep a checkpoint of the objects processed, with the source
+# of the objects they read and the key of their checkpoint in their output location (None: the index generations).
+
+READERS = {
+    "elb-parquet": ("elb", "_checkpoint/elb.json"),                         # convertelblogstoparquet.py --output
+    "s3-index": ("s3", None),                                               # indexs3accesslogs.py --index
+    "cloudfront-rollups": ("cloudfront", "_checkpoint/cloudfront.json")     # rollupcloudfrontlogs.py --store
+}
+
+"""
+Entry point of the compaction job, it works over one logging bucket (s3bkt-access-logging-*) at a time:
+
+    * "compact" groups the small objects delivered by ELB, S3 Server Access Logging and CloudFront per source and hour,
+      merges each group into one gzip object under compacted/{source}/yyyy/mm/dd/hh/ and writes a manifest under
+      compacted/_manifests/ with the Key, ETag and Size of every original object.
+    * "purge" reads the manifests and deletes the original objects, but only when the compacted object exists, the
+      original object still has the ETag recorded in the manifest and every reader given with --reader (e.g.
+      elb-parquet=s3://analytics/elb) already processed it, because those tools only read the originals.
+
+The Lifecycle Rule created by the Lambda Functions only transitions the objects under compacted/ bigger than
+MIN_TRANSITION_SIZE_BYTES, the original small objects just expire.
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact the small log objects of a logging bucket per source and hour.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compact = commands.add_parser("compact", help="Merge the small objects and write the manifests.")
+    compact.add_argument("--bucket", required=True, help="Logging bucket (s3://bucket) or local folder.")
+    compact.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    compact.add_argument("--grace-hours", type=int, default=GRACE_HOURS)
+    compact.add_argument("--min-objects", type=int, default=MIN_OBJECTS)
+
+    purge = commands.add_parser("purge", help="Delete the original objects listed in the manifests.")
+    purge.add_argument("--bucket", required=True, help="Logging bucket (s3://bucket) or local folder.")
+    purge.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    purge.add_argument("--dry-run", action="store_true", help="Only show which objects would be deleted.")
+    purge.add_argument("--reader", action="append", default=[], help=f"Tool that reads the originals as TYPE=LOCATION ({', '.join(READERS)}), can be repeated.")
+
+    args = parser.parse_args(argv)
+    bucket = open_location(args.bucket, args.endpoint_url)
+
+    if args.command == "compact":
+        compact_bucket(bucket, args.grace_hours, args.min_objects)
+    else:
+        purge_originals(bucket, args.dry_run, [load_reader(reader, args.endpoint_url) for reader in args.reader])
+    return 0
+
+# This function returns (source, hour) for a delivered log object, or None when the key is not a known text log object.
+
+def classify(key):
+    if key.startswith(COMPACTED_PREFIX) or key.endswith(BINARY_SUFFIXES):
+        return None
+    for source_type, pattern in SOURCE_PATTERNS:
+        match = pattern.search(key)
+        if match:
+            fields = match.groupdict()
+            source = "/".join(value for value in (source_type, fields.get("account"), fields.get("region"), fields.get("resource")) if value)
+            return source, f"{fields['year']}/{fields['month']}/{fields['day']}/{fields['hour']}"
+    return None
+
+# Here we build the groups of complete hours, ignoring the objects already listed in a previous manifest.
+
+def compact_bucket(bucket, grace_hours, min_objects):
+    already_compacted = set()
+    for manifest in load_manifests(bucket):
+        already_compacted.update(original["Key"] for original in manifest["originals"])
+
+    limit = (datetime.now(timezone.utc) - timedelta(hours=grace_hours)).strftime("%Y/%m/%d/%H")
+    groups = {}
+    for item in bucket.list_objects():
+        classification = classify(item["Key"])
+        if classification is None or item["Key"] in already_compacted or classification[1] >= limit:
+            continue
+        groups.setdefault(classification, []).append(item)
+
+    compacted_groups = 0
+    for (source, hour), items in sorted(groups.items()):
+        if len(items) < min_objects:
+            continue
+        compact_group(bucket, source, hour, sorted(items, key=lambda item: item["Key"]))
+        compacted_groups += 1
+
+    logger.info(f"Compaction finished for {bucket.name}: {compacted_groups} groups compacted.")
+
+# The lines of every original object are streamed into a gzip temporary file (so memory does not grow with the group),
+# then the compacted object is uploaded and, only after that, the manifest. Names depend on the originals of the group
+# so running the job again after a failure overwrites the same objects.
+
+def compact_group(bucket, source, hour, items):
+    digest = hashlib.sha1("\n".join(item["Key"] for item in items).encode("utf-8")).hexdigest()[:16]
+    compacted_key = f"{COMPACTED_PREFIX}{source}/{hour}/part-{digest}.log.gz"
+    manifest_key = f"{MANIFESTS_PREFIX}{source}/{hour}/part-{digest}.json"
+    lines = 0
+
+    with tempfile.TemporaryFile() as temporary:
+        with gzip.GzipFile(fileobj=temporary, mode="wb", compresslevel=9) as compressed:
+            for item in items:
+                stream = bucket.open_object(item["Key"])
+                try:
+                    for line in iter_lines(stream, compressed=is_compressed(item["Key"])):
+                        compressed.write(line.encode("utf-8") + b"\n")
+                        lines += 1
+                finally:
+                    stream.close()
+        compacted_size = temporary.tell()
+        temporary.seek(0)
+        bucket.put_stream(compacted_key, temporary)
+
+    manifest = {
+        "source": source,
+        "hour": hour,
+        "compacted_key": compacted_key,
+        "compacted_size": compacted_size,
+        "lines": lines,
+        "purged": False,
+        "originals": [{"Key": item["Key"], "ETag": item["ETag"], "Size": item["Size"]} for item in items]
+    }
+    bucket.put_bytes(manifest_key, json.dumps(manifest, indent=2).encode("utf-8"))
+    logger.info(f"Compacted {len(items)} objects of {source} {hour} into {compacted_key} ({compacted_size} bytes)")
+
+# This function deletes the originals listed in the manifests not purged yet. If an original was modified after the
+# compaction (different ETag) it is kept, as the Parquet files listed by the manifests of older versions of this job, and
+# the manifest is marked as purged only when every original was handled.
+
+def purge_originals(bucket, dry_run, readers=()):
+    current = {item["Key"]: item["ETag"] for item in bucket.list_objects()}
+    deleted = 0
+    if not readers:
+        logger.warning("No --reader given, the originals are deleted without checking the tools that read them.")
+
+    for manifest_key, manifest in load_manifests(bucket, with_keys=True):
+        if manifest["purged"]:
+            continue
+        if manifest["compacted_key"] not in current:
+            logger.warning(f"Compacted object {manifest['compacted_key']} not found, skipping {manifest_key}")
+            continue
+
+        pending = False
+        for original in manifest["originals"]:
+            etag = current.get(original["Key"])
+            if etag is None:
+                continue
+            if original["Key"].endswith(BINARY_SUFFIXES):
+                logger.warning(f"{original['Key']} is not a text log object, it will not be deleted.")
+                pending = True
+                continue
+            if etag != original["ETag"]:
+                logger.warning(f"{original['Key']} changed after the compaction, it will not be deleted.")
+                pending = True
+                continue
+            waiting = [name for name, source_type, processed in readers if source_type == manifest["source"].split("/")[0] and (original["Key"], etag) not in processed]
+            if waiting:
+                logger.info(f"{original['Key']} not processed yet by {', '.join(waiting)}, it will be deleted later.")
+                pending = True
+                continue
+            if dry_run:
+                logger.info(f"[dry-run] Would delete {original['Key']}")
+                continue
+            bucket.delete_object(original["Key"])
+            deleted += 1
+
+        if not dry_run and not pending:
+            manifest["purged"] = True
+            bucket.put_bytes(manifest_key, json.dumps(manifest, indent=2).encode("utf-8"))
+
+    logger.info(f"Purge finished for {bucket.name}: {deleted} original objects deleted.")
+
+# This function returns (name, source type, processed) for a reader given as TYPE=LOCATION, processed is the set of
+# (Key, ETag) of its checkpoint, the Keys are relative to the bucket the reader was executed with.
+
+def load_reader(reader, endpoint_url):
+    name, _, uri = reader.partition("=")
+    if name not in READERS or not uri:
+        raise SystemExit(f"Invalid reader {reader}, use TYPE=LOCATION with TYPE in {', '.join(READERS)}.")
+    source_type, checkpoint_key = READERS[name]
+    location = open_location(uri, endpoint_url)
+    if checkpoint_key is None:
+        generation = location.get_bytes("CURRENT").decode("utf-8").strip() if location.exists("CURRENT") else ""
+        checkpoint_key = f"{generation}/checkpoint.json" if generation else "checkpoint.json"
+
+    entries = json.loads(location.get_bytes(checkpoint_key).decode("utf-8")) if location.exists(checkpoint_key) else {}
+    return name, source_type, {(entry.partition("|")[2], etag) for entry, etag in entries.items()}
+
+def load_manifests(bucket, with_keys=False):
+    for item in bucket.list_objects(MANIFESTS_PREFIX):
+        if not item["Key"].endswith(".json"):
+            continue
+        manifest = json.loads(bucket.get_bytes(item["Key"]).decode("utf-8"))
+        yield (item["Key"], manifest) if with_keys else manifest
+
+if __name__ == "__main__":
+    sys.exit(main())
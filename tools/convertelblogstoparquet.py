@@ -0,0 +1,204 @@
+import os
+import re
+import sys
+import hashlib
+import logging
+import argparse
+import pyarrow as pa
+import pyarrow.parquet as pq
+from logsources import open_location, iter_lines, is_compressed, Checkpoint
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+BATCH_ROWS = int(os.environ.get("BATCH_ROWS", "100000"))                    # Max rows kept in memory per partition before writing a Parquet file.
+CHECKPOINT_KEY = os.environ.get("CHECKPOINT_KEY", "_checkpoint/elb.json")   # Manifest (inside the output location) with the objects already converted.
+CHECKPOINT_EVERY = int(os.environ.get("CHECKPOINT_EVERY", "100"))          # Objects converted between two saves of the checkpoint (it is also saved at the end).
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")         # Compression codec used in the Parquet files.
+
+# This tokenizer is compiled once and returns every field of an access log line, a field is a quoted string or a
+# sequence of characters without spaces. Adjacent quoted segments separated by commas are one field (the NLB
+# alpn_client_preference_list is written as "h2","http/1.1"), quoted values keep the content without the quotes and the
+# segments are joined with commas (h2,http/1.1).
+
+TOKENIZER = re.compile(r'((?:"[^"]*",?)+)|(\S+)')
+QUOTED_SEGMENT = re.compile(r'"([^"]*)"')
+
+# Keys delivered by the ELB service follow this layout, we use it to filter only ELB log objects.
+
+ELB_KEY_PATTERN = re.compile(r"AWSLogs/(\d{12})/elasticloadbalancing/([a-z0-9-]+)/(\d{4})/(\d{2})/(\d{2})/[^/]+\.log(\.gz)?$")
+
+# Fields of the Application Load Balancer access log entries in the order they are written by AWS, only the ones with a
+# type different from string are converted, the remaining fields are stored as they come.
+
+ALB_FIELDS = [
+    ("type", pa.string()), ("time", pa.string()), ("elb", pa.string()), ("client_port", pa.string()),
+    ("target_port", pa.string()), ("request_processing_time", pa.float64()), ("target_processing_time", pa.float64()),
+    ("response_processing_time", pa.float64()), ("elb_status_code", pa.int32()), ("target_status_code", pa.int32()),
+    ("received_bytes", pa.int64()), ("sent_bytes", pa.int64()), ("request", pa.string()), ("user_agent", pa.string()),
+    ("ssl_cipher", pa.string()), ("ssl_protocol", pa.string()), ("target_group_arn", pa.string()),
+    ("trace_id", pa.string()), ("domain_name", pa.string()), ("chosen_cert_arn", pa.string()),
+    ("matched_rule_priority", pa.string()), ("request_creation_time", pa.string()), ("actions_executed", pa.string()),
+    ("redirect_url", pa.string()), ("error_reason", pa.string()), ("target_port_list", pa.string()),
+    ("target_status_code_list", pa.string()), ("classification", pa.string()), ("classification_reason", pa.string()),
+    ("conn_trace_id", pa.string())
+]
+
+# Fields of the Network Load Balancer (TLS listeners) access log entries in the order they are written by AWS.
+
+NLB_FIELDS = [
+    ("type", pa.string()), ("version", pa.string()), ("time", pa.string()), ("elb", pa.string()),
+    ("listener", pa.string()), ("client_port", pa.string()), ("destination_port", pa.string()),
+    ("connection_time", pa.int64()), ("tls_handshake_time", pa.int64()), ("received_bytes", pa.int64()),
+    ("sent_bytes", pa.int64()), ("incoming_tls_alert", pa.string()), ("chosen_cert_arn", pa.string()),
+    ("chosen_cert_serial", pa.string()), ("tls_cipher", pa.string()), ("tls_protocol_version", pa.string()),
+    ("tls_named_group", pa.string()), ("domain_name", pa.string()), ("alpn_fe_protocol", pa.string()),
+    ("alpn_be_protocol", pa.string()), ("alpn_client_preference_list", pa.string()),
+    ("tls_connection_creation_time", pa.string())
+]
+
+FORMATS = {
+    "alb": (ALB_FIELDS, pa.schema(ALB_FIELDS)),
+    "nlb": (NLB_FIELDS, pa.schema(NLB_FIELDS))
+}
+
+FIELD_INDEX = {name: {field[0]: index for index, field in enumerate(fields)} for name, (fields, _) in FORMATS.items()}
+
+"""
+Entry point of the converter, for each source (a logging bucket s3bkt-access-logging-{lb_name} or a local copy of it) we
+list the objects delivered under AWSLogs/{account}/elasticloadbalancing/, skip the ones present in the checkpoint manifest,
+stream and parse every new object and write the rows as Parquet files partitioned by format, date and Load Balancer name:
+
+    {output}/format=alb/date=2025-06-18/lb=my-alb/part-{object_hash}-{sequence}.parquet
+
+Part names are derived from the source object so if the process stops before the manifest is saved, the next execution
+overwrites the same files instead of duplicating rows. That is why the manifest, rewritten completely on each save, is only
+saved every CHECKPOINT_EVERY objects and at the end.
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert ELB access logs into partitioned Parquet files.")
+    parser.add_argument("--source", action="append", required=True, help="Logging bucket (s3://bucket) or local folder, can be repeated.")
+    parser.add_argument("--output", required=True, help="Destination of the Parquet dataset (s3://bucket/prefix or local folder).")
+    parser.add_argument("--account", default="", help="Only convert the logs of this AWS Account ID.")
+    parser.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY)
+    args = parser.parse_args(argv)
+
+    output = open_location(args.output, args.endpoint_url)
+    checkpoint = Checkpoint(output, CHECKPOINT_KEY)
+    prefix = f"AWSLogs/{args.account}/elasticloadbalancing/" if args.account else "AWSLogs/"
+
+    converted_objects = 0
+    converted_rows = 0
+
+    for source_uri in args.source:
+        source = open_location(source_uri, args.endpoint_url)
+        for item in source.list_objects(prefix):
+            if not ELB_KEY_PATTERN.search(item["Key"]) or checkpoint.is_processed(source.name, item):
+                continue
+            rows = convert_object(source, item, output, args.batch_rows)
+            checkpoint.mark_processed(source.name, item)
+            converted_objects += 1
+            converted_rows += rows
+            logger.info(f"Converted {item['Key']} from {source.name} ({rows} rows)")
+            if converted_objects % args.checkpoint_every == 0:
+                checkpoint.save()
+
+    if converted_objects:
+        checkpoint.save()
+    logger.info(f"Conversion finished: {converted_objects} new objects, {converted_rows} rows written.")
+    return 0
+
+# This function streams one log object, groups the parsed rows by partition and flush them every batch_rows rows.
+
+def convert_object(source, item, output, batch_rows):
+    object_hash = hashlib.sha1(f"{source.name}|{item['Key']}".encode("utf-8")).hexdigest()[:16]
+    buffers = {}
+    sequences = {}
+    total_rows = 0
+
+    stream = source.open_object(item["Key"])
+    try:
+        for line in iter_lines(stream, compressed=is_compressed(item["Key"])):
+            parsed = parse_line(line)
+            if parsed is None:
+                logger.warning(f"Skipping malformed line in {item['Key']}: {line[:200]}")
+                continue
+            log_format, values = parsed
+            partition = (log_format, values[FIELD_INDEX[log_format]["time"]][:10], lb_name(values[FIELD_INDEX[log_format]["elb"]]))
+            rows = buffers.setdefault(partition, [])
+            rows.append(values)
+            total_rows += 1
+            if len(rows) >= batch_rows:
+                write_partition(output, partition, rows, object_hash, sequences)
+                buffers[partition] = []
+    finally:
+        stream.close()
+
+    for partition, rows in buffers.items():
+        if rows:
+            write_partition(output, partition, rows, object_hash, sequences)
+
+    return total_rows
+
+# Here we split the line using the compiled tokenizer and identify the format using the first field (NLB entries are
+# always "tls" and ALB entries are http, https, h2, grpcs, ws or wss). Missing trailing fields (older log versions) are
+# filled with None and extra fields (newer log versions) are ignored.
+
+def parse_line(line):
+    tokens = [",".join(QUOTED_SEGMENT.findall(quoted)) if quoted else unquoted for quoted, unquoted in TOKENIZER.findall(line)]
+    if len(tokens) < 5:
+        return None
+
+    log_format = "nlb" if tokens[0] == "tls" else "alb"
+    fields = FORMATS[log_format][0]
+    if len(tokens) < len(fields):
+        tokens.extend([None] * (len(fields) - len(tokens)))
+    return log_format, tokens[:len(fields)]
+
+# ELB writes the Load Balancer as app/{name}/{id} or net/{name}/{id}, we use only the name to build the partition.
+
+def lb_name(elb_field):
+    parts = elb_field.split("/")
+    return parts[1] if len(parts) == 3 else elb_field
+
+# Values equal to "-" are considered empty, numeric fields are converted according to the Parquet schema.
+
+def convert_value(value, field_type):
+    if value is None or value == "-":
+        return None
+    try:
+        if pa.types.is_integer(field_type):
+            return int(value)
+        if pa.types.is_floating(field_type):
+            number = float(value)
+            return None if number < 0 else number
+    except ValueError:
+        return None
+    return value
+
+# This function builds the Arrow table of a partition in a columnar way and writes it as a single Parquet file.
+
+def write_partition(output, partition, rows, object_hash, sequences):
+    log_format, date, name = partition
+    fields, schema = FORMATS[log_format]
+    columns = [
+        pa.array([convert_value(row[index], field_type) for row in rows], type=field_type)
+        for index, (_, field_type) in enumerate(fields)
+    ]
+    table = pa.Table.from_arrays(columns, schema=schema)
+
+    sequence = sequences.get(partition, 0)
+    sequences[partition] = sequence + 1
+    key = f"format={log_format}/date={date}/lb={name}/part-{object_hash}-{sequence:05d}.parquet"
+
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression=PARQUET_COMPRESSION)
+    output.put_bytes(key, sink.getvalue().to_pybytes())
+
+if __name__ == "__main__":
+    sys.exit(main())
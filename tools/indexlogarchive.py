@@ -0,0 +1,133 @@
+import re
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime, timezone
+from logsources import open_location
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+INDEX_KEY = "_index/prefixes.json"
+ACCOUNT = re.compile(r"^(?:aws-account-id=)?(\d{12})/$")
+DISTRIBUTION = re.compile(r"^(?:DistributionId=)?(E[A-Z0-9]+)/$")
+
+"""
+Entry point of the log archive index. The logging buckets replicate their objects into the central archive bucket (see
+lambda_code/fallarchive.py) keeping their keys, so every account, region and service has its own prefix:
+
+    * ELB:        AWSLogs/{account}/elasticloadbalancing/{region}/
+    * CloudFront: AWSLogs/{account}/CloudFront/ (or AWSLogs/aws-account-id={account}/CloudFront/)
+    * S3:         logs/{account}/{region}/{source_bucket}/
+    * Compacted:  compacted/{service}/{account}/... (objects merged by tools/compactlogobjects.py)
+
+The "update" command walks those prefixes with delimiter listings (it never lists the log objects themselves) and writes
+the index in _index/prefixes.json. The "locate" command answers from the index which prefixes must be read for an
+account, region, service or resource, so a query reads one location instead of fanning out to every logging bucket.
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index the prefixes replicated into the central log archive bucket.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Walk the archive bucket and write the prefix index.")
+    update.add_argument("--archive", required=True, help="Archive bucket (s3://bucket) or local folder.")
+    update.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+
+    locate = commands.add_parser("locate", help="Print the prefixes of the archive that match the filters.")
+    locate.add_argument("--archive", required=True, help="Archive bucket (s3://bucket) or local folder.")
+    locate.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    locate.add_argument("--account", default=None)
+    locate.add_argument("--region", default=None)
+    locate.add_argument("--service", choices=("elb", "cloudfront", "s3"), default=None)
+    locate.add_argument("--resource", default=None, help="Load Balancer, Distribution or source bucket.")
+    locate.add_argument("--include-compacted", action="store_true")
+
+    args = parser.parse_args(argv)
+    archive = open_location(args.archive, args.endpoint_url)
+
+    if args.command == "update":
+        entries = build_index(archive)
+        index = {"updated": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"), "entries": entries}
+        archive.put_bytes(INDEX_KEY, json.dumps(index, indent=2).encode("utf-8"))
+        logger.info(f"Index of {archive.name} updated with {len(entries)} prefixes.")
+    else:
+        index = json.loads(archive.get_bytes(INDEX_KEY).decode("utf-8"))
+        base = archive.name.rstrip("/") + "/"
+        for entry in locate_prefixes(index["entries"], args.account, args.region, args.service, args.resource, args.include_compacted):
+            print(f"{base}{entry['prefix']}")
+    return 0
+
+def entry(account, region, service, prefix, resource=None, compacted=False):
+    return {"account": account, "region": region, "service": service, "resource": resource, "prefix": prefix, "compacted": compacted}
+
+# Here we walk the layout of each log source, one delimiter listing per level.
+
+def build_index(archive):
+    entries = []
+
+    for account_prefix in archive.list_prefixes("AWSLogs/"):
+        match = ACCOUNT.match(account_prefix[len("AWSLogs/"):])
+        if not match:
+            continue
+        account = match.group(1)
+        children = archive.list_prefixes(account_prefix)
+        if f"{account_prefix}elasticloadbalancing/" in children:
+            for region_prefix in archive.list_prefixes(f"{account_prefix}elasticloadbalancing/"):
+                region = region_prefix.rstrip("/").rsplit("/", 1)[-1]
+                entries.append(entry(account, region, "elb", region_prefix))
+        cloudfront_prefix = f"{account_prefix}CloudFront/"
+        if cloudfront_prefix in children:
+            distributions = [(prefix, DISTRIBUTION.match(prefix[len(cloudfront_prefix):])) for prefix in archive.list_prefixes(cloudfront_prefix)]
+            distributions = [(prefix, match.group(1)) for prefix, match in distributions if match]
+            for distribution_prefix, distribution in distributions:
+                entries.append(entry(account, "global", "cloudfront", distribution_prefix, resource=distribution))
+            if not distributions:
+                entries.append(entry(account, "global", "cloudfront", cloudfront_prefix))
+
+    for account_prefix in archive.list_prefixes("logs/"):
+        match = ACCOUNT.match(account_prefix[len("logs/"):])
+        if not match:
+            continue
+        for region_prefix in archive.list_prefixes(account_prefix):
+            region = region_prefix.rstrip("/").rsplit("/", 1)[-1]
+            for bucket_prefix in archive.list_prefixes(region_prefix):
+                bucket = bucket_prefix.rstrip("/").rsplit("/", 1)[-1]
+                entries.append(entry(match.group(1), region, "s3", bucket_prefix, resource=bucket))
+
+    for service_prefix in archive.list_prefixes("compacted/"):
+        service = service_prefix[len("compacted/"):].rstrip("/")
+        if service not in ("elb", "s3", "cloudfront"):
+            continue
+        for account_prefix in archive.list_prefixes(service_prefix):
+            account = account_prefix.rstrip("/").rsplit("/", 1)[-1]
+            if not ACCOUNT.match(f"{account}/"):
+                continue
+            if service == "cloudfront":
+                for resource_prefix in archive.list_prefixes(account_prefix):
+                    entries.append(entry(account, "global", service, resource_prefix, resource=resource_prefix.rstrip("/").rsplit("/", 1)[-1], compacted=True))
+                continue
+            for region_prefix in archive.list_prefixes(account_prefix):
+                region = region_prefix.rstrip("/").rsplit("/", 1)[-1]
+                for resource_prefix in archive.list_prefixes(region_prefix):
+                    entries.append(entry(account, region, service, resource_prefix, resource=resource_prefix.rstrip("/").rsplit("/", 1)[-1], compacted=True))
+
+    return entries
+
+def locate_prefixes(entries, account=None, region=None, service=None, resource=None, include_compacted=False):
+    for item in entries:
+        if item["compacted"] and not include_compacted:
+            continue
+        if account and item["account"] != account:
+            continue
+        if region and item["region"] != region:
+            continue
+        if service and item["service"] != service:
+            continue
+        if resource and item["resource"] not in (None, resource):
+            continue
+        yield item
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+import os
+import re
+import sys
+import json
+import heapq
+import shutil
+import logging
+import argparse
+from array import array
+from datetime import datetime
+from logsources import open_location, iter_lines, is_compressed, Checkpoint, LocalLocation
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+PREFIX_DEPTH = int(os.environ.get("PREFIX_DEPTH", "2"))     # Number of "/" separated segments of the object key used as key prefix.
+LOGS_PREFIX = os.environ.get("LOGS_PREFIX", "logs/")        # TargetPrefix configured by enables3accesslogging in the logging buckets.
+
+# Compiled tokenizer for the S3 server access log format, a field is a quoted string, the bracketed timestamp or a
+# sequence of characters without spaces.
+
+TOKENIZER = re.compile(r'"([^"]*)"|\[([^\]]*)\]|(\S+)')
+
+# Position of the fields we aggregate within a server access log record.
+
+BUCKET, TIME, REQUESTER, OPERATION, KEY, HTTP_STATUS, BYTES_SENT = 1, 2, 4, 6, 7, 9, 11
+
+# Each aggregate is an array of int64 counters with METRICS values per entry, the position of an entry in the array is
+# the position of its key in the keys list, this keep the index compact and fast to load.
+
+METRICS = ("requests", "bytes", "errors")
+
+AGGREGATES = {
+    "prefix": ("bucket", "prefix"),
+    "requester": ("hour", "requester"),
+    "operation": ("hour", "operation")
+}
+
+# Every update writes the aggregates and the checkpoint into a new generation folder of the index, and only then the
+# CURRENT file is replaced to point to it. The aggregates and the checkpoint are committed together, a failure in the
+# middle leaves the previous generation untouched and the same objects are processed again.
+
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "generation-"
+CHECKPOINT_FILE = "checkpoint.json"
+
+"""
+Entry point of the indexer. The "update" command lists the objects delivered under logs/ in the logging buckets
+s3bkt-access-logging-{bucket} (or local copies of them), parses only the objects not present in the checkpoint and adds
+their records to the on-disk aggregates. The "top" command loads the aggregates and answers top-N questions like
+"which key prefixes received more requests" or "which requester generated more errors during this hour".
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental hot-key and top-requester index of S3 server access logs.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Add the newly delivered log objects to the index.")
+    update.add_argument("--source", action="append", required=True, help="Logging bucket (s3://bucket) or local folder, can be repeated.")
+    update.add_argument("--index", required=True, help="Local folder where the index is stored.")
+    update.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    update.add_argument("--prefix-depth", type=int, default=PREFIX_DEPTH)
+
+    top = commands.add_parser("top", help="Query the index.")
+    top.add_argument("--index", required=True, help="Local folder where the index is stored.")
+    top.add_argument("--by", choices=sorted(AGGREGATES), default="prefix")
+    top.add_argument("--metric", choices=METRICS, default="requests")
+    top.add_argument("--hour", default=None, help="Limit requester/operation results to one hour (YYYY-MM-DDTHH).")
+    top.add_argument("--limit", type=int, default=10)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "update":
+        update_index(args.source, args.index, args.endpoint_url, args.prefix_depth)
+    else:
+        for key, value in top_n(args.index, args.by, args.metric, args.limit, args.hour):
+            print(f"{value:>16}  {' '.join(key)}")
+    return 0
+
+# Array backed counter table, new keys are appended at the end of the keys list and their counters at the end of the array.
+
+class CounterTable:
+    def __init__(self):
+        self.keys = []
+        self.positions = {}
+        self.counts = array("q")
+
+    def add(self, key, requests, sent_bytes, errors):
+        position = self.positions.get(key)
+        if position is None:
+            position = len(self.keys)
+            self.positions[key] = position
+            self.keys.append(key)
+            self.counts.extend((0, 0, 0))
+        offset = position * len(METRICS)
+        self.counts[offset] += requests
+        self.counts[offset + 1] += sent_bytes
+        self.counts[offset + 2] += errors
+
+    def load(self, folder, name):
+        keys_path = os.path.join(folder, f"{name}.keys.json")
+        counts_path = os.path.join(folder, f"{name}.counts.bin")
+        if not os.path.exists(keys_path):
+            return self
+        with open(keys_path, "r") as handler:
+            self.keys = [tuple(key) for key in json.load(handler)]
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        with open(counts_path, "rb") as handler:
+            self.counts.frombytes(handler.read())
+        return self
+
+    def save(self, folder, name):
+        keys_path = os.path.join(folder, f"{name}.keys.json")
+        counts_path = os.path.join(folder, f"{name}.counts.bin")
+        with open(f"{counts_path}.tmp", "wb") as handler:
+            self.counts.tofile(handler)
+        with open(f"{keys_path}.tmp", "w") as handler:
+            json.dump(self.keys, handler, separators=(",", ":"))
+        os.replace(f"{counts_path}.tmp", counts_path)
+        os.replace(f"{keys_path}.tmp", keys_path)
+
+# This function processes only the objects that are not in the checkpoint of the current generation, the new
+# aggregates and checkpoint are published as the next generation once every object was indexed.
+
+def update_index(sources, index_folder, endpoint_url, prefix_depth):
+    os.makedirs(index_folder, exist_ok=True)
+    current = current_generation(index_folder)
+    tables = {name: CounterTable().load(current, name) for name in AGGREGATES}
+    checkpoint = Checkpoint(LocalLocation(current), CHECKPOINT_FILE)
+
+    new_objects = 0
+    new_records = 0
+
+    for source_uri in sources:
+        source = open_location(source_uri, endpoint_url)
+        for item in source.list_objects(LOGS_PREFIX):
+            if checkpoint.is_processed(source.name, item):
+                continue
+            stream = source.open_object(item["Key"])
+            try:
+                new_records += index_records(iter_lines(stream, compressed=is_compressed(item["Key"])), tables, prefix_depth)
+            finally:
+                stream.close()
+            checkpoint.mark_processed(source.name, item)
+            new_objects += 1
+
+    if new_objects:
+        publish_generation(index_folder, current, tables, checkpoint)
+    logger.info(f"Index updated: {new_objects} new objects, {new_records} records.")
+
+# Returns the folder of the generation pointed by CURRENT, indexes created before the generations keep their files in
+# the index folder itself.
+
+def current_generation(index_folder):
+    current_path = os.path.join(index_folder, CURRENT_FILE)
+    if not os.path.exists(current_path):
+        return index_folder
+    with open(current_path, "r") as handler:
+        return os.path.join(index_folder, handler.read().strip())
+
+# The files of the new generation are flushed to disk before CURRENT is replaced, then the older generations (and the
+# files of the previous layout) are removed.
+
+def publish_generation(index_folder, current, tables, checkpoint):
+    number = int(os.path.basename(current)[len(GENERATION_PREFIX):]) + 1 if current != index_folder else 1
+    generation = f"{GENERATION_PREFIX}{number:08d}"
+    folder = os.path.join(index_folder, generation)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+
+    for name, table in tables.items():
+        table.save(folder, name)
+    checkpoint.save(LocalLocation(folder))
+    for file_name in os.listdir(folder):
+        fsync_file(os.path.join(folder, file_name))
+
+    current_path = os.path.join(index_folder, CURRENT_FILE)
+    with open(f"{current_path}.tmp", "w") as handler:
+        handler.write(generation)
+    fsync_file(f"{current_path}.tmp")
+    os.replace(f"{current_path}.tmp", current_path)
+
+    for file_name in os.listdir(index_folder):
+        path = os.path.join(index_folder, file_name)
+        if file_name.startswith(GENERATION_PREFIX) and file_name != generation:
+            shutil.rmtree(path, ignore_errors=True)
+        elif file_name == CHECKPOINT_FILE or file_name.endswith((".keys.json", ".counts.bin")):
+            os.remove(path)
+
+def fsync_file(path):
+    with open(path, "rb") as handler:
+        os.fsync(handler.fileno())
+
+# Here we parse the records in bulk and update the counters of each aggregate, malformed lines are ignored.
+
+def index_records(lines, tables, prefix_depth):
+    prefixes = tables["prefix"]
+    requesters = tables["requester"]
+    operations = tables["operation"]
+    records = 0
+
+    for line in lines:
+        fields = [unquoted or bracketed or quoted for quoted, bracketed, unquoted in TOKENIZER.findall(line)]
+        if len(fields) <= BYTES_SENT:
+            continue
+
+        hour = to_hour(fields[TIME])
+        if hour is None:
+            continue
+        sent_bytes = int(fields[BYTES_SENT]) if fields[BYTES_SENT].isdigit() else 0
+        errors = 1 if fields[HTTP_STATUS][:1] in ("4", "5") else 0
+
+        prefixes.add((fields[BUCKET], key_prefix(fields[KEY], prefix_depth)), 1, sent_bytes, errors)
+        requesters.add((hour, fields[REQUESTER]), 1, sent_bytes, errors)
+        operations.add((hour, fields[OPERATION]), 1, sent_bytes, errors)
+        records += 1
+
+    return records
+
+# The timestamp of the records is written as 06/Feb/2019:00:00:38 +0000, we keep only the hour as 2019-02-06T00.
+
+def to_hour(value):
+    try:
+        return datetime.strptime(value[:14], "%d/%b/%Y:%H").strftime("%Y-%m-%dT%H")
+    except ValueError:
+        return None
+
+# Returns the first prefix_depth segments of the object key, "-" means the request was not related with an object.
+
+def key_prefix(key, prefix_depth):
+    if key == "-":
+        return "-"
+    parts = key.split("/")
+    if len(parts) <= prefix_depth:
+        return key
+    return "/".join(parts[:prefix_depth]) + "/"
+
+# This function loads one aggregate and returns the top entries for the metric requested. When no hour is given,
+# requester and operation counters of all hours are merged before ranking.
+
+def top_n(index_folder, aggregate, metric, limit, hour=None):
+    table = CounterTable().load(current_generation(index_folder), aggregate)
+    width = len(METRICS)
+    metric_offset = METRICS.index(metric)
+    counts = table.counts
+
+    if aggregate == "prefix":
+        totals = ((key, counts[position * width + metric_offset]) for position, key in enumerate(table.keys))
+    elif hour:
+        totals = ((key[1:], counts[position * width + metric_offset]) for position, key in enumerate(table.keys) if key[0] == hour)
+    else:
+        merged = {}
+        for position, key in enumerate(table.keys):
+            merged[key[1:]] = merged.get(key[1:], 0) + counts[position * width + metric_offset]
+        totals = merged.items()
+
+    return heapq.nlargest(limit, totals, key=lambda entry: entry[1])
+
+if __name__ == "__main__":
+    sys.exit(main())
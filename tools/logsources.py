@@ -0,0 +1,237 @@
+import io
+import os
+import json
+import zlib
+import shutil
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Size of each read performed against a log object, the objects are never loaded completely in memory.
+
+READ_CHUNK_SIZE = int(os.environ.get("READ_CHUNK_SIZE", str(1024 * 1024)))
+
+"""
+Small storage layer shared by the offline tools of this folder. A location can be a local directory (for example a copy
+of a logging bucket downloaded with "aws s3 sync") or an s3://bucket/prefix URI. When an endpoint URL is provided the S3
+client is pointed to it, which allow us to run the tools against a local S3 stand-in such as MinIO or LocalStack.
+"""
+
+# This function returns the right location object depending on the URI received.
+
+def open_location(uri, endpoint_url=None):
+    if uri.startswith("s3://"):
+        parsed = urlparse(uri)
+        return S3Location(parsed.netloc, parsed.path.lstrip("/"), endpoint_url)
+    return LocalLocation(uri)
+
+# Location backed by a folder of the local filesystem, keys are always expressed using "/" as separator.
+
+class LocalLocation:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.name = self.root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def list_objects(self, prefix=""):
+        base = self._path(prefix) if prefix else self.root
+        search_root = base if os.path.isdir(base) else os.path.dirname(base)
+        for current, _, files in os.walk(search_root):
+            for file_name in sorted(files):
+                path = os.path.join(current, file_name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    yield {"Key": key, "Size": stat.st_size, "ETag": f"{stat.st_size}-{int(stat.st_mtime)}"}
+
+    # This function returns the "folders" directly under the prefix (the prefix must end with "/"), like a listing
+    # with Delimiter="/" does in S3.
+
+    def list_prefixes(self, prefix=""):
+        base = self._path(prefix) if prefix else self.root
+        if not os.path.isdir(base):
+            return []
+        return [f"{prefix}{name}/" for name in sorted(os.listdir(base)) if os.path.isdir(os.path.join(base, name))]
+
+    def open_object(self, key):
+        return open(self._path(key), "rb")
+
+    def open_seekable(self, key):
+        return open(self._path(key), "rb")
+
+    def get_bytes(self, key):
+        with self.open_object(key) as handler:
+            return handler.read()
+
+    def put_bytes(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as handler:
+            handler.write(data)
+        os.replace(temporary_path, path)
+
+    def put_stream(self, key, stream):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "wb") as handler:
+            shutil.copyfileobj(stream, handler, READ_CHUNK_SIZE)
+        os.replace(temporary_path, path)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete_object(self, key):
+        os.remove(self._path(key))
+
+# Location backed by an S3 Bucket (or an S3 compatible endpoint), boto3 is imported only when this location is used.
+
+class S3Location:
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+        self.name = f"s3://{bucket}/{self.prefix}"
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def list_objects(self, prefix=""):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get("Contents", []):
+                yield {
+                    "Key": item["Key"][len(self.prefix):],
+                    "Size": item["Size"],
+                    "ETag": item["ETag"].strip('"')
+                }
+
+    def list_prefixes(self, prefix=""):
+        paginator = self.s3.get_paginator("list_objects_v2")
+        prefixes = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix, Delimiter="/"):
+            prefixes.extend(item["Prefix"][len(self.prefix):] for item in page.get("CommonPrefixes", []))
+        return prefixes
+
+    def open_object(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+
+    # Columnar formats (Parquet) read the footer first and then only the column chunks needed, so the object is opened as a
+    # seekable file where every read is a ranged GET instead of being downloaded completely.
+
+    def open_seekable(self, key):
+        return io.BufferedReader(S3RangeReader(self.s3, self.bucket, self.prefix + key), buffer_size=READ_CHUNK_SIZE)
+
+    def get_bytes(self, key):
+        return self.open_object(key).read()
+
+    def put_bytes(self, key, data):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def put_stream(self, key, stream):
+        self.s3.upload_fileobj(stream, self.bucket, self.prefix + key)
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def delete_object(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+class S3RangeReader(io.RawIOBase):
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        data = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.position}-{end - 1}")["Body"].read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+# This generator reads an object in chunks and yields decoded lines, gzip objects (even with multiple members, as ELB
+# writes them) are decompressed incrementally so the memory used does not depend on the size of the log file.
+
+def iter_lines(stream, compressed=True, chunk_size=None):
+    chunk_size = chunk_size or READ_CHUNK_SIZE
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if compressed else None
+    pending = b""
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is not None:
+            data = decompressor.decompress(chunk)
+            while decompressor.eof and decompressor.unused_data:
+                remaining = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                data += decompressor.decompress(remaining)
+            chunk = data
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line.decode("utf-8", errors="replace")
+
+    if decompressor is not None:
+        pending += decompressor.flush()
+    if pending:
+        yield pending.decode("utf-8", errors="replace")
+
+# This function tells us if a key looks like a gzip compressed log file.
+
+def is_compressed(key):
+    return key.endswith(".gz")
+
+# The checkpoint manifest records which objects were already processed (source, key and ETag) so every object is
+# processed exactly once, it is written only after the output of an object is persisted. save() can also write it to
+# another location, e.g. together with the output in a new generation of an index.
+
+class Checkpoint:
+    def __init__(self, location, key):
+        self.location = location
+        self.key = key
+        self.entries = {}
+        if location.exists(key):
+            self.entries = json.loads(location.get_bytes(key).decode("utf-8"))
+
+    def is_processed(self, source_name, item):
+        return self.entries.get(f"{source_name}|{item['Key']}") == item["ETag"]
+
+    def mark_processed(self, source_name, item):
+        self.entries[f"{source_name}|{item['Key']}"] = item["ETag"]
+
+    def save(self, location=None):
+        (location or self.location).put_bytes(self.key, json.dumps(self.entries, sort_keys=True).encode("utf-8"))
@@ -0,0 +1,477 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from logsources import open_location
+from backlogscheduler import PriorityScheduler, classify_priority, normalize_tags
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+ORCHESTRATOR_ROLE_NAME = os.environ.get("ORCHESTRATOR_ROLE_NAME", "iamrole-fall-organization-orchestrator")   # Role deployed in every member account by the global StackSet.
+SESSION_DURATION_SECONDS = int(os.environ.get("SESSION_DURATION_SECONDS", "3600"))                          # Duration requested for each assumed role session.
+SESSION_REFRESH_MARGIN_SECONDS = int(os.environ.get("SESSION_REFRESH_MARGIN_SECONDS", "300"))               # Sessions are renewed when they expire in less than this time.
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "64"))                                                      # Threads shared by all the accounts.
+MAX_PER_ACCOUNT = int(os.environ.get("MAX_PER_ACCOUNT", "4"))                                               # Max concurrent operations against the same account.
+METRICS_INTERVAL_SECONDS = int(os.environ.get("METRICS_INTERVAL_SECONDS", "30"))                            # Interval of the queue depth samples written to the log and the report.
+DEFERRED_MAX_ATTEMPTS = int(os.environ.get("DEFERRED_MAX_ATTEMPTS", "5"))                                   # Times a resource deferred by the rate limiter of its account is invoked again.
+DEFERRED_RETRY_SECONDS = int(os.environ.get("DEFERRED_RETRY_SECONDS", "30"))                                # Wait before invoking again a deferred resource, doubled on each attempt.
+
+LOGGING_BUCKET_PREFIX = "s3bkt-access-logging-"
+GLOBAL_REGION = "us-east-1"
+
+# FALL Lambda Function deployed by the regional StackSet for each service, the enablement is delegated to them so the
+# logic (buckets, KMS, lifecycle, rate limiter, notifications) is exactly the same one used for the new resources.
+
+FUNCTIONS = {
+    "vpc": "lambfun-fall-enable-vpc-flow-logs",
+    "elb": "lambfun-fall-enable-elb-access-logs",
+    "cloudfront": "lambfun-fall-enable-cloudfront-access-logs",
+    "s3": "lambfun-fall-enable-s3-access-logging"
+}
+
+# Status returned by the handlers in the "status" field of their response, mapped to the status of the report. Any other
+# value (e.g. the event was discarded by the classifier) is reported as skipped.
+
+HANDLER_STATUS = {
+    "success": "enabled",
+    "already-enabled": "already_enabled",
+    "excluded": "excluded",
+    "error": "failed"
+}
+
+"""
+Entry point of the organization orchestrator, executed from the central (management or delegated administrator)
+account. It assumes ORCHESTRATOR_ROLE_NAME in every member account and region and:
+
+    * "scan" lists the VPCs without Flow Logs, the Load Balancers without Access Logs, the S3 Buckets without Server
+      Access Logging and the CloudFront Distributions without a Standard Logging v2 delivery source.
+    * "enable" does the same scan and, for every resource found, invokes the FALL Lambda Function of that account and
+      region with an event equivalent to the CloudTrail one, so the resources created before FALL was deployed are
+      also covered.
+
+The STS sessions are cached and renewed before they expire, clients are pooled per account, region and service, and the
+work is executed concurrently with a cap of MAX_PER_ACCOUNT operations per account. The resources found are queued by
+priority class (see backlogscheduler.py) and the enablements are dispatched from those queues, so the internet-facing
+and production resources are enabled first. A consolidated report with the results, the throughput, the queue depth
+and the time-to-enable of each priority class is written at the end.
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan or enable FALL logging across the accounts of the organization.")
+    parser.add_argument("command", choices=["scan", "enable"])
+    parser.add_argument("--regions", nargs="+", required=True, help="Regions where the regional StackSet is deployed.")
+    parser.add_argument("--accounts", nargs="+", default=None, help="Accounts to process, by default every ACTIVE account of the organization.")
+    parser.add_argument("--exclude-accounts", nargs="+", default=[])
+    parser.add_argument("--services", nargs="+", choices=sorted(FUNCTIONS), default=sorted(FUNCTIONS))
+    parser.add_argument("--role-name", default=ORCHESTRATOR_ROLE_NAME)
+    parser.add_argument("--external-id", default=None)
+    parser.add_argument("--max-workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--max-per-account", type=int, default=MAX_PER_ACCOUNT)
+    parser.add_argument("--service-weights", nargs="+", default=[], help="Share of each service inside a priority class, e.g. elb=4 cloudfront=2 (default 1).")
+    parser.add_argument("--metrics-interval", type=int, default=METRICS_INTERVAL_SECONDS)
+    parser.add_argument("--report", default=None, help="Folder or s3://bucket/prefix where the JSON report is written.")
+    parser.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in used for the report.")
+    args = parser.parse_args(argv)
+
+    sessions = SessionManager(args.role_name, external_id=args.external_id, max_pool_connections=args.max_per_account * 2)
+    accounts = args.accounts or list_organization_accounts(sessions.base_session)
+    accounts = [account for account in accounts if account not in args.exclude_accounts]
+
+    weights = {service: 1 for service in args.services}
+    for weight in args.service_weights:
+        service, _, value = weight.partition("=")
+        if service not in FUNCTIONS or not value.isdigit() or int(value) < 1:
+            parser.error(f"Invalid service weight: {weight}")
+        weights[service] = int(value)
+
+    orchestrator = Orchestrator(sessions, args.regions, args.services, args.max_workers, args.max_per_account, weights, args.metrics_interval)
+    report = orchestrator.run(accounts, enable=args.command == "enable")
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.report:
+        key = f"fall-{args.command}-{report['started'].replace(':', '').replace('-', '')}.json"
+        open_location(args.report, args.endpoint_url).put_bytes(key, output.encode("utf-8"))
+        logger.info(f"Report written to {args.report.rstrip('/')}/{key}")
+    else:
+        print(output)
+    return 1 if report["totals"]["errors"] else 0
+
+# This function returns the ACTIVE accounts of the organization, it must be executed from the management account or
+# from a delegated administrator.
+
+def list_organization_accounts(session):
+    organizations = session.client("organizations")
+    accounts = []
+    for page in organizations.get_paginator("list_accounts").paginate():
+        accounts.extend(account["Id"] for account in page["Accounts"] if account["Status"] == "ACTIVE")
+    return accounts
+
+# Cache of the assumed role sessions and of the clients created with them. boto3 clients are thread safe but the
+# creation of clients from the same Session is not, so it is protected with a lock per account. When the credentials
+# of an account are about to expire the role is assumed again and the clients of that account are recreated.
+
+class SessionManager:
+    def __init__(self, role_name, external_id=None, duration=SESSION_DURATION_SECONDS, refresh_margin=SESSION_REFRESH_MARGIN_SECONDS, max_pool_connections=10):
+        self.role_name = role_name
+        self.external_id = external_id
+        self.duration = duration
+        self.refresh_margin = refresh_margin
+        self.config = Config(max_pool_connections=max_pool_connections, retries={"mode": "adaptive", "max_attempts": 10})
+        self.base_session = boto3.Session()
+        self.sts = self.base_session.client("sts")
+        self.central_account = self.sts.get_caller_identity()["Account"]
+        self.lock = threading.Lock()
+        self.account_locks = {}
+        self.sessions = {}
+        self.clients = {}
+        self.assumed = 0
+
+    def _account_lock(self, account_id):
+        with self.lock:
+            return self.account_locks.setdefault(account_id, threading.Lock())
+
+    # The central account uses its own credentials, the other accounts use the cached session while it is valid.
+
+    def _session(self, account_id):
+        if account_id == self.central_account:
+            return self.base_session, None
+
+        cached = self.sessions.get(account_id)
+        if cached and (cached[1] - datetime.now(timezone.utc)).total_seconds() > self.refresh_margin:
+            return cached
+
+        parameters = {
+            "RoleArn": f"arn:aws:iam::{account_id}:role/{self.role_name}",
+            "RoleSessionName": "fall-organization-orchestrator",
+            "DurationSeconds": self.duration
+        }
+        if self.external_id:
+            parameters["ExternalId"] = self.external_id
+        credentials = self.sts.assume_role(**parameters)["Credentials"]
+        session = boto3.Session(
+            aws_access_key_id=credentials["AccessKeyId"],
+            aws_secret_access_key=credentials["SecretAccessKey"],
+            aws_session_token=credentials["SessionToken"]
+        )
+        self.sessions[account_id] = (session, credentials["Expiration"])
+        self.clients[account_id] = {}
+        self.assumed += 1
+        return self.sessions[account_id]
+
+    def client(self, account_id, region, service):
+        with self._account_lock(account_id):
+            session, _ = self._session(account_id)
+            pool = self.clients.setdefault(account_id, {})
+            if (region, service) not in pool:
+                pool[(region, service)] = session.client(service, region_name=region, config=self.config)
+            return pool[(region, service)]
+
+# Scanners, each one returns the resources of the account and region where logging is not enabled. S3 and CloudFront
+# are global services, they are scanned only once per account. Each resource includes the attributes and tags used to
+# assign its priority class.
+
+def scan_vpc(sessions, account_id, region):
+    ec2 = sessions.client(account_id, region, "ec2")
+    with_flow_logs = set()
+    for page in ec2.get_paginator("describe_flow_logs").paginate(Filters=[{"Name": "resource-type", "Values": ["VPC"]}]):
+        with_flow_logs.update(flow_log["ResourceId"] for flow_log in page["FlowLogs"])
+    resources = []
+    for page in ec2.get_paginator("describe_vpcs").paginate():
+        resources.extend({
+            "id": vpc["VpcId"],
+            "region": region,
+            "attributes": {"is_default": vpc.get("IsDefault", False)},
+            "tags": normalize_tags(vpc.get("Tags"))
+        } for vpc in page["Vpcs"] if vpc["VpcId"] not in with_flow_logs)
+    return resources
+
+def scan_elb(sessions, account_id, region):
+    elbv2 = sessions.client(account_id, region, "elbv2")
+    resources = []
+    for page in elbv2.get_paginator("describe_load_balancers").paginate():
+        for load_balancer in page["LoadBalancers"]:
+            if load_balancer["Type"] not in ("application", "network"):
+                continue
+            attributes = elbv2.describe_load_balancer_attributes(LoadBalancerArn=load_balancer["LoadBalancerArn"])["Attributes"]
+            if not any(attribute["Key"] == "access_logs.s3.enabled" and attribute["Value"] == "true" for attribute in attributes):
+                resources.append({"id": load_balancer["LoadBalancerArn"], "region": region, "attributes": {"scheme": load_balancer.get("Scheme")}, "tags": {}})
+
+    # DescribeTags accepts up to 20 Load Balancers per call.
+
+    for start in range(0, len(resources), 20):
+        batch = {resource["id"]: resource for resource in resources[start:start + 20]}
+        for description in elbv2.describe_tags(ResourceArns=list(batch))["TagDescriptions"]:
+            batch[description["ResourceArn"]]["tags"] = normalize_tags(description["Tags"])
+    return resources
+
+def scan_s3(sessions, account_id, regions):
+    s3 = sessions.client(account_id, GLOBAL_REGION, "s3")
+    resources = []
+    for bucket in s3.list_buckets().get("Buckets", []):
+        name = bucket["Name"]
+        if name.startswith(LOGGING_BUCKET_PREFIX):
+            continue
+        region = s3.get_bucket_location(Bucket=name).get("LocationConstraint") or GLOBAL_REGION
+        if region not in regions:
+            continue
+        regional_s3 = sessions.client(account_id, region, "s3")
+        if "LoggingEnabled" not in regional_s3.get_bucket_logging(Bucket=name):
+            try:
+                tags = normalize_tags(regional_s3.get_bucket_tagging(Bucket=name)["TagSet"])
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "NoSuchTagSet":
+                    raise
+                tags = {}
+            resources.append({"id": name, "region": region, "attributes": {}, "tags": tags})
+    return resources
+
+def scan_cloudfront(sessions, account_id, regions):
+    cloudfront = sessions.client(account_id, GLOBAL_REGION, "cloudfront")
+    logs = sessions.client(account_id, GLOBAL_REGION, "logs")
+    with_delivery = set()
+    for page in logs.get_paginator("describe_delivery_sources").paginate():
+        for source in page["deliverySources"]:
+            with_delivery.update(source.get("resourceArns", []))
+    resources = []
+    for page in cloudfront.get_paginator("list_distributions").paginate():
+        for distribution in page.get("DistributionList", {}).get("Items", []):
+            if distribution["ARN"] not in with_delivery:
+                tags = cloudfront.list_tags_for_resource(Resource=distribution["ARN"])["Tags"].get("Items", [])
+                resources.append({
+                    "id": distribution["Id"],
+                    "region": GLOBAL_REGION,
+                    "attributes": {"enabled": distribution.get("Enabled", True)},
+                    "tags": normalize_tags(tags)
+                })
+    return resources
+
+# Event equivalent to the one delivered by EventBridge when the resource is created, it includes only the fields read
+# by the handlers. The tags are not included, so the handlers retrieve them and ExcludeLogging is still respected.
+
+def build_event(service, account_id, resource, principal):
+    region = resource["region"]
+    detail = {
+        "awsRegion": region,
+        "userIdentity": {"accountId": account_id, "arn": principal, "principalId": principal},
+        "requestParameters": {}
+    }
+    if service == "vpc":
+        detail.update({"eventSource": "ec2.amazonaws.com", "eventName": "CreateVpc", "responseElements": {"vpc": {"vpcId": resource["id"]}}})
+    elif service == "elb":
+        detail.update({"eventSource": "elasticloadbalancing.amazonaws.com", "eventName": "CreateLoadBalancer", "responseElements": {"loadBalancers": [{"loadBalancerArn": resource["id"]}]}})
+    elif service == "cloudfront":
+        detail.update({"eventSource": "cloudfront.amazonaws.com", "eventName": "CreateDistributionWithTags", "responseElements": {"distribution": {"id": resource["id"]}}})
+    else:
+        detail.update({"eventSource": "s3.amazonaws.com", "eventName": "CreateBucket", "requestParameters": {"bucketName": resource["id"]}})
+
+    return {
+        "source": "aws." + detail["eventSource"].split(".")[0],
+        "detail-type": "AWS API Call via CloudTrail",
+        "account": account_id,
+        "region": region,
+        "detail": detail
+    }
+
+class Orchestrator:
+    def __init__(self, sessions, regions, services, max_workers, max_per_account, weights=None, metrics_interval=METRICS_INTERVAL_SECONDS):
+        self.sessions = sessions
+        self.regions = regions
+        self.services = services
+        self.max_workers = max_workers
+        self.max_per_account = max_per_account
+        self.weights = weights or {service: 1 for service in services}
+        self.metrics_interval = metrics_interval
+        self.principal = sessions.sts.get_caller_identity()["Arn"]
+
+    def scan_units(self, account_id):
+        for service in self.services:
+            if service in ("s3", "cloudfront"):
+                scanner = scan_s3 if service == "s3" else scan_cloudfront
+                yield service, GLOBAL_REGION, scanner, (self.sessions, account_id, self.regions)
+            else:
+                scanner = scan_vpc if service == "vpc" else scan_elb
+                for region in self.regions:
+                    yield service, region, scanner, (self.sessions, account_id, region)
+
+    def invoke(self, service, account_id, resource):
+        if service == "cloudfront" and GLOBAL_REGION not in self.regions:
+            return "skipped", f"The CloudFront function is only deployed in {GLOBAL_REGION}"
+        client = self.sessions.client(account_id, resource["region"], "lambda")
+        response = client.invoke(
+            FunctionName=FUNCTIONS[service],
+            InvocationType="RequestResponse",
+            Payload=json.dumps(build_event(service, account_id, resource, self.principal)).encode("utf-8")
+        )
+        payload = response["Payload"].read().decode("utf-8")
+        result = json.loads(payload) if payload else None
+
+        # The rate limiter of the account raises RateLimitDeferred, in an asynchronous invocation Lambda retries the event, so
+        # here the resource is queued again.
+
+        if response.get("FunctionError"):
+            if isinstance(result, dict) and result.get("errorType") == "RateLimitDeferred":
+                return "deferred", result.get("errorMessage")
+            return "failed", result.get("errorMessage", payload) if isinstance(result, dict) else payload
+
+        status = result.get("status") if isinstance(result, dict) else None
+        if status is None:
+            return "failed", f"Unexpected response of {FUNCTIONS[service]}: {payload}"
+        if status not in HANDLER_STATUS:
+            return "skipped", f"Event {status}"
+        return HANDLER_STATUS[status], result.get("message")
+
+    # The scans and the enablements share the pool and the work is only submitted when it can run: at most max_workers
+    # operations in flight, and at most max_per_account against the same account, so no worker ever waits for a slot of
+    # a big account. The scans of the accounts are submitted in rotation and go first, because they feed the backlog.
+    # The resources found are queued by priority class and each enablement is taken from the highest class with an
+    # account that has a free slot, so a saturated account never blocks the rest of the backlog.
+
+    def run(self, accounts, enable=False):
+        started = time.time()
+        report = {
+            "started": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "command": "enable" if enable else "scan",
+            "regions": self.regions,
+            "services": self.services,
+            "accounts": {},
+            "errors": []
+        }
+        totals = {"accounts": len(accounts), "scans": 0, "missing": 0, "enabled": 0, "already_enabled": 0, "excluded": 0, "failed": 0, "skipped": 0, "deferred": 0, "errors": 0}
+        priorities = {}
+        scheduler = PriorityScheduler(self.weights)
+        in_flight = {}
+        retries = []
+        last_sample = started
+        waiting_scans = deque()
+        for account_id in accounts:
+            report["accounts"][account_id] = {}
+            waiting_scans.append((account_id, deque(self.scan_units(account_id))))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            scans = {}
+            enablements = {}
+            pending = set()
+
+            def submit(account_id, function, *args):
+                in_flight[account_id] = in_flight.get(account_id, 0) + 1
+                if in_flight[account_id] >= self.max_per_account:
+                    scheduler.block(account_id)
+                future = executor.submit(function, *args)
+                pending.add(future)
+                return future
+
+            def release(account_id):
+                in_flight[account_id] -= 1
+                scheduler.unblock(account_id)
+
+            def dispatch():
+                skipped = 0
+                while waiting_scans and skipped < len(waiting_scans) and len(scans) + len(enablements) < self.max_workers:
+                    account_id, units = waiting_scans.popleft()
+                    if in_flight.get(account_id, 0) >= self.max_per_account:
+                        waiting_scans.append((account_id, units))
+                        skipped += 1
+                        continue
+                    skipped = 0
+                    service, region, scanner, arguments = units.popleft()
+                    scans[submit(account_id, scanner, *arguments)] = (account_id, service, region)
+                    if units:
+                        waiting_scans.append((account_id, units))
+
+                while len(scans) + len(enablements) < self.max_workers:
+                    item = scheduler.pop()
+                    if item is None:
+                        break
+                    priority, service, account_id, (resource, entry, attempt), queued_at = item
+                    future = submit(account_id, self.invoke, service, account_id, resource)
+                    enablements[future] = (entry, account_id, priority, service, resource, attempt, queued_at)
+
+            dispatch()
+            while pending or retries:
+                timeout = min([self.metrics_interval] + [max(retry[0] - time.time(), 0) for retry in retries])
+                if pending:
+                    done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+                    done = set()
+                for future in done:
+                    if future in scans:
+                        account_id, service, region = scans.pop(future)
+                        release(account_id)
+                        totals["scans"] += 1
+                        try:
+                            resources = future.result()
+                        except Exception as e:
+                            totals["errors"] += 1
+                            report["errors"].append({"account": account_id, "service": service, "region": region, "error": str(e)})
+                            logger.error(f"Scan of {service} in {account_id}/{region} failed: {e}")
+                            continue
+
+                        totals["missing"] += len(resources)
+                        for resource in resources:
+                            priority = classify_priority(service, resource["attributes"], resource["tags"])
+                            entry = {"service": service, "resource": resource["id"], "priority": priority, "status": "missing"}
+                            report["accounts"][account_id].setdefault(resource["region"], []).append(entry)
+                            priorities[priority] = priorities.get(priority, 0) + 1
+                            if enable:
+                                scheduler.push(priority, service, account_id, (resource, entry, 1))
+                    else:
+                        entry, account_id, priority, service, resource, attempt, queued_at = enablements.pop(future)
+                        release(account_id)
+                        try:
+                            status, error = future.result()
+                        except Exception as e:
+                            status, error = "failed", str(e)
+                        if status == "deferred" and attempt < DEFERRED_MAX_ATTEMPTS:
+                            totals["deferred"] += 1
+                            retries.append((time.time() + DEFERRED_RETRY_SECONDS * 2 ** (attempt - 1), priority, service, account_id, (resource, entry, attempt + 1), queued_at))
+                            continue
+                        if status == "deferred":
+                            status = "failed"
+                        entry["status"] = status
+                        if error:
+                            entry["error" if status == "failed" else "detail"] = error
+                        totals[status] += 1
+                        scheduler.completed(priority, queued_at)
+
+                for retry in [retry for retry in retries if retry[0] <= time.time()]:
+                    retries.remove(retry)
+                    scheduler.push(*retry[1:])
+
+                dispatch()
+
+                if enable and time.time() - last_sample >= self.metrics_interval:
+                    last_sample = time.time()
+                    logger.info(f"Queue depth by priority: {scheduler.sample()}, enablements in flight: {len(enablements)}")
+
+        duration = time.time() - started
+        totals["errors"] += totals["failed"]
+        report["finished"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        report["duration_seconds"] = round(duration, 3)
+        report["totals"] = totals
+        report["priorities"] = priorities
+        if enable:
+            report["scheduler"] = scheduler.metrics()
+        report["throughput"] = {
+            "accounts_per_second": round(len(accounts) / duration, 3) if duration else None,
+            "scans_per_second": round(totals["scans"] / duration, 3) if duration else None,
+            "enablements_per_second": round(sum(totals[status] for status in ("enabled", "already_enabled", "excluded", "failed", "skipped")) / duration, 3) if duration else None,
+            "sessions_assumed": self.sessions.assumed
+        }
+        logger.info(f"{report['command']} finished in {duration:.1f}s: {totals}")
+        return report
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import math
+import hashlib
+import logging
+import argparse
+from datetime import datetime, timezone
+from logsources import open_location, iter_lines, is_compressed, Checkpoint
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# Retrieve the corresponding values from the Environment Variables (they can be overridden using the command line arguments)
+
+RELATIVE_ACCURACY = float(os.environ.get("RELATIVE_ACCURACY", "0.01"))  # Max relative error of the time-taken percentiles.
+TOP_EDGE_LOCATIONS = int(os.environ.get("TOP_EDGE_LOCATIONS", "10"))    # Edge locations shown in each view.
+FLUSH_OBJECTS = int(os.environ.get("FLUSH_OBJECTS", "200"))              # Objects read before their rollups are merged into the store and the checkpoint is saved.
+
+# Values of x-edge-result-type considered as served from the CloudFront cache.
+
+HIT_RESULT_TYPES = {"Hit", "RefreshHit"}
+
+"""
+Entry point of the rollup job. The "update" command reads line by line the JSON objects that CloudFront Standard Logging
+v2 delivers (outputFormat='json') in the s3bkt-access-logging-{distribution} buckets, builds per distribution and per
+minute rollups (requests, cache hits, bytes, status classes, edge locations and a mergeable sketch of time-taken) and
+merges them into the store, one file per distribution and hour:
+
+    {store}/distribution={id}/date=2025-06-18/hour=10.json
+
+Each hourly file also lists the source objects already merged into it, so an object processed again after a failure
+(e.g. the store was written but not the checkpoint) is skipped instead of being counted twice.
+
+The "view" command merges the stored minutes into minute, hour or day rows without reading the raw logs again.
+"""
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache hit ratio and latency rollups of CloudFront Standard Logging v2.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Add the newly delivered log objects to the rollup store.")
+    update.add_argument("--source", action="append", required=True, help="Logging bucket (s3://bucket) or local folder, can be repeated.")
+    update.add_argument("--store", required=True, help="Location of the rollups (s3://bucket/prefix or local folder).")
+    update.add_argument("--prefix", default="AWSLogs/", help="Only read the objects under this prefix.")
+    update.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+    update.add_argument("--flush-objects", type=int, default=FLUSH_OBJECTS)
+
+    view = commands.add_parser("view", help="Print the merged rollups of a distribution.")
+    view.add_argument("--store", required=True, help="Location of the rollups (s3://bucket/prefix or local folder).")
+    view.add_argument("--distribution", required=True)
+    view.add_argument("--date", required=True, help="Day to show (YYYY-MM-DD).")
+    view.add_argument("--granularity", choices=("minute", "hour", "day"), default="hour")
+    view.add_argument("--endpoint-url", default=None, help="Endpoint of a local S3 stand-in (MinIO, LocalStack).")
+
+    args = parser.parse_args(argv)
+    store = open_location(args.store, args.endpoint_url)
+
+    if args.command == "update":
+        update_rollups(args.source, store, args.prefix, args.endpoint_url, args.flush_objects)
+    else:
+        for row in view_rollups(store, args.distribution, args.date, args.granularity):
+            print(json.dumps(row))
+    return 0
+
+# Log-bucketed quantile sketch (DDSketch), each value is counted in the bucket ceil(log_gamma(value)) so the relative
+# error of any percentile is bounded by relative_accuracy, and two sketches are merged by adding their buckets.
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, bins=None, zero_count=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = bins or {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value):
+        if value <= 1e-9:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def merge(self, other):
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        return self
+
+    def quantile(self, q):
+        count = self.count
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count, "bins": {str(key): count for key, count in self.bins.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["relative_accuracy"], {int(key): count for key, count in data["bins"].items()}, data["zero_count"])
+
+# Rollup of one distribution during one minute (or the merge of several minutes).
+
+class Rollup:
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.bytes = 0
+        self.status = {}
+        self.edge_locations = {}
+        self.time_taken = QuantileSketch()
+
+    def add(self, record):
+        self.requests += 1
+        if record.get("x-edge-result-type") in HIT_RESULT_TYPES:
+            self.hits += 1
+        self.bytes += to_int(record.get("sc-bytes"))
+        status_class = f"{str(record.get('sc-status', '-'))[:1]}xx"
+        self.status[status_class] = self.status.get(status_class, 0) + 1
+        edge_location = record.get("x-edge-location", "-")
+        self.edge_locations[edge_location] = self.edge_locations.get(edge_location, 0) + 1
+        time_taken = to_float(record.get("time-taken"))
+        if time_taken is not None:
+            self.time_taken.add(time_taken * 1000)
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.hits += other.hits
+        self.bytes += other.bytes
+        for status_class, count in other.status.items():
+            self.status[status_class] = self.status.get(status_class, 0) + count
+        for edge_location, count in other.edge_locations.items():
+            self.edge_locations[edge_location] = self.edge_locations.get(edge_location, 0) + count
+        self.time_taken.merge(other.time_taken)
+        return self
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "bytes": self.bytes,
+            "status": self.status,
+            "edge_locations": self.edge_locations,
+            "time_taken": self.time_taken.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        rollup = cls()
+        rollup.requests = data["requests"]
+        rollup.hits = data["hits"]
+        rollup.bytes = data["bytes"]
+        rollup.status = data["status"]
+        rollup.edge_locations = data["edge_locations"]
+        rollup.time_taken = QuantileSketch.from_dict(data["time_taken"])
+        return rollup
+
+    def report(self):
+        top_edges = sorted(self.edge_locations.items(), key=lambda entry: entry[1], reverse=True)[:TOP_EDGE_LOCATIONS]
+        return {
+            "requests": self.requests,
+            "cache_hit_ratio": round(self.hits / self.requests, 4) if self.requests else None,
+            "bytes": self.bytes,
+            "status": self.status,
+            "edge_locations": dict(top_edges),
+            "time_taken_ms": {
+                "p50": round_or_none(self.time_taken.quantile(0.5)),
+                "p90": round_or_none(self.time_taken.quantile(0.9)),
+                "p99": round_or_none(self.time_taken.quantile(0.99))
+            }
+        }
+
+# This function builds the minute rollups of the new objects, kept apart per source object, and every FLUSH_OBJECTS
+# objects merges them into the hourly files and saves the checkpoint, so the memory used does not depend on the backlog.
+# Only the objects not listed in an hourly file are merged into it, the checkpoint only avoids reading them again.
+# CloudFront delivers Parquet objects when outputFormat is parquet, this job only reads the JSON ones and logs the rest.
+
+def update_rollups(sources, store, prefix, endpoint_url, flush_objects=FLUSH_OBJECTS):
+    checkpoint = Checkpoint(store, "_checkpoint/cloudfront.json")
+    pending = {}
+    batch_objects = 0
+    new_objects = 0
+    skipped = 0
+    written = 0
+
+    for source_uri in sources:
+        source = open_location(source_uri, endpoint_url)
+        for item in source.list_objects(prefix):
+            if checkpoint.is_processed(source.name, item):
+                continue
+            if item["Key"].endswith(".parquet"):
+                logger.warning(f"Skipping {item['Key']}, only the JSON output format is supported.")
+                checkpoint.mark_processed(source.name, item)
+                skipped += 1
+                continue
+            source_id = hashlib.sha1(f"{source.name}|{item['Key']}|{item['ETag']}".encode("utf-8")).hexdigest()[:20]
+            stream = source.open_object(item["Key"])
+            try:
+                for line in iter_lines(stream, compressed=is_compressed(item["Key"])):
+                    add_record(pending, source_id, line)
+            finally:
+                stream.close()
+            checkpoint.mark_processed(source.name, item)
+            new_objects += 1
+            batch_objects += 1
+
+            if batch_objects >= flush_objects:
+                written += flush(store, pending, checkpoint)
+                batch_objects = 0
+
+    written += flush(store, pending, checkpoint)
+    logger.info(f"Rollups updated: {new_objects} new objects, {skipped} Parquet objects skipped, {written} hourly files written.")
+
+def flush(store, pending, checkpoint):
+    written = 0
+    for (distribution_id, date, hour), objects in pending.items():
+        key = f"distribution={distribution_id}/date={date}/hour={hour}.json"
+        stored = load_hour(store, key)
+        merged = set(stored["sources"])
+        new_sources = [source_id for source_id in objects if source_id not in merged]
+        if not new_sources:
+            continue
+        for source_id in new_sources:
+            for minute, rollup in objects[source_id].items():
+                if minute in stored["minutes"]:
+                    rollup.merge(Rollup.from_dict(stored["minutes"][minute]))
+                stored["minutes"][minute] = rollup.to_dict()
+        stored["sources"] = sorted(merged.union(new_sources))
+        store.put_bytes(key, json.dumps(stored, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+        written += 1
+
+    pending.clear()
+    checkpoint.save()
+    return written
+
+# Hourly files written by the previous versions only contain the minutes, they are read as a file without sources.
+
+def load_hour(store, key):
+    if not store.exists(key):
+        return {"sources": [], "minutes": {}}
+    stored = json.loads(store.get_bytes(key).decode("utf-8"))
+    if "minutes" not in stored:
+        return {"sources": [], "minutes": stored}
+    return stored
+
+def add_record(pending, source_id, line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return
+    minute = record_minute(record)
+    if minute is None:
+        return
+    distribution_id = record.get("DistributionId") or record.get("distribution-id") or "unknown"
+    minutes = pending.setdefault((distribution_id, minute[:10], minute[11:13]), {}).setdefault(source_id, {})
+    minutes.setdefault(minute, Rollup()).add(record)
+
+# The minute of a record is taken from the date and time fields, or from the timestamp (epoch) when they are not selected.
+
+def record_minute(record):
+    if record.get("date") and record.get("time"):
+        return f"{record['date']}T{record['time'][:5]}"
+    timestamp = to_float(record.get("timestamp") or record.get("timestamp(ms)"))
+    if timestamp is None:
+        return None
+    if timestamp > 1e11:
+        timestamp /= 1000
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M")
+
+# Here we read only the hourly files of the requested day and merge their minutes according to the granularity.
+
+def view_rollups(store, distribution_id, date, granularity):
+    merged = {}
+    for hour in range(24):
+        key = f"distribution={distribution_id}/date={date}/hour={hour:02d}.json"
+        for minute, data in load_hour(store, key)["minutes"].items():
+            period = {"minute": minute, "hour": minute[:13], "day": minute[:10]}[granularity]
+            rollup = Rollup.from_dict(data)
+            if period in merged:
+                merged[period].merge(rollup)
+            else:
+                merged[period] = rollup
+
+    for period in sorted(merged):
+        yield {"distribution": distribution_id, "period": period, **merged[period].report()}
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def round_or_none(value):
+    return None if value is None else round(value, 2)
+
+if __name__ == "__main__":
+    sys.exit(main())